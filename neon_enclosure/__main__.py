@@ -26,39 +26,62 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from signal import signal, SIGUSR2
+from typing import Optional
 from neon_utils.log_utils import init_log
-from neon_utils.process_utils import start_malloc, snapshot_malloc, print_malloc
 from neon_utils.signal_utils import init_signal_bus, init_signal_handlers
-from ovos_bus_client.util import get_mycroft_bus
 from ovos_utils.process_utils import reset_sigint_handler, PIDLock
-from ovos_utils.log import LOG
 from ovos_utils import wait_for_exit_signal
 
+from neon_enclosure.memory import init_memory_profiler
+from neon_enclosure.messagebus import get_resilient_bus
+from neon_enclosure.profiling import StartupTimeline
 from neon_enclosure.service import NeonHardwareAbstractionLayer
 
 
-def main(*args, **kwargs):
+def start_service(*args, timeline: Optional[StartupTimeline] = None,
+                  standalone: bool = True,
+                  **kwargs) -> NeonHardwareAbstractionLayer:
+    """
+    Initialize and start the Enclosure service, recording each startup phase.
+    :param timeline: StartupTimeline to record phases to
+    :param standalone: if False, skip process setup (signal handlers and PID
+        lock) so the service can run alongside a running instance
+    :returns: started NeonHardwareAbstractionLayer
+    """
+    timeline = timeline or StartupTimeline()
     kwargs.setdefault("skill_id", "neon.phal")
-    init_log(log_name="enclosure")
-    malloc_running = start_malloc(stack_depth=4)
+    with timeline.phase("init_log"):
+        init_log(log_name="enclosure")
+    with timeline.phase("memory_profiler"):
+        if "memory_profiler" not in kwargs:
+            kwargs["memory_profiler"] = init_memory_profiler("enclosure")
 
-    if "bus" not in kwargs:
-        bus = get_mycroft_bus()
-        kwargs["bus"] = bus
-    else:
-        bus = kwargs["bus"]
-    init_signal_bus(bus)
-    init_signal_handlers()
-    reset_sigint_handler()
-    PIDLock('enclosure')
-    service = NeonHardwareAbstractionLayer(*args, **kwargs)
+    with timeline.phase("connect_bus"):
+        if "bus" not in kwargs:
+            bus = get_resilient_bus()
+            kwargs["bus"] = bus
+        else:
+            bus = kwargs["bus"]
+    if standalone:
+        with timeline.phase("signal_handlers"):
+            init_signal_bus(bus)
+            init_signal_handlers()
+            reset_sigint_handler()
+            signal(SIGUSR2, kwargs["memory_profiler"].toggle)
+        with timeline.phase("pid_lock"):
+            PIDLock('enclosure')
+    with timeline.phase("construct"):
+        service = NeonHardwareAbstractionLayer(*args, timeline=timeline,
+                                               **kwargs)
     service.start()
+    return service
+
+
+def main(*args, **kwargs):
+    service = start_service(*args, **kwargs)
     wait_for_exit_signal()
-    if malloc_running:
-        try:
-            print_malloc(snapshot_malloc())
-        except Exception as e:
-            LOG.error(e)
+    service.memory_profiler.stop()
     service.shutdown()
 
 
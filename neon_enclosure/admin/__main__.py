@@ -26,39 +26,37 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from signal import signal, SIGUSR2
 from neon_utils.log_utils import init_log
-from neon_utils.process_utils import start_malloc, snapshot_malloc, print_malloc
 from neon_utils.signal_utils import init_signal_bus, init_signal_handlers
-from ovos_utils.messagebus import get_mycroft_bus
 from ovos_utils.process_utils import reset_sigint_handler, PIDLock
 from ovos_utils import wait_for_exit_signal
-from ovos_utils.log import LOG
 
+from neon_enclosure.memory import init_memory_profiler
+from neon_enclosure.messagebus import get_resilient_bus
 from neon_enclosure.admin.service import NeonAdminHardwareAbstractionLayer
 
 
 def main(*args, **kwargs):
     kwargs.setdefault("skill_id", "neon.phal_admin")
     init_log(log_name="admin")
-    malloc_running = start_malloc(stack_depth=4)
+    if "memory_profiler" not in kwargs:
+        kwargs["memory_profiler"] = init_memory_profiler("admin")
 
     if "bus" not in kwargs:
-        bus = get_mycroft_bus()
+        bus = get_resilient_bus()
         kwargs["bus"] = bus
     else:
         bus = kwargs["bus"]
     init_signal_bus(bus)
     init_signal_handlers()
     reset_sigint_handler()
+    signal(SIGUSR2, kwargs["memory_profiler"].toggle)
     PIDLock('admin')
     service = NeonAdminHardwareAbstractionLayer(*args, **kwargs)
     service.start()
     wait_for_exit_signal()
-    if malloc_running:
-        try:
-            print_malloc(snapshot_malloc())
-        except Exception as e:
-            LOG.error(e)
+    service.memory_profiler.stop()
     service.shutdown()
 
 
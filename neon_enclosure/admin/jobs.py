@@ -0,0 +1,279 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import shlex
+
+from collections import deque
+from itertools import count
+from os import killpg
+from signal import SIGKILL, SIGTERM
+from subprocess import PIPE, Popen, TimeoutExpired
+from threading import Condition, Lock, Thread
+from time import time
+from typing import Callable, Deque, Dict, List, Optional
+
+from ovos_utils.log import LOG
+
+JOB_STATES = ("queued", "running", "completed", "failed", "timed_out",
+              "cancelled")
+
+
+class _Job:
+    __slots__ = ("job_id", "name", "command", "timeout", "state", "requests",
+                 "queued", "started", "finished", "returncode", "process")
+
+    def __init__(self, job_id: str, name: str, command: List[str],
+                 timeout: float):
+        self.job_id = job_id
+        self.name = name
+        self.command = command
+        self.timeout = timeout
+        self.state = "queued"
+        self.requests = 1
+        self.queued = time()
+        self.started = None
+        self.finished = None
+        self.returncode = None
+        self.process: Optional[Popen] = None
+
+    def as_dict(self) -> dict:
+        # Command output is only logged; job dicts are sent on the bus
+        return {"job_id": self.job_id, "job": self.name,
+                "state": self.state, "requests": self.requests,
+                "queued": self.queued, "started": self.started,
+                "finished": self.finished, "returncode": self.returncode}
+
+
+def _parse_commands(commands: dict) -> Dict[str, dict]:
+    parsed = dict()
+    for name, spec in (commands or {}).items():
+        if not isinstance(spec, dict):
+            spec = {"command": spec}
+        command = spec.get("command")
+        if isinstance(command, str):
+            command = shlex.split(command)
+        if not command:
+            LOG.error(f"No command configured for job: {name}")
+            continue
+        parsed[name] = {"command": [str(arg) for arg in command],
+                        "timeout": spec.get("timeout")}
+    return parsed
+
+
+class JobQueue:
+    """
+    Runs configured privileged commands on a pool of threads so slow commands
+    do not block other requests. Only commands named in `commands` may be run.
+    A request for a command that is already queued is merged with the queued
+    job; a command is never run concurrently with itself.
+    """
+    def __init__(self, commands: dict,
+                 on_complete: Optional[Callable[[dict], None]] = None,
+                 max_workers: int = 2, default_timeout: float = 60,
+                 history: int = 50):
+        """
+        :param commands: dict of job name to command (argv list or string) or
+            dict with `command` and optional `timeout` in seconds
+        :param on_complete: called with the job dict when a job finishes
+        :param max_workers: max number of commands to run concurrently
+        :param default_timeout: seconds a command may run before it is killed
+        :param history: number of finished jobs to keep
+        """
+        self.commands = _parse_commands(commands)
+        self.on_complete = on_complete
+        self.default_timeout = default_timeout
+        self._queued: Deque[_Job] = deque()
+        self._running: Dict[str, _Job] = dict()
+        self._finished: Deque[_Job] = deque(maxlen=max(history, 0))
+        self._ids = count(1)
+        self._lock = Lock()
+        self._work = Condition(self._lock)
+        self._stopping = False
+        self._threads: List[Thread] = list()
+        for i in range(max(max_workers, 1)):
+            thread = Thread(target=self._run, name=f"phal_admin_job_{i}",
+                            daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, name: str) -> dict:
+        """
+        Queue a configured job.
+        :param name: name of the job to run
+        :returns: dict of the queued job; `requests` is greater than 1 if the
+            request was merged with an already queued job
+        """
+        if name not in self.commands:
+            raise KeyError(f"Unknown job: {name}")
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("Job queue is stopped")
+            for job in self._queued:
+                if job.name == name:
+                    job.requests += 1
+                    LOG.debug(f"Merged request for job: {name}")
+                    return job.as_dict()
+            spec = self.commands[name]
+            job = _Job(str(next(self._ids)), name, spec["command"],
+                       spec["timeout"] or self.default_timeout)
+            self._queued.append(job)
+            self._work.notify()
+            return job.as_dict()
+
+    def _next_job(self) -> Optional[_Job]:
+        for job in self._queued:
+            if job.name not in self._running:
+                self._queued.remove(job)
+                return job
+        return None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                job = None
+                while not self._stopping:
+                    job = self._next_job()
+                    if job:
+                        break
+                    self._work.wait()
+                if not job:
+                    return
+                job.state = "running"
+                job.started = time()
+                self._running[job.name] = job
+            self._execute(job)
+            with self._lock:
+                self._running.pop(job.name, None)
+                self._finished.append(job)
+                # A merged job may be waiting on this one
+                self._work.notify_all()
+            LOG.info(f"Job {job.name} ({job.job_id}) {job.state} in "
+                     f"{round(job.finished - job.started, 3)}s")
+            if self.on_complete:
+                try:
+                    self.on_complete(job.as_dict())
+                except Exception as e:
+                    LOG.exception(e)
+
+    def _execute(self, job: _Job):
+        try:
+            # New session so a timeout kills any children of the command
+            job.process = Popen(job.command, stdout=PIPE, stderr=PIPE,
+                                text=True, start_new_session=True)
+        except OSError as e:
+            job.state = "failed"
+            job.finished = time()
+            LOG.error(f"Job {job.name} ({job.job_id}) failed to start: {e}")
+            return
+        try:
+            stdout, stderr = job.process.communicate(timeout=job.timeout)
+        except TimeoutExpired:
+            stdout, stderr = self._kill(job.process)
+            job.state = "timed_out"
+        else:
+            if job.process.returncode == 0:
+                job.state = "completed"
+            elif self._stopping and job.process.returncode < 0:
+                # Terminated by `shutdown`
+                job.state = "cancelled"
+            else:
+                job.state = "failed"
+        job.returncode = job.process.returncode
+        job.process = None
+        job.finished = time()
+        if stdout:
+            LOG.info(f"Job {job.name} ({job.job_id}) stdout:\n{stdout}")
+        if stderr:
+            LOG.info(f"Job {job.name} ({job.job_id}) stderr:\n{stderr}")
+
+    @staticmethod
+    def _kill(process: Popen, timeout: float = 5):
+        for sig in (SIGTERM, SIGKILL):
+            try:
+                killpg(process.pid, sig)
+            except OSError:
+                pass
+            try:
+                return process.communicate(timeout=timeout)
+            except TimeoutExpired:
+                continue
+        return "", ""
+
+    def get_jobs(self, job_id: Optional[str] = None) -> List[dict]:
+        """
+        :param job_id: only return this job
+        :returns: list of queued, running, and recently finished jobs
+        """
+        with self._lock:
+            jobs = list(self._finished) + list(self._running.values()) + \
+                list(self._queued)
+        return [job.as_dict() for job in jobs
+                if job_id is None or job.job_id == job_id]
+
+    def shutdown(self, timeout: float = 5):
+        """
+        Cancel queued jobs and stop running commands.
+        :param timeout: seconds to wait for each worker to stop
+        """
+        with self._lock:
+            self._stopping = True
+            cancelled = list(self._queued)
+            self._queued.clear()
+            running = [job.process for job in self._running.values()
+                       if job.process]
+            self._work.notify_all()
+        for job in cancelled:
+            job.state = "cancelled"
+            job.finished = time()
+            self._finished.append(job)
+        for process in running:
+            try:
+                killpg(process.pid, SIGTERM)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def request_job(bus, job: str, timeout: float = 5) -> dict:
+    """
+    Queue a configured admin job from a plugin or another service. Completion
+    is emitted as `neon.phal.admin.job_completed` with the returned `job_id`.
+    :param bus: messagebus client (i.e. a plugin's `bus`)
+    :param job: name of a job in the admin `jobs` configuration
+    :param timeout: seconds to wait for the admin service to respond
+    :returns: dict of the queued job
+    """
+    from ovos_bus_client.message import Message
+    resp = bus.wait_for_response(Message("neon.phal.admin.run_job",
+                                         {"job": job}), timeout=timeout)
+    if not resp:
+        raise TimeoutError("No response from the admin service")
+    if resp.data.get("error"):
+        raise ValueError(resp.data["error"])
+    return resp.data["job"]
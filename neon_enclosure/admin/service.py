@@ -27,16 +27,34 @@
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from threading import Event
+from typing import Optional
 from ovos_PHAL import AdminPHAL
+from ovos_bus_client.message import Message
 from ovos_utils.log import LOG
 
+from neon_enclosure.admin.jobs import JobQueue
+from neon_enclosure.loader import shutdown_plugins
+from neon_enclosure.memory import MemoryProfiler, get_plugin_paths
+
 
 class NeonAdminHardwareAbstractionLayer(AdminPHAL):
-    def __init__(self, skill_id="neon.phal_admin", **kwargs):
+    def __init__(self, skill_id="neon.phal_admin",
+                 memory_profiler: Optional[MemoryProfiler] = None, **kwargs):
         LOG.info(f"Initializing Admin PHAL")
         AdminPHAL.__init__(self, skill_id=skill_id, **kwargs)
         self.status.set_alive()
         self.started = Event()
+        self.shutdown_report = dict()
+        self.memory_profiler = memory_profiler or MemoryProfiler()
+        self.memory_profiler.bind(self.bus, "neon.phal.admin")
+        jobs_config = self.admin_config.get("jobs") or {}
+        self.job_queue = JobQueue(jobs_config.get("commands") or {},
+                                  self._on_job_complete,
+                                  jobs_config.get("workers", 2),
+                                  jobs_config.get("timeout", 60),
+                                  jobs_config.get("history", 50))
+        self.bus.on("neon.phal.admin.run_job", self.handle_run_job)
+        self.bus.on("neon.phal.admin.get_jobs", self.handle_get_jobs)
 
     @property
     def config(self):
@@ -47,20 +65,43 @@ class NeonAdminHardwareAbstractionLayer(AdminPHAL):
     def start(self):
         LOG.info("Starting Admin PHAL")
         AdminPHAL.start(self)
+        self.memory_profiler.plugin_paths.update(
+            get_plugin_paths(self.drivers))
         LOG.info("Started Admin PHAL")
         self.started.set()
 
+    def handle_run_job(self, message: Message):
+        """
+        Queue a configured job by name. Completion is emitted as
+        `neon.phal.admin.job_completed`.
+        """
+        try:
+            job = self.job_queue.submit(message.data.get("job"))
+        except (KeyError, RuntimeError) as e:
+            LOG.warning(f"Job not queued: {e}")
+            self.bus.emit(message.response({"error": str(e)}))
+            return
+        self.bus.emit(message.response({"job": job}))
+
+    def handle_get_jobs(self, message: Message):
+        self.bus.emit(message.response(
+            {"jobs": self.job_queue.get_jobs(message.data.get("job_id"))}))
+
+    def _on_job_complete(self, job: dict):
+        self.bus.emit(Message("neon.phal.admin.job_completed", job))
+
     def shutdown(self):
+        self.job_queue.shutdown()
         try:
             AdminPHAL.shutdown(self)
         except Exception as e:
             LOG.exception(e)
         # TODO: Below should be implemented in ovos-PHAL directly
-        for service, clazz in self.drivers.items():
-            try:
-                if hasattr(clazz, 'shutdown'):
-                    LOG.debug(f"Shutting Down {service}")
-                    clazz.shutdown()
-            except Exception as e:
-                LOG.error(f"Error shutting down {service}: {e}")
-            del clazz
+        timeouts = {name: self.admin_config[name]["shutdown_timeout"]
+                    for name in self.drivers
+                    if isinstance(self.admin_config.get(name), dict) and
+                    "shutdown_timeout" in self.admin_config[name]}
+        self.shutdown_report = shutdown_plugins(
+            self.drivers, timeouts,
+            self.admin_config.get("plugin_shutdown_timeout", 10),
+            self.admin_config.get("shutdown_timeout", 30))
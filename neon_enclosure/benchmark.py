@@ -0,0 +1,302 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from random import choices
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Sequence
+from uuid import uuid4
+
+from ovos_bus_client.message import Message
+from ovos_utils.log import LOG
+
+from neon_enclosure.metrics import format_table
+from neon_enclosure.service import NeonHardwareAbstractionLayer
+
+# Defaults for the benchmarked service so it does not read the system PHAL
+# configuration or persist plugin state
+BENCHMARK_CONFIG = {"state_snapshots": False,
+                    "hot_reload": False}
+
+# Result keys compared to a baseline and whether higher values are better
+BENCHMARK_METRICS = {"construct": False,
+                     "start_to_ready": False,
+                     "shutdown": False,
+                     "throughput": True,
+                     "latency.p50": False,
+                     "latency.p95": False,
+                     "latency.p99": False}
+
+
+def make_synthetic_plugin(index: int, handler_time: float = 0) -> type:
+    """
+    Build a PHAL plugin class that responds to `bench.plugin<index>.request`.
+    :param index: plugin index used in its message type
+    :param handler_time: seconds each handler call sleeps for
+    :returns: plugin class
+    """
+    msg_type = f"bench.plugin{index}.request"
+
+    class SyntheticPlugin:
+        def __init__(self, bus, config):
+            self.bus = bus
+            self.bus.on(msg_type, self.on_request)
+
+        def on_request(self, message: Message):
+            if handler_time:
+                sleep(handler_time)
+            self.bus.emit(message.response({"plugin": index}))
+
+        def shutdown(self):
+            self.bus.remove(msg_type, self.on_request)
+
+    SyntheticPlugin.__name__ = f"SyntheticPlugin{index}"
+    return SyntheticPlugin
+
+
+class BenchmarkService(NeonHardwareAbstractionLayer):
+    """
+    Enclosure service that loads the specified plugins instead of installed
+    plugins and does not persist its startup timeline.
+    """
+    def __init__(self, plugins: Dict[str, type], **kwargs):
+        self._bench_plugins = plugins
+        NeonHardwareAbstractionLayer.__init__(self, **kwargs)
+
+    def get_enabled_plugins(self) -> dict:
+        return {name: (plug, self.user_config.get(name) or {})
+                for name, plug in self._bench_plugins.items()}
+
+    def publish_startup_timeline(self):
+        pass
+
+
+def get_percentiles(values: Sequence[float],
+                    pcts: Sequence[int] = (50, 95, 99)) -> Dict[str, float]:
+    """
+    :param values: sample values
+    :param pcts: percentiles to compute
+    :returns: dict of `p<pct>` to nearest-rank percentile value
+    """
+    values = sorted(values)
+    if not values:
+        return {f"p{pct}": 0.0 for pct in pcts}
+    return {f"p{pct}": values[min(len(values) - 1,
+                                  max(int(len(values) * pct / 100 + 0.5) - 1,
+                                      0))]
+            for pct in pcts}
+
+
+def run_load(bus, message_types: Dict[str, float], count: int = 0,
+             duration: float = 10, rate: float = 0, concurrency: int = 4,
+             timeout: float = 5, data: Optional[dict] = None) -> dict:
+    """
+    Emit request messages and measure the latency of their responses.
+    :param bus: MessageBusClient (or FakeBus) to send requests with
+    :param message_types: dict of message type to relative weight
+    :param count: total requests to send; if 0, send for `duration` seconds
+    :param duration: seconds to send requests for if `count` is 0
+    :param rate: max total requests per second; 0 is unlimited
+    :param concurrency: number of requests awaiting responses at once
+    :param timeout: seconds to wait for each response
+    :param data: data to include in each request
+    :returns: dict of `sent`, `received` and `dropped` counts, `throughput`
+        (responses per second), `latency` percentiles (seconds) and the same
+        counts and percentiles `by_type`
+    """
+    pending: Dict[str, tuple] = dict()
+    latencies: Dict[str, List[float]] = {t: list() for t in message_types}
+    sent = {t: 0 for t in message_types}
+    dropped = {t: 0 for t in message_types}
+    lock = Lock()
+    msg_types = list(message_types.keys())
+    weights = list(message_types.values())
+
+    def _on_response(message: Message):
+        with lock:
+            request = pending.pop(message.context.get("bench_id"), None)
+        if request:
+            latencies[request[2]].append(monotonic() - request[0])
+            request[1].set()
+
+    def _worker(interval: float, stop_time: float):
+        next_send = monotonic()
+        while True:
+            if interval:
+                sleep(max(next_send - monotonic(), 0))
+                next_send += interval
+            if monotonic() >= stop_time:
+                return
+            msg_type = choices(msg_types, weights)[0]
+            with lock:
+                if count and sum(sent.values()) >= count:
+                    return
+                sent[msg_type] += 1
+            bench_id = str(uuid4())
+            received = Event()
+            with lock:
+                pending[bench_id] = (monotonic(), received, msg_type)
+            bus.emit(Message(msg_type, dict(data or {}),
+                             {"bench_id": bench_id}))
+            if not received.wait(timeout):
+                with lock:
+                    if pending.pop(bench_id, None):
+                        dropped[msg_type] += 1
+
+    concurrency = max(concurrency, 1)
+    for msg_type in msg_types:
+        bus.on(f"{msg_type}.response", _on_response)
+    start = monotonic()
+    stop_time = start + (duration if not count else float("inf"))
+    threads = [Thread(target=_worker, name=f"bench_{i}", daemon=True,
+                      args=(concurrency / rate if rate else 0, stop_time))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = monotonic() - start
+    for msg_type in msg_types:
+        bus.remove(f"{msg_type}.response", _on_response)
+    all_latencies = [v for values in latencies.values() for v in values]
+    return {"sent": sum(sent.values()), "received": len(all_latencies),
+            "dropped": sum(dropped.values()), "duration": elapsed,
+            "throughput": len(all_latencies) / elapsed if elapsed else 0.0,
+            "latency": get_percentiles(all_latencies),
+            "by_type": {t: {"sent": sent[t], "received": len(latencies[t]),
+                            "dropped": dropped[t],
+                            "latency": get_percentiles(latencies[t])}
+                        for t in msg_types}}
+
+
+def format_load_report(results: dict) -> str:
+    """
+    Format `run_load` results as text.
+    :param results: dict returned by `run_load`
+    :returns: multi-line string report
+    """
+    sent = results["sent"]
+    lines = [f"Sent {sent} requests in {results['duration']:.1f}s",
+             f"throughput: {results['throughput']:.1f} responses/s",
+             "latency: " + ", ".join(f"{pct} {1000 * value:.2f} ms" for
+                                     pct, value in results["latency"].items()),
+             f"dropped replies: {results['dropped']} "
+             f"({100 * results['dropped'] / sent if sent else 0:.1f}%)", ""]
+    rows = [("message", "sent", "received", "dropped", "p50 ms", "p95 ms",
+             "p99 ms")]
+    for msg_type, stats in sorted(results["by_type"].items()):
+        rows.append((msg_type, str(stats["sent"]), str(stats["received"]),
+                     str(stats["dropped"]),
+                     *(f"{1000 * v:.2f}" for v in stats["latency"].values())))
+    return "\n".join(lines) + format_table(rows)
+
+
+def run_benchmark(plugin_count: int = 10, messages: int = 1000,
+                  concurrency: int = 4, handler_time: float = 0,
+                  config: Optional[dict] = None) -> dict:
+    """
+    Benchmark the enclosure service lifecycle and message handling with
+    synthetic plugins on a FakeBus.
+    :param plugin_count: number of synthetic plugins to load
+    :param messages: number of request messages to send
+    :param concurrency: number of requests awaiting responses at once
+    :param handler_time: seconds each plugin handler call takes
+    :param config: PHAL configuration for the service, applied over
+        `BENCHMARK_CONFIG`
+    :returns: dict of lifecycle timings (seconds) and load results
+    """
+    from ovos_utils.messagebus import FakeBus
+    plugins = {f"bench-plugin-{i}": make_synthetic_plugin(i, handler_time)
+               for i in range(plugin_count)}
+    bus = FakeBus()
+    ready = Event()
+    start = monotonic()
+    service = BenchmarkService(plugins, bus=bus,
+                               config={**BENCHMARK_CONFIG, **(config or {})},
+                               ready_hook=ready.set)
+    construct = monotonic() - start
+    start = monotonic()
+    service.start()
+    ready.wait()
+    start_to_ready = monotonic() - start
+    load = run_load(bus, {f"bench.plugin{i}.request": 1
+                          for i in range(plugin_count)},
+                    count=messages, concurrency=concurrency)
+    start = monotonic()
+    service.shutdown()
+    shutdown = monotonic() - start
+    return {"plugins": plugin_count, "construct": construct,
+            "start_to_ready": start_to_ready, "shutdown": shutdown, **load}
+
+
+def _get_metric(results: dict, key: str) -> Optional[float]:
+    for part in key.split('.'):
+        if not isinstance(results, dict):
+            return None
+        results = results.get(part)
+    return results
+
+
+def compare_to_baseline(results: dict, baseline: dict,
+                        threshold: float = 0.25,
+                        min_delta: float = 0.005) -> List[str]:
+    """
+    Compare benchmark results to a baseline.
+    :param results: dict returned by `run_benchmark`
+    :param baseline: previous results to compare to
+    :param threshold: max allowed relative regression (0.25 is 25% worse)
+    :param min_delta: ignore timing regressions smaller than this (seconds)
+    :returns: list of descriptions of metrics that regressed
+    """
+    regressions = list()
+    for key, higher_is_better in BENCHMARK_METRICS.items():
+        value = _get_metric(results, key)
+        base = _get_metric(baseline, key)
+        if not base or value is None:
+            continue
+        delta = base - value if higher_is_better else value - base
+        if not higher_is_better and delta < min_delta:
+            continue
+        if delta / base > threshold:
+            regressions.append(f"{key}: {base:.6g} -> {value:.6g} "
+                               f"({delta / base:+.0%})")
+    if regressions:
+        LOG.warning(f"Benchmark regressions: {regressions}")
+    return regressions
+
+
+def save_results(results: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
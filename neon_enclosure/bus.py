@@ -0,0 +1,212 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from itertools import count
+from time import monotonic, thread_time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ovos_bus_client.message import Message
+
+from neon_enclosure.coalesce import EmitCoalescer
+from neon_enclosure.cpu import plugin_context
+from neon_enclosure.executor import HandlerExecutor
+from neon_enclosure.metrics import HandlerMetrics
+from neon_enclosure.tracing import MessageTracer
+
+
+class PluginBus:
+    """
+    Proxy to a MessageBusClient that keeps track of the handlers registered
+    by a single plugin so they can be dispatched to or removed as a group.
+    Threads started by handlers are attributed to the plugin. If `metrics` is
+    provided, handler calls are timed. If `executor` is
+    provided, handlers are queued to it instead of called on the bus thread.
+    If `coalescer` is provided, emitted messages it has rules for are passed
+    to it. If `tracer` is provided, sampled handled and emitted messages are
+    traced.
+    """
+    def __init__(self, bus, name: str = "",
+                 metrics: Optional[HandlerMetrics] = None,
+                 executor: Optional[HandlerExecutor] = None,
+                 coalescer: Optional[EmitCoalescer] = None,
+                 tracer: Optional[MessageTracer] = None):
+        self._bus = bus
+        self.name = name
+        self.metrics = metrics
+        self.executor = executor
+        self.coalescer = coalescer
+        self.tracer = tracer
+        self.last_used = monotonic()
+        self._active: Dict[int, float] = dict()
+        self._call_ids = count()
+        self._handlers: Dict[str, List[Tuple[Callable, Callable]]] = dict()
+        self._held: Optional[List[Tuple[str, str, Callable]]] = None
+
+    def __getattr__(self, item):
+        return getattr(self._bus, item)
+
+    def _wrap(self, msg_type: str, handler: Callable) -> Callable:
+        def call(message: Message, trace=None):
+            self.last_used = start = monotonic()
+            start_cpu = thread_time()
+            call_id = next(self._call_ids)
+            self._active[call_id] = start
+            if trace:
+                self.tracer.dispatch(trace)
+            try:
+                with plugin_context(self.name):
+                    return handler(message)
+            finally:
+                del self._active[call_id]
+                self.last_used = monotonic()
+                if trace:
+                    self.tracer.complete(trace)
+                if self.metrics:
+                    self.metrics.record(self.name, msg_type,
+                                        monotonic() - start,
+                                        thread_time() - start_cpu)
+        if not self.executor and not self.tracer:
+            return call
+
+        def wrapper(message: Message):
+            trace = self.tracer.receive(self.name, message) \
+                if self.tracer else None
+            if self.executor:
+                self.last_used = monotonic()
+                self.executor.submit(self.name, call, message, trace)
+            else:
+                call(message, trace)
+        return wrapper
+
+    def emit(self, message: Message):
+        if self.tracer:
+            self.tracer.emit(self.name, message)
+        if self.coalescer and self.coalescer.handles(message.msg_type):
+            self.coalescer.submit(message)
+        else:
+            self._bus.emit(message)
+
+    def hold_subscriptions(self):
+        """
+        Record handlers registered after this without subscribing them to
+        the bus until `release_subscriptions` is called.
+        """
+        self._held = list()
+
+    def release_subscriptions(self):
+        """
+        Subscribe handlers registered since `hold_subscriptions`.
+        """
+        held, self._held = self._held or [], None
+        for method, msg_type, wrapper in held:
+            getattr(self._bus, method)(msg_type, wrapper)
+
+    def _subscribe(self, method: str, msg_type: str, wrapper: Callable):
+        if self._held is not None:
+            self._held.append((method, msg_type, wrapper))
+        else:
+            getattr(self._bus, method)(msg_type, wrapper)
+
+    def _unsubscribe(self, msg_type: str, wrapper: Callable):
+        if self._held is not None:
+            self._held = [record for record in self._held
+                          if record[1:] != (msg_type, wrapper)]
+        self._bus.remove(msg_type, wrapper)
+
+    def on(self, msg_type: str, handler: Callable):
+        wrapper = self._wrap(msg_type, handler)
+        self._handlers.setdefault(msg_type, list()).append((handler, wrapper))
+        self._subscribe("on", msg_type, wrapper)
+
+    def once(self, msg_type: str, handler: Callable):
+        wrapped = self._wrap(msg_type, handler)
+
+        def wrapper(message: Message):
+            self._forget(msg_type, handler)
+            return wrapped(message)
+        self._handlers.setdefault(msg_type, list()).append((handler, wrapper))
+        self._subscribe("once", msg_type, wrapper)
+
+    def _forget(self, msg_type: str, handler: Callable):
+        records = self._handlers.get(msg_type) or list()
+        for record in records:
+            if record[0] == handler:
+                records.remove(record)
+                return record[1]
+        return None
+
+    def remove(self, msg_type: str, handler: Callable):
+        wrapper = self._forget(msg_type, handler)
+        self._unsubscribe(msg_type, wrapper or handler)
+
+    def remove_all_listeners(self, msg_type: str):
+        self._handlers.pop(msg_type, None)
+        if self._held is not None:
+            self._held = [record for record in self._held
+                          if record[1] != msg_type]
+        self._bus.remove_all_listeners(msg_type)
+
+    def remove_all(self):
+        """
+        Remove every handler registered through this proxy.
+        """
+        for msg_type, records in list(self._handlers.items()):
+            for _, wrapper in records:
+                self._unsubscribe(msg_type, wrapper)
+        self._handlers.clear()
+
+    @property
+    def active_calls(self) -> int:
+        """
+        Number of handler calls currently running.
+        """
+        return len(self._active)
+
+    @property
+    def longest_active_call(self) -> float:
+        """
+        Seconds the longest running handler call has been running, or 0.
+        """
+        starts = list(self._active.values())
+        return monotonic() - min(starts) if starts else 0.0
+
+    @property
+    def message_types(self) -> List[str]:
+        """
+        Message types this plugin has registered handlers for.
+        """
+        return [msg_type for msg_type, records in self._handlers.items()
+                if records]
+
+    def dispatch(self, message: Message):
+        """
+        Call this plugin's handlers for a message without emitting it.
+        :param message: Message to handle
+        """
+        for _, wrapper in list(self._handlers.get(message.msg_type) or []):
+            wrapper(message)
@@ -29,12 +29,11 @@ import click
 import sys
 
 from click_default_group import DefaultGroup
-from neon_utils.packaging_utils import get_package_version_spec
-from neon_utils.configuration_utils import init_config_dir
-from ovos_utils.log import LOG
-from ovos_config.config import Configuration
 from typing import List
 
+# Keep module-level imports minimal; `neon-enclosure` is called frequently by
+# health checks and heavier modules are only imported by commands that use them
+
 @click.group("neon-enclosure", cls=DefaultGroup,
              no_args_is_help=True, invoke_without_command=True,
              help="Neon Enclosure Commands\n\n"
@@ -43,23 +42,100 @@ from typing import List
               help="Print the current version")
 def neon_enclosure_cli(version: bool = False):
     if version:
-        click.echo(f"neon_enclosure version "
-                   f"{get_package_version_spec('neon_enclosure')}")
+        try:
+            from importlib.metadata import version as get_version
+        except ImportError:
+            # Fallback for Python < 3.8
+            from importlib_metadata import version as get_version
+        click.echo(f"neon_enclosure version {get_version('neon_enclosure')}")
 
 @neon_enclosure_cli.command(help="Install neon-enclosure module dependencies from config & cli")
 @click.option("--package", "-p", default=[], multiple=True,
               help="Additional package to install (can be repeated)")
-def install_dependencies(package: List[str]):
+@click.option("--force", "-f", is_flag=True, default=False,
+              help="Run pip even if dependencies are already satisfied")
+@click.option("--wheelhouse", "-w", default=None,
+              envvar="NEON_ENCLOSURE_WHEELHOUSE",
+              help="Install only from wheels in this directory")
+def install_dependencies(package: List[str], force: bool = False,
+                         wheelhouse: str = None):
+    from ovos_config.config import Configuration
+    from ovos_utils.log import LOG
     from neon_utils.packaging_utils import install_packages_from_pip
-    from neon_enclosure.utils import build_extra_dependency_list
+    from neon_enclosure.utils import build_extra_dependency_list, \
+        check_dependency_stamp, get_unsatisfied_requirements, \
+        write_dependency_stamp, install_from_wheelhouse
     config = Configuration()
     dependencies = build_extra_dependency_list(config, list(package))
-    result = install_packages_from_pip("neon-enclosure", dependencies)
-    LOG.info(f"pip exit code: {result}")
+    if not force:
+        if check_dependency_stamp(dependencies):
+            LOG.info("Dependencies unchanged since last install")
+            sys.exit(0)
+        unsatisfied = get_unsatisfied_requirements(dependencies)
+        LOG.info(f"Unsatisfied dependencies: {unsatisfied}")
+    else:
+        unsatisfied = dependencies
+    result = 0
+    if unsatisfied and wheelhouse:
+        result = install_from_wheelhouse(unsatisfied, wheelhouse)
+        LOG.info(f"pip exit code: {result}")
+    elif unsatisfied:
+        result = install_packages_from_pip("neon-enclosure", unsatisfied)
+        LOG.info(f"pip exit code: {result}")
+    if result == 0:
+        if unsatisfied:
+            _refresh_plugin_manifest()
+        write_dependency_stamp(dependencies)
     sys.exit(result)
 
+
+@neon_enclosure_cli.command(help="Build wheels for neon-enclosure module "
+                                 "dependencies for offline installation")
+@click.option("--package", "-p", default=[], multiple=True,
+              help="Additional package to include (can be repeated)")
+@click.option("--jobs", "-j", default=4, type=int,
+              help="Number of packages to build concurrently")
+@click.argument("path")
+def build_wheelhouse(package: List[str], jobs: int, path: str):
+    from ovos_config.config import Configuration
+    from neon_enclosure.utils import build_extra_dependency_list, \
+        build_wheelhouse as _build_wheelhouse
+    config = Configuration()
+    dependencies = build_extra_dependency_list(config, list(package))
+    results = _build_wheelhouse(dependencies, path, jobs)
+    failed = [req for req, result in results.items() if result != 0]
+    if failed:
+        click.echo(f"Failed to build: {failed}")
+        sys.exit(1)
+    click.echo(f"Built wheels for {len(results)} packages in {path}")
+
+
+def _refresh_plugin_manifest():
+    from os.path import isfile
+    from neon_enclosure.discovery import get_default_manifest_path, \
+        write_plugin_manifest
+    # A frozen manifest is trusted as-is; update it after installing plugins
+    if isfile(get_default_manifest_path()):
+        write_plugin_manifest()
+
+
+@neon_enclosure_cli.command(help="Write a manifest of installed PHAL plugins "
+                                 "so the service can skip plugin discovery")
+@click.option("--path", "-p", default=None,
+              help="Manifest file to write (default in the Python prefix)")
+def write_manifest(path: str):
+    from neon_enclosure.discovery import get_default_manifest_path, \
+        write_plugin_manifest
+    path = path or get_default_manifest_path()
+    manifest = write_plugin_manifest(path)
+    for plugin_type, plugins in manifest["plugins"].items():
+        click.echo(f"{plugin_type}: {', '.join(plugins) or 'None'}")
+    click.echo(f"Wrote plugin manifest to {path}")
+
+
 @neon_enclosure_cli.command(help="Start Neon Enclosure module")
 def run():
+    from neon_utils.configuration_utils import init_config_dir
     init_config_dir()
     from neon_enclosure.__main__ import main
     click.echo("Starting Enclosure Service")
@@ -67,14 +143,224 @@ def run():
     click.echo("Enclosure Service Shutdown")
 
 
+def _get_diagnostic_config(timeline_path: str) -> dict:
+    from copy import deepcopy
+    from ovos_config.config import Configuration
+    config = deepcopy(Configuration().get("PHAL") or {})
+    # Diagnostic runs must not touch the running service's files or bus
+    for plugin_config in config.values():
+        if isinstance(plugin_config, dict) and plugin_config.get("isolated"):
+            plugin_config["isolated"] = False
+    config.update({"state_snapshots": False, "hot_reload": False,
+                   "startup_timeline_path": timeline_path,
+                   "isolated_plugins": [],
+                   "metrics_server": {"enabled": False}})
+    return config
+
+
+@neon_enclosure_cli.command(help="Profile Neon Enclosure startup using a "
+                                 "local FakeBus")
+@click.option("--output", "-o", default=None,
+              help="File to write the startup timeline JSON to")
+def profile_startup(output: str):
+    from os.path import join
+    from tempfile import TemporaryDirectory
+    from ovos_utils.messagebus import FakeBus
+    from neon_enclosure.__main__ import start_service
+    from neon_enclosure.profiling import StartupTimeline
+    timeline = StartupTimeline()
+    with TemporaryDirectory() as tmp_dir:
+        config = _get_diagnostic_config(join(tmp_dir, "startup.json"))
+        service = start_service(timeline=timeline, standalone=False,
+                                bus=FakeBus(), config=config)
+        service.shutdown()
+    if output:
+        timeline.save(output)
+    click.echo(timeline.format_waterfall())
+
+
+@neon_enclosure_cli.command(help="Get handler latency metrics from a running "
+                                 "Neon Enclosure service")
+@click.option("--plugin", "-p", default=None,
+              help="Only show metrics for this plugin")
+@click.option("--json", "as_json", is_flag=True, default=False,
+              help="Print raw metrics as JSON")
+def handler_metrics(plugin: str, as_json: bool):
+    from ovos_bus_client.client import MessageBusClient
+    from ovos_bus_client.message import Message
+    from neon_enclosure.metrics import format_handler_metrics, \
+        format_queue_stats
+    bus = MessageBusClient()
+    bus.run_in_thread()
+    if not bus.connected_event.wait(10):
+        click.echo("Unable to connect to the messagebus")
+        sys.exit(1)
+    resp = bus.wait_for_response(Message("neon.phal.get_handler_metrics",
+                                         {"plugin": plugin}))
+    bus.close()
+    if not resp:
+        click.echo("No response from the Enclosure service")
+        sys.exit(1)
+    if as_json:
+        import json
+        click.echo(json.dumps(resp.data["metrics"], indent=2))
+    else:
+        click.echo(format_handler_metrics(resp.data["metrics"]))
+        if resp.data.get("queues"):
+            click.echo()
+            click.echo(format_queue_stats(resp.data["queues"]))
+
+
+@neon_enclosure_cli.command(help="Dump sampled message traces from a running "
+                                 "Neon Enclosure service")
+@click.option("--trace", "-t", "trace_id", default=None,
+              help="Only show records for this trace ID")
+@click.option("--plugin", "-p", default=None,
+              help="Only show records for this plugin")
+@click.option("--json", "as_json", is_flag=True, default=False,
+              help="Print raw records as JSON")
+def traces(trace_id: str, plugin: str, as_json: bool):
+    from ovos_bus_client.client import MessageBusClient
+    from ovos_bus_client.message import Message
+    from neon_enclosure.tracing import format_traces
+    bus = MessageBusClient()
+    bus.run_in_thread()
+    if not bus.connected_event.wait(10):
+        click.echo("Unable to connect to the messagebus")
+        sys.exit(1)
+    resp = bus.wait_for_response(Message("neon.phal.get_traces",
+                                         {"trace_id": trace_id,
+                                          "plugin": plugin}))
+    bus.close()
+    if not resp:
+        click.echo("No response from the Enclosure service")
+        sys.exit(1)
+    if as_json:
+        import json
+        click.echo(json.dumps(resp.data["traces"], indent=2))
+    elif not resp.data["traces"]:
+        click.echo("No traced messages")
+    else:
+        click.echo(format_traces(resp.data["traces"]))
+
+
+@neon_enclosure_cli.command(help="Send requests to the Enclosure service and "
+                                 "report response throughput and latency. "
+                                 "Requests are handled by plugins as real "
+                                 "messages")
+@click.option("--local", is_flag=True, default=False,
+              help="Start the service with installed plugins on a local "
+                   "FakeBus instead of using a running service")
+@click.option("--message", "-m", "messages", multiple=True,
+              help="Message type to send, optionally with a relative weight "
+                   "(`type=weight`). Defaults to all message types handled "
+                   "by loaded plugins")
+@click.option("--plugin", "-p", "plugins", multiple=True,
+              help="Only send message types handled by this plugin")
+@click.option("--data", "-d", default=None,
+              help="JSON data to send with each message")
+@click.option("--rate", "-r", default=0.0,
+              help="Max requests per second (0 is unlimited)")
+@click.option("--concurrency", "-c", default=4,
+              help="Number of requests awaiting replies at once")
+@click.option("--duration", "-t", default=10.0,
+              help="Seconds to send requests for")
+@click.option("--timeout", default=2.0,
+              help="Seconds to wait for each reply before it is dropped")
+@click.option("--json", "as_json", is_flag=True, default=False,
+              help="Print raw results as JSON")
+def bench(local: bool, messages: List[str], plugins: List[str], data: str,
+          rate: float, concurrency: int, duration: float, timeout: float,
+          as_json: bool):
+    import json
+    from ovos_bus_client.message import Message
+    from neon_enclosure.benchmark import format_load_report, run_load
+    service = None
+    tmp_dir = None
+    if local:
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from ovos_utils.messagebus import FakeBus
+        from neon_enclosure.__main__ import start_service
+        bus = FakeBus()
+        tmp_dir = TemporaryDirectory()
+        config = _get_diagnostic_config(join(tmp_dir.name, "startup.json"))
+        service = start_service(standalone=False, bus=bus, config=config)
+        message_types = service.get_message_types()
+    else:
+        from ovos_bus_client.client import MessageBusClient
+        bus = MessageBusClient()
+        bus.run_in_thread()
+        if not bus.connected_event.wait(10):
+            click.echo("Unable to connect to the messagebus")
+            sys.exit(1)
+        message_types = dict()
+        if not messages:
+            resp = bus.wait_for_response(
+                Message("neon.phal.get_message_types"))
+            if not resp:
+                bus.close()
+                click.echo("No response from the Enclosure service")
+                sys.exit(1)
+            message_types = resp.data["message_types"]
+    mix = _get_message_mix(messages, message_types, plugins)
+    try:
+        if not mix:
+            click.echo("No message types to send")
+            sys.exit(1)
+        click.echo(f"Sending {len(mix)} message types for {duration}s")
+        results = run_load(bus, mix, duration=duration, rate=rate,
+                           concurrency=concurrency, timeout=timeout,
+                           data=json.loads(data) if data else None)
+    finally:
+        if service:
+            service.shutdown()
+        else:
+            bus.close()
+        if tmp_dir:
+            tmp_dir.cleanup()
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+    else:
+        click.echo(format_load_report(results))
+
+
+def _get_message_mix(messages: List[str], message_types: dict,
+                     plugins: List[str]) -> dict:
+    if messages:
+        mix = dict()
+        for message in messages:
+            msg_type, _, weight = message.partition("=")
+            mix[msg_type] = float(weight) if weight else 1.0
+        return mix
+    return {msg_type: 1.0 for name, types in message_types.items()
+            if not plugins or name in plugins for msg_type in types}
+
+
 @neon_enclosure_cli.command(help="Start Neon Enclosure Admin module")
 def run_admin():
     from os import geteuid
     if geteuid() != 0:
         click.echo("Admin enclosure must be started as `root`")
         exit(1)
+    from neon_utils.configuration_utils import init_config_dir
     init_config_dir()
     from neon_enclosure.admin.__main__ import main
     click.echo("Starting Admin Enclosure Service")
     main()
     click.echo("Admin Enclosure Service Shutdown")
+
+
+@neon_enclosure_cli.command(help="Start Neon Enclosure and Admin modules in a "
+                                 "single process")
+def run_all():
+    from os import geteuid
+    if geteuid() != 0:
+        click.echo("Combined enclosure must be started as `root`")
+        exit(1)
+    from neon_utils.configuration_utils import init_config_dir
+    init_config_dir()
+    from neon_enclosure.combined import main
+    click.echo("Starting Enclosure and Admin Enclosure Services")
+    main()
+    click.echo("Enclosure and Admin Enclosure Services Shutdown")
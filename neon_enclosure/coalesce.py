@@ -0,0 +1,177 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from threading import Condition, Lock, Thread, current_thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+
+from ovos_bus_client.message import Message
+from ovos_utils.log import LOG
+
+COALESCE_POLICIES = ("debounce", "throttle", "last-value")
+
+
+class _CoalesceState:
+    __slots__ = ("pending", "deadline", "received", "emitted")
+
+    def __init__(self):
+        self.pending: Optional[Message] = None
+        # Monotonic time the current window ends, if one is open
+        self.deadline: Optional[float] = None
+        self.received = 0
+        self.emitted = 0
+
+
+class EmitCoalescer:
+    """
+    Reduces bursts of emitted messages of the same type. Policies are applied
+    per message type within a time `window` (seconds):
+    - `debounce` emits the latest message once no more have been received for
+      `window` seconds
+    - `throttle` emits the first message immediately and then at most one
+      message (the latest) per `window`
+    - `last-value` emits the latest message received during each `window`
+    Windows of all message types are tracked by a single thread.
+    """
+    def __init__(self, emit: Callable[[Message], None],
+                 rules: Dict[str, dict]):
+        """
+        :param emit: method to emit messages with
+        :param rules: dict of message type to `policy` and `window`
+        """
+        self._emit = emit
+        self.rules = dict()
+        for msg_type, rule in rules.items():
+            policy = rule.get("policy", "last-value")
+            if policy not in COALESCE_POLICIES:
+                LOG.error(f"Invalid coalesce policy for {msg_type}: "
+                          f"{policy}")
+                continue
+            self.rules[msg_type] = (policy, float(rule.get("window", 0.5)))
+        self._state: Dict[str, _CoalesceState] = dict()
+        self._lock = Lock()
+        self._wake = Condition(self._lock)
+        self._thread: Optional[Thread] = None
+
+    def handles(self, msg_type: str) -> bool:
+        return msg_type in self.rules
+
+    def submit(self, message: Message):
+        """
+        Emit or hold a message according to the rule for its type.
+        :param message: Message of a type in `rules`
+        """
+        msg_type = message.msg_type
+        policy, window = self.rules[msg_type]
+        with self._lock:
+            state = self._state.get(msg_type)
+            if state is None:
+                state = self._state[msg_type] = _CoalesceState()
+            state.received += 1
+            if policy == "throttle" and state.deadline is None:
+                state.emitted += 1
+                self._open_window(state, window)
+            else:
+                state.pending = message
+                if policy == "debounce" or state.deadline is None:
+                    # Debounce moves the end of the window out
+                    self._open_window(state, window)
+                return
+        self._emit(message)
+
+    def _open_window(self, state: _CoalesceState, window: float):
+        state.deadline = monotonic() + window
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="emit_coalescer",
+                                  daemon=True)
+            self._thread.start()
+        self._wake.notify()
+
+    def _run(self):
+        with self._lock:
+            while self._thread is current_thread():
+                now = monotonic()
+                deadlines = [state.deadline for state in self._state.values()
+                             if state.deadline is not None]
+                if not deadlines:
+                    self._wake.wait()
+                    continue
+                if min(deadlines) > now:
+                    self._wake.wait(min(deadlines) - now)
+                    continue
+                messages = self._close_windows(now)
+                self._lock.release()
+                for message in messages:
+                    try:
+                        self._emit(message)
+                    except Exception as e:
+                        LOG.exception(f"Failed to emit {message.msg_type}: "
+                                      f"{e}")
+                self._lock.acquire()
+
+    def _close_windows(self, now: float) -> List[Message]:
+        messages = list()
+        for msg_type, state in self._state.items():
+            if state.deadline is None or state.deadline > now:
+                continue
+            message, state.pending = state.pending, None
+            state.deadline = None
+            if message:
+                messages.append(message)
+                state.emitted += 1
+                policy, window = self.rules[msg_type]
+                if policy == "throttle":
+                    state.deadline = now + window
+        return messages
+
+    def flush(self):
+        """
+        Close open windows, emit any held messages, and stop the window
+        thread until another message is held.
+        """
+        with self._lock:
+            pending = list()
+            for state in self._state.values():
+                state.deadline = None
+                if state.pending:
+                    pending.append(state.pending)
+                    state.pending = None
+                    state.emitted += 1
+            self._thread = None
+            self._wake.notify_all()
+        for message in pending:
+            self._emit(message)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        :returns: dict of message type to `received` and `emitted` counts
+        """
+        with self._lock:
+            return {msg_type: {"received": state.received,
+                               "emitted": state.emitted}
+                    for msg_type, state in self._state.items()}
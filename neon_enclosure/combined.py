@@ -0,0 +1,97 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from copy import deepcopy
+from signal import signal, SIGUSR2
+from typing import Optional, Tuple
+from neon_utils.log_utils import init_log
+from neon_utils.signal_utils import init_signal_bus, init_signal_handlers
+from ovos_config.config import Configuration
+from ovos_utils.process_utils import reset_sigint_handler, PIDLock
+from ovos_utils import wait_for_exit_signal
+
+from neon_enclosure.__main__ import start_service
+from neon_enclosure.admin.service import NeonAdminHardwareAbstractionLayer
+from neon_enclosure.memory import init_memory_profiler
+from neon_enclosure.messagebus import get_resilient_bus
+from neon_enclosure.profiling import StartupTimeline
+from neon_enclosure.service import NeonHardwareAbstractionLayer
+
+
+def start_services(bus=None, timeline: Optional[StartupTimeline] = None,
+                   standalone: bool = True) -> \
+        Tuple[NeonHardwareAbstractionLayer, NeonAdminHardwareAbstractionLayer]:
+    """
+    Start the Admin and Enclosure services in this process with a shared
+    messagebus connection and memory profiler.
+    :param bus: MessageBusClient to share (default connects a new client)
+    :param timeline: StartupTimeline to record Enclosure startup phases to
+    :param standalone: if False, skip process setup (signal handlers and PID
+        locks)
+    :returns: started Enclosure service, started Admin service
+    """
+    timeline = timeline or StartupTimeline()
+    with timeline.phase("init_log"):
+        init_log(log_name="enclosure")
+    with timeline.phase("memory_profiler"):
+        profiler = init_memory_profiler("enclosure")
+    with timeline.phase("connect_bus"):
+        bus = bus or get_resilient_bus()
+    if standalone:
+        with timeline.phase("signal_handlers"):
+            init_signal_bus(bus)
+            init_signal_handlers()
+            reset_sigint_handler()
+            signal(SIGUSR2, profiler.toggle)
+        with timeline.phase("pid_lock"):
+            # Hold both locks so separate services are not started alongside
+            PIDLock('enclosure')
+            PIDLock('admin')
+    # Each service removes `admin` from its config, so give each a copy
+    config = deepcopy(Configuration().get("PHAL") or {})
+    with timeline.phase("admin"):
+        admin = NeonAdminHardwareAbstractionLayer(bus=bus,
+                                                  memory_profiler=profiler,
+                                                  config=deepcopy(config))
+        admin.start()
+    service = start_service(timeline=timeline, standalone=False, bus=bus,
+                            memory_profiler=profiler, config=config,
+                            watch_config=True)
+    return service, admin
+
+
+def main(*args, **kwargs):
+    service, admin = start_services(*args, **kwargs)
+    wait_for_exit_signal()
+    service.memory_profiler.stop()
+    service.shutdown()
+    admin.shutdown()
+
+
+if __name__ == '__main__':
+    main()
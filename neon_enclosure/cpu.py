@@ -0,0 +1,335 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+
+from contextlib import contextmanager
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import getpid, listdir, sysconf
+from time import thread_time
+from typing import Callable, Dict, Optional, Set
+
+from ovos_utils.log import LOG
+
+from neon_enclosure.metrics import HandlerMetrics
+from neon_enclosure.workers import get_process_stats
+
+_local = threading.local()
+_lock = threading.Lock()
+# Native thread ID to name of the plugin that started the thread
+_thread_owners: Dict[int, str] = dict()
+# CPU seconds used by exited threads, by plugin
+_exited_cpu: Dict[str, float] = dict()
+# Exited threads that may still be listed in procfs
+_exited_tids: Set[int] = set()
+_original_start = threading.Thread.start
+_hook_users = 0
+# Threads can only be matched to procfs entries with native IDs (Python 3.8+)
+CPU_ACCOUNTING_SUPPORTED = hasattr(threading, "get_native_id")
+
+
+def get_thread_owner() -> Optional[str]:
+    """
+    Get the plugin responsible for code running in the current thread.
+    :returns: plugin name, or None if not running plugin code
+    """
+    return getattr(_local, "plugin", None) or \
+        getattr(threading.current_thread(), "_phal_plugin", None)
+
+
+@contextmanager
+def plugin_context(name: str):
+    """
+    Attribute threads started within this context to a plugin.
+    :param name: plugin name
+    """
+    previous = getattr(_local, "plugin", None)
+    _local.plugin = name
+    try:
+        yield
+    finally:
+        _local.plugin = previous
+
+
+def call_as_plugin(name: str, fn: Callable, *args, **kwargs):
+    """
+    Call a function, attributing any threads it starts to a plugin.
+    """
+    with plugin_context(name):
+        return fn(*args, **kwargs)
+
+
+def _run_as_plugin(owner: str, run: Callable):
+    tid = threading.get_native_id()
+    with _lock:
+        _thread_owners[tid] = owner
+        _exited_tids.discard(tid)
+    try:
+        run()
+    finally:
+        # Record CPU on exit so short-lived threads are not missed
+        with _lock:
+            _thread_owners.pop(tid, None)
+            _exited_tids.add(tid)
+            _exited_cpu[owner] = _exited_cpu.get(owner, 0.0) + thread_time()
+
+
+def _start(thread: threading.Thread):
+    owner = get_thread_owner()
+    if owner:
+        # Threads started by this thread inherit its owner
+        thread._phal_plugin = owner
+        thread.run = partial(_run_as_plugin, owner, thread.run)
+    _original_start(thread)
+
+
+def install_thread_hook():
+    """
+    Record the plugin that started each thread until every caller has called
+    `remove_thread_hook`.
+    """
+    global _hook_users
+    if not CPU_ACCOUNTING_SUPPORTED:
+        raise RuntimeError("Thread accounting requires Python 3.8+")
+    with _lock:
+        _hook_users += 1
+        threading.Thread.start = _start
+
+
+def remove_thread_hook():
+    """
+    Stop recording thread owners if no other callers need them.
+    """
+    global _hook_users
+    with _lock:
+        _hook_users = max(_hook_users - 1, 0)
+        if not _hook_users:
+            threading.Thread.start = _original_start
+
+
+def read_thread_cpu_times() -> Dict[int, float]:
+    """
+    Read CPU time of each thread in this process from procfs.
+    :returns: dict of native thread ID to CPU time in seconds
+    """
+    ticks = sysconf("SC_CLK_TCK")
+    times = dict()
+    for tid in listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{tid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            # Thread exited
+            continue
+        times[int(tid)] = (int(fields[11]) + int(fields[12])) / ticks
+    return times
+
+
+class CPUAccounting:
+    """
+    Aggregates per-thread CPU time by the plugin that started each thread.
+    CPU time spent in plugin bus handlers (which run on shared threads) is
+    taken from `metrics` and counted for the handling plugin instead of the
+    service.
+    """
+    def __init__(self, metrics: Optional[HandlerMetrics] = None):
+        install_thread_hook()
+        self._hooked = True
+        self.metrics = metrics
+        # Last CPU time of threads not started by plugins
+        self._last: Dict[int, float] = dict()
+        self._exited = 0.0
+
+    def close(self):
+        """
+        Stop attributing new threads to plugins.
+        """
+        if self._hooked:
+            self._hooked = False
+            remove_thread_hook()
+
+    def sample(self) -> dict:
+        """
+        Sample thread CPU times and process memory.
+        :returns: dict of `plugins` (name to `cpu_time`, `handler_cpu_time`,
+            and `threads`), `service_cpu_time`, `cpu_time`, and `rss`
+        """
+        threads = dict()
+        with _lock:
+            # Read under the lock so no thread exits between read and lookup
+            times = read_thread_cpu_times()
+            _exited_tids.intersection_update(times)
+            for tid in set(self._last) - set(times):
+                self._exited += self._last.pop(tid)
+            totals = dict(_exited_cpu)
+            service = self._exited
+            for tid, cpu in times.items():
+                if tid in _exited_tids:
+                    continue
+                owner = _thread_owners.get(tid)
+                if owner:
+                    self._last.pop(tid, None)
+                    totals[owner] = totals.get(owner, 0.0) + cpu
+                    threads[owner] = threads.get(owner, 0) + 1
+                    continue
+                last = self._last.get(tid)
+                if last is not None and cpu < last:
+                    # Thread ID was reused
+                    self._exited += last
+                    service += last
+                self._last[tid] = cpu
+                service += cpu
+        handler_times = dict()
+        for plugin, handlers in (self.metrics.get_metrics()
+                                 if self.metrics else {}).items():
+            handler_times[plugin] = sum(stats.get("cpu", 0.0)
+                                        for stats in handlers.values())
+        plugins = dict()
+        for name in set(totals) | set(handler_times):
+            plugins[name] = {"cpu_time": totals.get(name, 0.0) +
+                             handler_times.get(name, 0.0),
+                             "handler_cpu_time": handler_times.get(name, 0.0),
+                             "threads": threads.get(name, 0)}
+        process = get_process_stats(getpid())
+        return {"plugins": plugins,
+                "service_cpu_time": max(service -
+                                        sum(handler_times.values()), 0.0),
+                "cpu_time": process["cpu_time"],
+                "rss": process["rss"]}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+def format_prometheus(sample: dict, workers: Optional[dict] = None) -> str:
+    """
+    Format a CPU accounting sample in the Prometheus text exposition format.
+    :param sample: dict returned by `CPUAccounting.sample`
+    :param workers: dict returned by `WorkerSupervisor.get_stats`
+    :returns: metrics text
+    """
+    workers = workers or dict()
+    lines = list()
+
+    def _metric(name: str, metric_type: str, doc: str, values: dict):
+        lines.append(f"# HELP {name} {doc}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for plugin, value in sorted(values.items()):
+            lines.append(f'{name}{{plugin="{_escape(plugin)}"}} {value}')
+
+    cpu = {name: stats["cpu_time"]
+           for name, stats in sample["plugins"].items()}
+    for name, stats in workers.items():
+        if "cpu_time" in stats:
+            cpu[name] = cpu.get(name, 0.0) + stats["cpu_time"]
+    _metric("neon_phal_plugin_cpu_seconds_total", "counter",
+            "CPU time used by each plugin's threads, handlers, and worker",
+            cpu)
+    _metric("neon_phal_plugin_handler_cpu_seconds_total", "counter",
+            "CPU time used in each plugin's bus handlers",
+            {name: stats["handler_cpu_time"]
+             for name, stats in sample["plugins"].items()})
+    _metric("neon_phal_plugin_threads", "gauge",
+            "Running threads started by each plugin",
+            {name: stats["threads"]
+             for name, stats in sample["plugins"].items()})
+    _metric("neon_phal_worker_resident_memory_bytes", "gauge",
+            "Resident memory of isolated plugin worker processes",
+            {name: stats["rss"] for name, stats in workers.items()
+             if "rss" in stats})
+    lines.append("# HELP neon_phal_service_cpu_seconds_total "
+                 "CPU time used by the service outside of plugins")
+    lines.append("# TYPE neon_phal_service_cpu_seconds_total counter")
+    lines.append(f"neon_phal_service_cpu_seconds_total "
+                 f"{sample['service_cpu_time']}")
+    lines.append("# HELP process_cpu_seconds_total "
+                 "Total user and system CPU time spent in seconds")
+    lines.append("# TYPE process_cpu_seconds_total counter")
+    lines.append(f"process_cpu_seconds_total {sample['cpu_time']}")
+    lines.append("# HELP process_resident_memory_bytes "
+                 "Resident memory size in bytes")
+    lines.append("# TYPE process_resident_memory_bytes gauge")
+    lines.append(f"process_resident_memory_bytes {sample['rss']}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    HTTP server providing metrics text at `/metrics` from a background thread.
+    """
+    def __init__(self, get_metrics: Callable[[], str],
+                 host: str = "127.0.0.1", port: int = 9464):
+        """
+        :param get_metrics: callable returning Prometheus metrics text
+        :param host: address to listen on
+        :param port: port to listen on; 0 selects a free port
+        """
+        self.get_metrics = get_metrics
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        get_metrics = self.get_metrics
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                try:
+                    body = get_metrics().encode()
+                except Exception as e:
+                    LOG.exception(e)
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever,
+                         name="metrics_server", daemon=True).start()
+        LOG.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
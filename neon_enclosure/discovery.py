@@ -0,0 +1,161 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import sys
+
+from hashlib import sha256
+from os import makedirs, remove, replace, stat
+from os.path import dirname, isdir, isfile, join
+from typing import Dict, Iterable, Optional
+
+from ovos_utils.log import LOG
+from ovos_utils.xdg_utils import xdg_cache_home
+
+try:
+    from importlib_metadata import EntryPoint, entry_points
+except ImportError:
+    from importlib.metadata import EntryPoint, entry_points
+
+
+def get_default_cache_path() -> str:
+    return join(xdg_cache_home(), "neon", "phal_plugins.json")
+
+
+def get_default_manifest_path() -> str:
+    # Manifests describe a specific environment, so keep them with it
+    return join(sys.prefix, "share", "neon", "phal_manifest.json")
+
+
+def get_environment_fingerprint() -> str:
+    """
+    Get a hash that changes when distributions are installed or removed.
+    Only directory metadata is read, so this is much cheaper than a scan of
+    installed entry points.
+    """
+    paths = list()
+    for path in sys.path:
+        if path and isdir(path):
+            paths.append((path, stat(path).st_mtime_ns))
+    return sha256(json.dumps(paths).encode()).hexdigest()
+
+
+def scan_plugin_entrypoints(plugin_type: str) -> Dict[str, str]:
+    """
+    Scan installed distributions for plugin entry points.
+    :param plugin_type: entry point group to search
+    :returns: dict of plugin name to entry point value (`module:attr`)
+    """
+    return {entrypoint.name: entrypoint.value
+            for entrypoint in entry_points(group=plugin_type)}
+
+
+def _read_json(path: str) -> Optional[dict]:
+    if not isfile(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        LOG.warning(f"Ignoring invalid plugin cache {path}: {e}")
+        return None
+
+
+def _write_json(path: str, data: dict):
+    makedirs(dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    replace(tmp_path, path)
+
+
+def write_plugin_manifest(path: Optional[str] = None,
+                          plugin_types: Iterable[str] =
+                          ("ovos.plugin.phal", "ovos.plugin.phal.admin")) \
+        -> dict:
+    """
+    Write a manifest of installed plugins to be used instead of discovery.
+    :param path: manifest file to write
+    :param plugin_types: entry point groups to include
+    :returns: dict manifest that was written
+    """
+    path = path or get_default_manifest_path()
+    manifest = {"plugins": {plugin_type: scan_plugin_entrypoints(plugin_type)
+                            for plugin_type in plugin_types}}
+    _write_json(path, manifest)
+    LOG.info(f"Wrote plugin manifest to {path}")
+    return manifest
+
+
+def remove_plugin_cache(path: Optional[str] = None):
+    """
+    Remove a cached or frozen plugin list so the next lookup runs discovery.
+    :param path: cache or manifest file to remove
+    """
+    path = path or get_default_cache_path()
+    if isfile(path):
+        remove(path)
+
+
+def find_plugin_entrypoints(plugin_type: str,
+                            manifest_path: Optional[str] = None,
+                            cache_path: Optional[str] = None) -> dict:
+    """
+    Find installed plugin entry points without importing them. A frozen
+    manifest is used if present, otherwise discovery results are cached until
+    the installed packages change.
+    :param plugin_type: entry point group to search
+    :param manifest_path: frozen plugin manifest to use if it exists
+    :param cache_path: discovery cache file; set to "" to disable caching
+    :returns: dict of plugin name to EntryPoint
+    """
+    manifest_path = manifest_path or get_default_manifest_path()
+    cache_path = get_default_cache_path() if cache_path is None \
+        else cache_path
+    manifest = _read_json(manifest_path)
+    plugins = (manifest or {}).get("plugins", {}).get(plugin_type)
+    if plugins is not None:
+        LOG.debug(f"Using plugin manifest: {manifest_path}")
+    elif cache_path:
+        fingerprint = get_environment_fingerprint()
+        cache = _read_json(cache_path) or {}
+        if cache.get("fingerprint") == fingerprint:
+            plugins = cache.get("plugins", {}).get(plugin_type)
+        if plugins is None:
+            plugins = scan_plugin_entrypoints(plugin_type)
+            if cache.get("fingerprint") != fingerprint:
+                cache = {"fingerprint": fingerprint, "plugins": {}}
+            cache["plugins"][plugin_type] = plugins
+            try:
+                _write_json(cache_path, cache)
+            except OSError as e:
+                LOG.warning(f"Failed to write plugin cache {cache_path}: {e}")
+    else:
+        plugins = scan_plugin_entrypoints(plugin_type)
+    return {name: EntryPoint(name=name, value=value, group=plugin_type)
+            for name, value in plugins.items()}
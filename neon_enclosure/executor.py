@@ -0,0 +1,250 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Callable, Deque, Dict, List, Optional
+
+from ovos_utils.log import LOG
+
+OVERFLOW_POLICIES = ("drop-oldest", "block", "reject")
+
+
+class _PluginQueue:
+    __slots__ = ("items", "probes", "scheduled", "max_depth", "processed",
+                 "dropped", "rejected")
+
+    def __init__(self):
+        self.items: Deque[tuple] = deque()
+        # Queued probe calls, which do not count toward the queue size
+        self.probes = 0
+        self.scheduled = False
+        self.max_depth = 0
+        self.processed = 0
+        self.dropped = 0
+        self.rejected = 0
+
+
+class HandlerExecutor:
+    """
+    Runs plugin bus handlers on a shared pool of threads. Each plugin has a
+    bounded queue; handlers for a single plugin are called in order, one at a
+    time, while different plugins are served concurrently.
+    """
+    def __init__(self, max_workers: int = 4, queue_size: int = 100,
+                 policy: str = "block",
+                 block_timeout: Optional[float] = 1):
+        """
+        :param max_workers: number of threads calling handlers
+        :param queue_size: max queued calls per plugin
+        :param policy: action when a plugin queue is full; `drop-oldest`
+            discards the oldest queued call, `block` waits for space (up to
+            `block_timeout` seconds) and `reject` discards the new call
+        :param block_timeout: max seconds to block with the `block` policy
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy: {policy}")
+        self.queue_size = max(queue_size, 1)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queues: Dict[str, _PluginQueue] = dict()
+        self._ready: Deque[str] = deque()
+        self._lock = Lock()
+        self._work = Condition(self._lock)
+        self._space = Condition(self._lock)
+        self._idle = Condition(self._lock)
+        self._running = True
+        self._threads: List[Thread] = list()
+        for i in range(max(max_workers, 1)):
+            thread = Thread(target=self._run, name=f"phal_handler_{i}",
+                            daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, plugin: str, fn: Callable, *args) -> bool:
+        """
+        Queue a call for a plugin.
+        :param plugin: name of the plugin the call belongs to
+        :param fn: callable to run
+        :returns: True if the call was queued
+        """
+        with self._lock:
+            if not self._running:
+                return False
+            queue = self._queues.get(plugin)
+            if queue is None:
+                queue = self._queues[plugin] = _PluginQueue()
+            if self._depth(queue) >= self.queue_size:
+                if self.policy == "drop-oldest":
+                    self._drop_oldest(queue)
+                    queue.dropped += 1
+                    LOG.warning(f"Handler queue full for {plugin}; "
+                                f"discarded oldest call")
+                elif self.policy == "block":
+                    self._space.wait_for(
+                        lambda: self._depth(queue) < self.queue_size or
+                        not self._running, self.block_timeout)
+                if self._depth(queue) >= self.queue_size or \
+                        not self._running:
+                    queue.rejected += 1
+                    LOG.warning(f"Handler queue full for {plugin}; "
+                                f"discarding call")
+                    return False
+            queue.items.append((fn, args, False))
+            queue.max_depth = max(queue.max_depth, self._depth(queue))
+            self._schedule(plugin, queue)
+            return True
+
+    def submit_probe(self, plugin: str, fn: Callable, *args) -> bool:
+        """
+        Queue a call behind a plugin's queued calls without taking space in
+        its queue; probes are never discarded by the overflow policy and are
+        not counted in stats.
+        :param plugin: name of the plugin to probe
+        :param fn: callable to run
+        :returns: True if the call was queued
+        """
+        with self._lock:
+            if not self._running:
+                return False
+            queue = self._queues.get(plugin)
+            if queue is None:
+                queue = self._queues[plugin] = _PluginQueue()
+            queue.items.append((fn, args, True))
+            queue.probes += 1
+            self._schedule(plugin, queue)
+            return True
+
+    @staticmethod
+    def _depth(queue: _PluginQueue) -> int:
+        return len(queue.items) - queue.probes
+
+    @staticmethod
+    def _drop_oldest(queue: _PluginQueue):
+        probes = list()
+        while queue.items[0][2]:
+            probes.append(queue.items.popleft())
+        queue.items.popleft()
+        queue.items.extendleft(reversed(probes))
+
+    def _schedule(self, plugin: str, queue: _PluginQueue):
+        if not queue.scheduled:
+            queue.scheduled = True
+            self._ready.append(plugin)
+            self._work.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._work.wait_for(lambda: self._ready or not self._running)
+                if not self._running:
+                    return
+                plugin = self._ready.popleft()
+                queue = self._queues[plugin]
+                fn, args, probe = queue.items.popleft()
+                if probe:
+                    queue.probes -= 1
+                if self.policy == "block":
+                    self._space.notify_all()
+            try:
+                fn(*args)
+            except Exception as e:
+                LOG.exception(f"Handler for {plugin} raised: {e}")
+            with self._lock:
+                if not probe:
+                    queue.processed += 1
+                if queue.items and self._running:
+                    # Requeue behind other plugins so one busy plugin does not
+                    # starve the rest
+                    self._ready.append(plugin)
+                    self._work.notify()
+                else:
+                    queue.scheduled = False
+                    self._idle.notify_all()
+
+    def clear(self, plugin: str):
+        """
+        Discard calls queued for a plugin that have not started. A call in
+        progress is left to finish without blocking calls submitted later.
+        :param plugin: name of the plugin to clear calls for
+        """
+        with self._lock:
+            queue = self._queues.pop(plugin, None)
+            if queue:
+                queue.items.clear()
+                if plugin in self._ready:
+                    self._ready.remove(plugin)
+                    queue.scheduled = False
+                if self.policy == "block":
+                    self._space.notify_all()
+                self._idle.notify_all()
+
+    def get_stats(self, plugin: Optional[str] = None) -> Dict[str, dict]:
+        """
+        :param plugin: only return stats for this plugin
+        :returns: dict of plugin name to queue `depth`, `max_depth`,
+            `processed`, `dropped` and `rejected` calls
+        """
+        with self._lock:
+            return {name: {"depth": self._depth(queue),
+                           "max_depth": queue.max_depth,
+                           "processed": queue.processed,
+                           "dropped": queue.dropped,
+                           "rejected": queue.rejected}
+                    for name, queue in self._queues.items()
+                    if plugin is None or name == plugin}
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for all queued calls to complete.
+        :returns: True if all queues are empty and idle
+        """
+        with self._lock:
+            return self._idle.wait_for(
+                lambda: not any(q.scheduled for q in self._queues.values()),
+                timeout)
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = 5):
+        """
+        Stop worker threads; queued calls that have not started are dropped.
+        """
+        with self._lock:
+            self._running = False
+            for plugin in self._ready:
+                # Not in progress; in-progress queues are released by workers
+                self._queues[plugin].scheduled = False
+            self._ready.clear()
+            for queue in self._queues.values():
+                queue.items.clear()
+                queue.probes = 0
+            self._work.notify_all()
+            self._space.notify_all()
+            self._idle.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join(timeout)
@@ -0,0 +1,253 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from threading import Lock, RLock, Timer
+from time import monotonic
+from typing import List, Optional
+
+from ovos_bus_client.message import Message
+from ovos_utils.log import LOG
+
+from neon_enclosure.bus import PluginBus
+from neon_enclosure.coalesce import EmitCoalescer
+from neon_enclosure.cpu import call_as_plugin
+from neon_enclosure.executor import HandlerExecutor
+from neon_enclosure.metrics import HandlerMetrics
+from neon_enclosure.scheduler import Scheduler
+from neon_enclosure.state import PluginStateStore, init_plugin, \
+    save_plugin_state
+from neon_enclosure.tracing import MessageTracer
+
+
+class LazyPlugin:
+    """
+    Stand-in for a PHAL plugin that is only imported and initialized when one
+    of its configured `lazy_messages` is received. If `idle_timeout` is
+    configured, the plugin is shut down after that many seconds without
+    handling a message and activated again on the next matching message.
+    If `executor` is provided, plugins are activated on it rather than on the
+    bus thread; messages received while activating are delivered after.
+    """
+    def __init__(self, name: str, entrypoint, bus, config: dict,
+                 metrics: Optional[HandlerMetrics] = None,
+                 executor: Optional[HandlerExecutor] = None,
+                 coalescer: Optional[EmitCoalescer] = None,
+                 state_store: Optional[PluginStateStore] = None,
+                 tracer: Optional[MessageTracer] = None,
+                 scheduler: Optional[Scheduler] = None):
+        self.name = name
+        self.metrics = metrics
+        self.executor = executor
+        self.coalescer = coalescer
+        self.state_store = state_store
+        self.tracer = tracer
+        self.scheduler = scheduler
+        self.bus = bus
+        self.config = config
+        self.message_types = list(config.get("lazy_messages") or [])
+        self.idle_timeout: Optional[float] = config.get("idle_timeout")
+        self.plugin = None
+        self._entrypoint = entrypoint
+        self._plugin_bus: Optional[PluginBus] = None
+        self._idle_timer: Optional[Timer] = None
+        self._activating = False
+        self._stopped = False
+        self._pending: List[Message] = list()
+        self._lock = RLock()
+        # Held while loading so the bus thread is not blocked by `_lock`
+        self._activation_lock = Lock()
+        self._register_stubs()
+
+    @property
+    def active(self) -> bool:
+        return self.plugin is not None
+
+    @property
+    def plugin_bus(self) -> Optional[PluginBus]:
+        """
+        PluginBus of the active plugin, if active.
+        """
+        return self._plugin_bus
+
+    @property
+    def plugin_module(self) -> Optional[str]:
+        """
+        Module the plugin is loaded from, without importing it.
+        """
+        module = getattr(self._entrypoint, "module", None)
+        return module if isinstance(module, str) else None
+
+    def _register_stubs(self):
+        for msg_type in self.message_types:
+            self.bus.on(msg_type, self._on_message)
+
+    def _remove_stubs(self):
+        for msg_type in self.message_types:
+            self.bus.remove(msg_type, self._on_message)
+
+    def _on_message(self, message: Message):
+        with self._lock:
+            plugin_bus = self._plugin_bus
+            if not plugin_bus:
+                # The triggering message was emitted before the plugin
+                # registered its handlers; deliver it once active.
+                self._pending.append(message)
+                if self._activating:
+                    return
+                self._activating = True
+        if plugin_bus:
+            # Delivered to the stub just before it was replaced
+            plugin_bus.dispatch(message)
+        elif not self.executor:
+            self._activate_pending()
+        elif not self.executor.submit(self.name, self._activate_pending):
+            LOG.error(f"Unable to queue activation of {self.name}")
+            with self._lock:
+                self._activating = False
+                self._pending.clear()
+
+    def _activate_pending(self):
+        self.activate()
+        with self._lock:
+            pending, self._pending = self._pending, list()
+            self._activating = False
+            plugin_bus = self._plugin_bus
+        if plugin_bus:
+            for message in pending:
+                plugin_bus.dispatch(message)
+
+    def activate(self):
+        """
+        Import and initialize the plugin, replacing stub handlers. If the
+        plugin fails to load, stubs are kept so activation is retried on the
+        next matching message.
+        """
+        with self._activation_lock:
+            with self._lock:
+                if self.active or self._stopped:
+                    return
+            start = monotonic()
+            try:
+                plug = self._entrypoint.load()
+                if hasattr(plug, "validator") and \
+                        not plug.validator.validate(self.config):
+                    LOG.warning(f"PHAL plugin {self.name} failed validation")
+                    return
+                plugin_bus = PluginBus(self.bus, self.name, self.metrics,
+                                       self.executor, self.coalescer,
+                                       self.tracer)
+                # Subscribe after stubs are removed so no message is handled
+                # by both a stub and the plugin
+                plugin_bus.hold_subscriptions()
+                state = self.state_store.get(self.name) \
+                    if self.state_store else None
+                optional = {"scheduler": self.scheduler.for_plugin(
+                    self.name)} if self.scheduler else None
+                plugin = call_as_plugin(self.name, init_plugin, plug, state,
+                                        optional, bus=plugin_bus,
+                                        config=self.config)
+            except Exception:
+                LOG.exception(f"failed to load PHAL plugin: {self.name}")
+                if self.scheduler:
+                    self.scheduler.cancel_plugin(self.name)
+                return
+            with self._lock:
+                self._remove_stubs()
+                plugin_bus.release_subscriptions()
+                self._plugin_bus = plugin_bus
+                self.plugin = plugin
+                if self._stopped:
+                    # Shut down while loading
+                    self._shutdown_plugin()
+                    return
+                LOG.info(f"PHAL plugin activated: {self.name} "
+                         f"({round(monotonic() - start, 3)}s)")
+                self._schedule_idle_check(self.idle_timeout)
+
+    def deactivate(self):
+        """
+        Shut down the plugin and restore stub handlers.
+        """
+        with self._lock:
+            if not self.active:
+                return
+            self._shutdown_plugin()
+            self._register_stubs()
+            LOG.info(f"PHAL plugin deactivated: {self.name}")
+
+    def _shutdown_plugin(self):
+        if self._idle_timer:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if self.state_store:
+            save_plugin_state(self.name, self.plugin, self.state_store)
+        if self.scheduler:
+            self.scheduler.cancel_plugin(self.name)
+        try:
+            if hasattr(self.plugin, "shutdown"):
+                self.plugin.shutdown()
+        except Exception as e:
+            LOG.error(f"Error shutting down {self.name}: {e}")
+        self._plugin_bus.remove_all()
+        if self.executor:
+            # Queued calls must not run against the shut down plugin
+            self.executor.clear(self.name)
+        self._plugin_bus = None
+        self.plugin = None
+
+    def _schedule_idle_check(self, delay: Optional[float]):
+        if not delay:
+            return
+        self._idle_timer = Timer(delay, self._check_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _check_idle(self):
+        with self._lock:
+            if not self.active:
+                return
+            # `last_used` is updated when calls are queued and finish
+            idle = monotonic() - self._plugin_bus.last_used
+            busy = self._plugin_bus.active_calls or (
+                self.executor and self.executor.get_stats(self.name).get(
+                    self.name, {}).get("depth"))
+            if busy:
+                self._schedule_idle_check(self.idle_timeout)
+            elif idle >= self.idle_timeout:
+                LOG.debug(f"{self.name} idle for {round(idle)}s")
+                self.deactivate()
+            else:
+                self._schedule_idle_check(self.idle_timeout - idle)
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            if self.active:
+                self._shutdown_plugin()
+            else:
+                self._remove_stubs()
@@ -0,0 +1,175 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait, \
+    FIRST_COMPLETED
+from threading import Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+from ovos_utils.log import LOG
+
+
+def load_plugins_concurrently(builders: Dict[str, Callable[[], object]],
+                              load_after: Optional[Dict[str, List[str]]] = None,
+                              critical: Optional[List[str]] = None,
+                              max_workers: int = 4,
+                              prerequisites: Optional[Dict[str, Future]] = None
+                              ) -> Tuple[Dict[str, object], Dict[str, float]]:
+    """
+    Build plugins on a worker pool, respecting ordering constraints.
+    :param builders: dict of plugin name to callable returning the plugin
+    :param load_after: dict of plugin name to plugins that must finish loading
+        before it is started
+    :param critical: plugins that must finish loading before any other plugin
+        is started
+    :param max_workers: max number of plugins to build concurrently
+    :param prerequisites: dict of name to Future that plugins may reference in
+        `load_after` to wait on something other than a plugin
+    :returns: dict of loaded plugin names to objects,
+        dict of plugin names to load time in seconds
+    """
+    load_after = load_after or dict()
+    prerequisites = prerequisites or dict()
+    critical = [name for name in critical or [] if name in builders]
+    pending = dict()
+    for name in builders:
+        deps = set(dep for dep in load_after.get(name) or []
+                   if (dep in builders or dep in prerequisites)
+                   and dep != name)
+        if name not in critical:
+            deps.update(critical)
+        pending[name] = deps
+
+    loaded = dict()
+    load_times = dict()
+
+    def _build(name: str):
+        start = monotonic()
+        try:
+            plugin = builders[name]()
+        except Exception:
+            LOG.exception(f"failed to load PHAL plugin: {name}")
+            plugin = None
+        load_times[name] = monotonic() - start
+        return plugin
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1),
+                            thread_name_prefix="phal_loader") as executor:
+        futures = {future: name for name, future in prerequisites.items()}
+
+        def _submit_ready():
+            for name in [n for n, deps in pending.items() if not deps]:
+                pending.pop(name)
+                futures[executor.submit(_build, name)] = name
+
+        _submit_ready()
+        while futures or pending:
+            if not futures:
+                LOG.warning(f"Circular load order between plugins: "
+                            f"{list(pending.keys())}")
+                for deps in pending.values():
+                    deps.clear()
+                _submit_ready()
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                if name in prerequisites:
+                    LOG.debug(f"Prerequisite resolved: {name}")
+                elif future.result() is not None:
+                    loaded[name] = future.result()
+                    LOG.info(f"PHAL plugin loaded: {name} "
+                             f"({round(load_times[name], 3)}s)")
+                else:
+                    waiting = [n for n, deps in pending.items()
+                               if name in deps]
+                    if waiting:
+                        LOG.warning(f"{waiting} will load without {name}")
+                for deps in pending.values():
+                    deps.discard(name)
+            _submit_ready()
+
+    # Preserve configured plugin order for consumers iterating drivers
+    loaded = {name: loaded[name] for name in builders if name in loaded}
+    return loaded, load_times
+
+
+def shutdown_plugins(drivers: Dict[str, object],
+                     timeouts: Optional[Dict[str, float]] = None,
+                     default_timeout: float = 10,
+                     total_timeout: float = 30,
+                     before_shutdown: Optional[Callable[[str, object],
+                                                        None]] = None) -> dict:
+    """
+    Shut down plugins concurrently, abandoning any that exceed their deadline.
+    :param drivers: dict of plugin name to plugin object
+    :param timeouts: dict of plugin name to seconds allowed for shutdown
+    :param default_timeout: seconds allowed for plugins not in `timeouts`
+    :param total_timeout: max seconds to wait for all plugins
+    :param before_shutdown: called with each plugin name and object before
+        it is shut down, within the same deadline (i.e. to save state)
+    :returns: dict report of `completed`, `timed_out`, and `errors` plugins
+        and shutdown `durations` in seconds
+    """
+    timeouts = timeouts or dict()
+    report = {"completed": [], "timed_out": [], "errors": {}, "durations": {}}
+
+    def _shutdown(name: str, plugin):
+        start = monotonic()
+        try:
+            if before_shutdown:
+                before_shutdown(name, plugin)
+            if hasattr(plugin, 'shutdown'):
+                LOG.debug(f"Shutting Down {name}")
+                plugin.shutdown()
+        except Exception as e:
+            LOG.error(f"Error shutting down {name}: {e}")
+            report["errors"][name] = repr(e)
+        report["durations"][name] = monotonic() - start
+
+    start = monotonic()
+    deadline = start + total_timeout
+    threads = dict()
+    for name, plugin in drivers.items():
+        if not hasattr(plugin, 'shutdown') and not before_shutdown:
+            continue
+        # Daemon threads so a hung plugin cannot block interpreter exit
+        threads[name] = Thread(target=_shutdown, args=(name, plugin),
+                               name=f"shutdown_{name}", daemon=True)
+        threads[name].start()
+    for name, thread in threads.items():
+        plugin_deadline = start + timeouts.get(name, default_timeout)
+        thread.join(max(min(plugin_deadline, deadline) - monotonic(), 0))
+        if thread.is_alive():
+            report["timed_out"].append(name)
+        elif name not in report["errors"]:
+            report["completed"].append(name)
+    if report["timed_out"]:
+        LOG.warning(f"Plugins exceeded shutdown deadline: "
+                    f"{report['timed_out']}")
+    LOG.debug(f"Plugins shut down in {round(monotonic() - start, 3)}s")
+    return report
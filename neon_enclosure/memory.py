@@ -0,0 +1,246 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import tracemalloc
+
+from importlib.util import find_spec
+from os import makedirs
+from os.path import dirname, join
+from threading import Event, Lock, Thread
+from time import time
+from typing import Dict, Optional
+
+from ovos_bus_client.message import Message
+from ovos_utils.log import LOG
+from ovos_utils.xdg_utils import xdg_state_home
+
+
+def get_default_memory_log_path(service: str = "enclosure") -> str:
+    return join(xdg_state_home(), "neon", f"{service}_memory.jsonl")
+
+
+def get_plugin_paths(drivers: dict) -> Dict[str, str]:
+    """
+    Get the source location of each plugin's top-level package.
+    :param drivers: dict of plugin name to plugin object
+    :returns: dict of plugin name to package directory or module file
+    """
+    paths = dict()
+    for name, driver in drivers.items():
+        module = getattr(driver, "plugin_module", None) or \
+            type(driver).__module__
+        try:
+            spec = find_spec(module.split('.')[0])
+        except (ImportError, ValueError):
+            continue
+        if spec and spec.submodule_search_locations:
+            paths[name] = list(spec.submodule_search_locations)[0]
+        elif spec and spec.origin:
+            paths[name] = spec.origin
+    return paths
+
+
+def init_memory_profiler(service: str = "enclosure",
+                         config: Optional[dict] = None) -> "MemoryProfiler":
+    """
+    Build a MemoryProfiler from configuration, starting it if enabled.
+    :param service: `enclosure` or `admin`
+    :param config: global configuration (defaults to `Configuration()`)
+    :returns: MemoryProfiler for the service
+    """
+    if config is None:
+        from ovos_config.config import Configuration
+        config = Configuration()
+    phal_config = config.get("PHAL") or dict()
+    if service == "admin":
+        phal_config = phal_config.get("admin") or dict()
+    profiler_config = phal_config.get("memory_profiler") or dict()
+    # Legacy `debugging.tracemalloc` config enables profiling at boot
+    debugging = config.get("debugging") or dict()
+    profiler = MemoryProfiler(
+        profiler_config.get("interval",
+                            debugging.get("log_interval_minutes", 5) * 60),
+        profiler_config.get("stack_depth", 4),
+        profiler_config.get("path") or get_default_memory_log_path(service),
+        profiler_config.get("limit", 10))
+    if profiler_config.get("enabled") or debugging.get("tracemalloc"):
+        profiler.start()
+    return profiler
+
+
+class MemoryProfiler:
+    """
+    Periodically compares tracemalloc snapshots and attributes memory growth
+    to PHAL plugins. Tracing only runs while the profiler is started, so it
+    can be enabled on a running service to investigate a leak.
+    """
+    def __init__(self, interval: float = 300, stack_depth: int = 4,
+                 path: Optional[str] = None, limit: int = 10):
+        """
+        :param interval: seconds between snapshots
+        :param stack_depth: number of frames to trace for each allocation
+        :param path: JSON lines file to append samples to
+        :param limit: number of top allocation sites to include in samples
+        """
+        self.interval = interval
+        self.stack_depth = stack_depth
+        self.path = path or get_default_memory_log_path()
+        self.limit = limit
+        self.plugin_paths: Dict[str, str] = dict()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        # True if tracing was started by this profiler rather than before it
+        self._started_tracing = False
+        self._stopping = Event()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+        self._bus = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def bind(self, bus, namespace: str = "neon.phal"):
+        """
+        Register bus handlers to control the profiler.
+        :param bus: MessageBusClient to register handlers with
+        :param namespace: message type prefix (i.e. `neon.phal`)
+        """
+        bus.on(f"{namespace}.memory_profiler.start", self._handle_start)
+        bus.on(f"{namespace}.memory_profiler.stop", self._handle_stop)
+        bus.on(f"{namespace}.memory_profiler.sample", self._handle_sample)
+        self._bus = bus
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            LOG.info(f"Starting memory profiler (interval={self.interval}s)")
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start(self.stack_depth)
+            self._snapshot = self._take_snapshot()
+            self._stopping.clear()
+            self._thread = Thread(target=self._run, name="memory_profiler",
+                                  daemon=True)
+            self._thread.start()
+
+    def stop(self) -> Optional[dict]:
+        """
+        Take a final sample and stop tracing if this profiler started it.
+        :returns: final sample if the profiler was running
+        """
+        with self._lock:
+            if not self.running:
+                return None
+            self._stopping.set()
+            self._thread.join(5)
+            self._thread = None
+        sample = self.sample()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._snapshot = None
+        LOG.info("Stopped memory profiler")
+        return sample
+
+    def toggle(self, *_):
+        """
+        Start the profiler if stopped, else stop it. Accepts (and ignores)
+        signal handler arguments.
+        """
+        if self.running:
+            Thread(target=self.stop, daemon=True).start()
+        else:
+            self.start()
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>")))
+
+    def _get_owner(self, traceback: tracemalloc.Traceback) -> str:
+        # Attribute to the innermost frame in plugin code
+        for frame in reversed(traceback):
+            for plugin, path in self.plugin_paths.items():
+                if frame.filename.startswith(path):
+                    return plugin
+        return "other"
+
+    def sample(self) -> Optional[dict]:
+        """
+        Compare memory usage to the previous sample and persist the result.
+        :returns: dict sample, or None if tracing is not running
+        """
+        if not tracemalloc.is_tracing() or self._snapshot is None:
+            return None
+        snapshot = self._take_snapshot()
+        diff = snapshot.compare_to(self._snapshot, "traceback")
+        self._snapshot = snapshot
+        growth = dict()
+        for stat in diff:
+            owner = self._get_owner(stat.traceback)
+            growth[owner] = growth.get(owner, 0) + stat.size_diff
+        current, peak = tracemalloc.get_traced_memory()
+        sample = {"time": time(), "traced": current, "peak": peak,
+                  "growth": growth,
+                  "top": [{"file": stat.traceback[-1].filename,
+                           "line": stat.traceback[-1].lineno,
+                           "size_diff": stat.size_diff,
+                           "count_diff": stat.count_diff}
+                          for stat in diff[:self.limit]]}
+        try:
+            makedirs(dirname(self.path), exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(sample) + "\n")
+        except OSError as e:
+            LOG.error(f"Failed to write memory sample: {e}")
+        LOG.debug(f"Memory growth by plugin: {growth}")
+        return sample
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                LOG.exception(e)
+
+    def _handle_start(self, message: Message):
+        self.start()
+        self._bus.emit(message.response({"running": self.running}))
+
+    def _handle_stop(self, message: Message):
+        sample = self.stop()
+        self._bus.emit(message.response({"running": self.running,
+                                         "sample": sample}))
+
+    def _handle_sample(self, message: Message):
+        self._bus.emit(message.response({"running": self.running,
+                                         "sample": self.sample()}))
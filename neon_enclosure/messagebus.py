@@ -0,0 +1,275 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from itertools import count
+from random import uniform
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from ovos_bus_client.client import MessageBusClient
+from ovos_bus_client.message import Message
+from ovos_bus_client.session import Session, SessionManager
+from ovos_utils.log import LOG
+from websocket import WebSocketConnectionClosedException
+
+
+class OutboundBuffer:
+    """
+    Bounded, ordered buffer of messages that could not be sent. Messages of
+    `collapse` types replace any buffered message of the same type, so only
+    the latest state is replayed. Message types may be glob patterns.
+    """
+    def __init__(self, max_size: int = 500, default_retention: float = 60,
+                 retention: Optional[Dict[str, float]] = None,
+                 collapse: Optional[List[str]] = None):
+        """
+        :param max_size: max messages buffered; the oldest are dropped
+        :param default_retention: seconds messages are kept for replay
+        :param retention: dict of message type to seconds kept for replay;
+            0 does not buffer messages of that type
+        :param collapse: message types for which only the latest is kept
+        """
+        self.max_size = max(max_size, 1)
+        self.default_retention = default_retention
+        self.retention = retention or dict()
+        self.collapse = collapse or list()
+        self._messages: "OrderedDict[object, Tuple[Message, float]]" = \
+            OrderedDict()
+        self._keys = count()
+        self._rules: Dict[str, Tuple[float, bool]] = dict()
+        self.stats = {"buffered": 0, "dropped": 0, "expired": 0,
+                      "collapsed": 0, "replayed": 0}
+
+    def _get_rules(self, msg_type: str) -> Tuple[float, bool]:
+        rules = self._rules.get(msg_type)
+        if rules is None:
+            retention = self.default_retention
+            for pattern, seconds in self.retention.items():
+                if fnmatchcase(msg_type, pattern):
+                    retention = seconds
+                    break
+            collapse = any(fnmatchcase(msg_type, pattern)
+                           for pattern in self.collapse)
+            rules = self._rules[msg_type] = (retention, collapse)
+        return rules
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(self, message: Message):
+        """
+        Buffer a message for replay.
+        """
+        retention, collapse = self._get_rules(message.msg_type)
+        if not retention:
+            self.stats["dropped"] += 1
+            return
+        if collapse:
+            key = ("collapse", message.msg_type)
+            if self._messages.pop(key, None):
+                self.stats["collapsed"] += 1
+        else:
+            key = next(self._keys)
+        self._messages[key] = (message, monotonic() + retention)
+        self.stats["buffered"] += 1
+        while len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)
+            self.stats["dropped"] += 1
+
+    def pop(self) -> Optional[Message]:
+        """
+        Get the oldest unexpired message.
+        :returns: Message, or None if the buffer is empty
+        """
+        now = monotonic()
+        while self._messages:
+            _, (message, expires) = self._messages.popitem(last=False)
+            if expires >= now:
+                return message
+            self.stats["expired"] += 1
+        return None
+
+    def push_front(self, message: Message):
+        """
+        Return a message that failed to replay to the front of the buffer.
+        """
+        key = ("collapse", message.msg_type) \
+            if self._get_rules(message.msg_type)[1] else next(self._keys)
+        if key in self._messages:
+            # A newer state was buffered since
+            return
+        self._messages[key] = (message, monotonic() +
+                               self._get_rules(message.msg_type)[0])
+        self._messages.move_to_end(key, last=False)
+
+
+class ResilientBusClient(MessageBusClient):
+    """
+    MessageBusClient that buffers messages emitted while disconnected and
+    replays them in order after reconnecting. Reconnect attempts back off
+    exponentially with random jitter so services do not reconnect in step.
+    """
+    def __init__(self, *args, buffer: Optional[OutboundBuffer] = None,
+                 min_retry: float = 1, max_retry: float = 60, **kwargs):
+        """
+        :param buffer: OutboundBuffer for messages emitted while disconnected
+        :param min_retry: min seconds before reconnecting
+        :param max_retry: max seconds before reconnecting
+        """
+        self.buffer = buffer or OutboundBuffer()
+        self.min_retry = min_retry
+        self.max_retry = max_retry
+        self._attempts = 0
+        self._replaying = False
+        self._buffer_lock = Lock()
+        self._closing = Event()
+        MessageBusClient.__init__(self, *args, **kwargs)
+
+    def get_retry_delay(self) -> float:
+        """
+        :returns: seconds to wait before the next reconnect attempt
+        """
+        limit = min(self.min_retry * 2 ** self._attempts, self.max_retry)
+        # "Full jitter" spreads out clients that disconnected together
+        return uniform(self.min_retry, max(limit, self.min_retry))
+
+    def run_forever(self):
+        self.started_running = True
+        while not self._closing.is_set():
+            self.client.run_forever()
+            self.connected_event.clear()
+            if self._closing.is_set():
+                break
+            delay = self.get_retry_delay()
+            self._attempts += 1
+            LOG.warning(f"Messagebus disconnected; reconnecting in "
+                        f"{round(delay, 1)}s ({len(self.buffer)} messages "
+                        f"buffered)")
+            if self._closing.wait(delay):
+                break
+            self.emitter.emit("reconnecting")
+            self.client = self.create_client()
+
+    def on_open(self, *args):
+        with self._buffer_lock:
+            # Connect and decide on replay together so nothing emitted in
+            # between is left in the buffer; messages emitted during replay
+            # are buffered behind it
+            self.connected_event.set()
+            self._replaying = len(self.buffer) > 0
+        self._attempts = 0
+        MessageBusClient.on_open(self, *args)
+        if self._replaying:
+            Thread(target=self._replay, name="bus_replay",
+                   daemon=True).start()
+
+    def on_close(self, *args):
+        self.connected_event.clear()
+        MessageBusClient.on_close(self, *args)
+
+    def on_error(self, *args):
+        # Reconnection is handled by `run_forever`
+        error = args[-1] if args else None
+        LOG.warning(f"Messagebus error: {error!r}")
+        try:
+            self.emitter.emit("error", error)
+        except Exception as e:
+            LOG.exception(f"Failed to emit error event: {e}")
+
+    def close(self):
+        self._closing.set()
+        MessageBusClient.close(self)
+
+    def _send(self, message: Message) -> bool:
+        try:
+            self.client.send(message.serialize())
+            return True
+        except (WebSocketConnectionClosedException, OSError):
+            return False
+        except Exception as e:
+            if not self.connected_event.is_set():
+                return False
+            LOG.exception(f"Failed to emit {message.msg_type}: {e}")
+            # Not a connection problem; don't buffer it
+            return True
+
+    def emit(self, message: Message):
+        if "session" not in message.context:
+            session = SessionManager.sessions.get(self.session_id) or \
+                Session(self.session_id)
+            message.context["session"] = session.serialize()
+        with self._buffer_lock:
+            if self._replaying or not self.connected_event.is_set():
+                self.buffer.add(message)
+                return
+        if not self._send(message):
+            with self._buffer_lock:
+                self.buffer.add(message)
+
+    def _replay(self):
+        start = monotonic()
+        replayed = 0
+        while True:
+            with self._buffer_lock:
+                message = self.buffer.pop()
+                if message is None:
+                    self._replaying = False
+                    break
+            if not self._send(message):
+                with self._buffer_lock:
+                    self.buffer.push_front(message)
+                    self._replaying = False
+                break
+            replayed += 1
+        with self._buffer_lock:
+            self.buffer.stats["replayed"] += replayed
+        LOG.info(f"Replayed {replayed} buffered messages in "
+                 f"{round(monotonic() - start, 3)}s")
+
+
+def get_resilient_bus(config: Optional[dict] = None) -> ResilientBusClient:
+    """
+    Connect a ResilientBusClient in a background thread.
+    :param config: `bus_buffer` configuration (default from `PHAL`)
+    :returns: ResilientBusClient
+    """
+    if config is None:
+        from ovos_config.config import Configuration
+        config = (Configuration().get("PHAL") or {}).get("bus_buffer") or {}
+    buffer = OutboundBuffer(config.get("size", 500),
+                            config.get("retention", 60),
+                            config.get("type_retention"),
+                            config.get("collapse"))
+    bus = ResilientBusClient(buffer=buffer,
+                             min_retry=config.get("min_retry", 1),
+                             max_retry=config.get("max_retry", 60))
+    bus.run_in_thread()
+    return bus
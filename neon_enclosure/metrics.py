@@ -0,0 +1,166 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from ovos_utils.log import LOG
+
+# Histogram bucket upper bounds in seconds; the last bucket is unbounded
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+
+
+class _HandlerStats:
+    __slots__ = ("count", "total", "cpu", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.cpu = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+def estimate_percentile(buckets: List[int], percentile: float) -> float:
+    """
+    Estimate a latency percentile from histogram bucket counts.
+    :param buckets: count of samples in each of `LATENCY_BUCKETS` (+ overflow)
+    :param percentile: percentile to estimate (0-100)
+    :returns: upper bound of the bucket containing the percentile in seconds
+    """
+    target = sum(buckets) * percentile / 100
+    seen = 0
+    for idx, count in enumerate(buckets):
+        seen += count
+        if count and seen >= target:
+            return LATENCY_BUCKETS[idx] if idx < len(LATENCY_BUCKETS) \
+                else float("inf")
+    return 0.0
+
+
+class HandlerMetrics:
+    """
+    Call counts and latency histograms of bus handlers by plugin and message
+    type. Handlers that take longer than `slow_threshold` seconds are logged.
+    """
+    def __init__(self, slow_threshold: Optional[float] = 0.5):
+        self.slow_threshold = slow_threshold
+        self._stats: Dict[Tuple[str, str], _HandlerStats] = dict()
+        self._lock = Lock()
+
+    def record(self, plugin: str, msg_type: str, duration: float,
+               cpu_time: float = 0.0):
+        """
+        Record a handler call.
+        :param plugin: name of the plugin that handled the message
+        :param msg_type: message type handled
+        :param duration: seconds spent in the handler
+        :param cpu_time: CPU seconds used by the handler's thread
+        """
+        with self._lock:
+            stats = self._stats.get((plugin, msg_type))
+            if stats is None:
+                stats = self._stats[(plugin, msg_type)] = _HandlerStats()
+            stats.count += 1
+            stats.total += duration
+            stats.cpu += cpu_time
+            if duration > stats.max:
+                stats.max = duration
+            stats.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        if self.slow_threshold and duration > self.slow_threshold:
+            LOG.warning(f"Slow handler: {plugin} took {round(duration, 3)}s "
+                        f"to handle {msg_type}")
+
+    def get_metrics(self, plugin: Optional[str] = None) -> dict:
+        """
+        Get a serializable summary of handler metrics.
+        :param plugin: optional plugin name to get metrics for
+        :returns: dict of plugin name to message type to metrics
+        """
+        metrics = dict()
+        with self._lock:
+            for (name, msg_type), stats in self._stats.items():
+                if plugin and name != plugin:
+                    continue
+                metrics.setdefault(name, dict())[msg_type] = {
+                    "count": stats.count,
+                    "total": stats.total,
+                    "cpu": stats.cpu,
+                    "max": stats.max,
+                    "p50": estimate_percentile(stats.buckets, 50),
+                    "p95": estimate_percentile(stats.buckets, 95),
+                    "buckets": list(stats.buckets)}
+        return metrics
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def format_handler_metrics(metrics: dict) -> str:
+    """
+    Format handler metrics as a text table.
+    :param metrics: dict returned by `HandlerMetrics.get_metrics`
+    :returns: multi-line string table
+    """
+    rows = [("plugin", "message", "count", "mean ms", "p95 ms", "max ms")]
+    for plugin, handlers in sorted(metrics.items()):
+        for msg_type, stats in sorted(handlers.items()):
+            rows.append((plugin, msg_type, str(stats["count"]),
+                         f"{1000 * stats['total'] / stats['count']:.2f}",
+                         f"<={1000 * stats['p95']:.1f}",
+                         f"{1000 * stats['max']:.2f}"))
+    return format_table(rows)
+
+
+def format_queue_stats(queues: dict) -> str:
+    """
+    Format handler queue stats as a text table.
+    :param queues: dict returned by `HandlerExecutor.get_stats`
+    :returns: multi-line string table
+    """
+    rows = [("plugin", "depth", "max depth", "processed", "dropped",
+             "rejected")]
+    for plugin, stats in sorted(queues.items()):
+        rows.append((plugin, str(stats["depth"]), str(stats["max_depth"]),
+                     str(stats["processed"]), str(stats["dropped"]),
+                     str(stats["rejected"])))
+    return format_table(rows)
+
+
+def format_table(rows: list) -> str:
+    """
+    Format rows of strings as left-aligned columns.
+    :param rows: list of equal-length tuples; the first is the header
+    :returns: multi-line string table
+    """
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(col.ljust(widths[i]) for i, col in
+                               enumerate(row)) for row in rows)
@@ -0,0 +1,119 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from contextlib import contextmanager
+from os import makedirs, replace
+from os.path import dirname, join
+from threading import Lock
+from time import monotonic
+from typing import List, Optional
+
+from ovos_utils.xdg_utils import xdg_state_home
+
+
+def get_default_timeline_path() -> str:
+    return join(xdg_state_home(), "neon", "enclosure_startup.json")
+
+
+class StartupTimeline:
+    """
+    Records monotonic start times and durations of service startup phases.
+    Times are reported in seconds relative to the creation of the timeline.
+    """
+    def __init__(self):
+        self.origin = monotonic()
+        self.phases: List[dict] = list()
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str, category: str = "service"):
+        """
+        Context manager to record the enclosed code as a phase.
+        :param name: name of the phase
+        :param category: phase category (i.e. `service`, `plugin`)
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, start, monotonic(), category)
+
+    def record(self, name: str, start: float, end: float,
+               category: str = "service"):
+        """
+        Record a phase from monotonic timestamps.
+        :param name: name of the phase
+        :param start: monotonic time the phase started
+        :param end: monotonic time the phase ended
+        :param category: phase category (i.e. `service`, `plugin`)
+        """
+        with self._lock:
+            self.phases.append({"name": name, "category": category,
+                                "start": start - self.origin,
+                                "duration": end - start})
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            phases = sorted(self.phases, key=lambda p: p["start"])
+        total = max([p["start"] + p["duration"] for p in phases] or [0])
+        return {"total": total, "phases": phases}
+
+    def save(self, path: Optional[str] = None) -> str:
+        """
+        Write the timeline to a JSON file.
+        :param path: file to write (default in XDG state directory)
+        :returns: path written to
+        """
+        path = path or get_default_timeline_path()
+        makedirs(dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        replace(f"{path}.tmp", path)
+        return path
+
+    def format_waterfall(self, width: int = 40) -> str:
+        """
+        Format the timeline as a text waterfall chart.
+        :param width: number of characters representing the total duration
+        :returns: multi-line string chart
+        """
+        timeline = self.to_dict()
+        scale = width / (timeline["total"] or 1)
+        name_width = max([len(p["name"]) for p in timeline["phases"]] or [0])
+        lines = [f"{'phase':<{name_width}}    start  duration"]
+        for phase in timeline["phases"]:
+            offset = int(phase["start"] * scale)
+            bar = "#" * max(int(phase["duration"] * scale), 1)
+            lines.append(f"{phase['name']:<{name_width}} "
+                         f"{phase['start']:7.3f}s {phase['duration']:7.3f}s "
+                         f"|{' ' * offset}{bar:<{width - offset}}|")
+        lines.append(f"{'total':<{name_width}} {'':8} "
+                     f"{timeline['total']:7.3f}s")
+        return "\n".join(lines)
@@ -0,0 +1,302 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from heapq import heappop, heappush
+from itertools import count
+from math import ceil
+from random import uniform
+from threading import Condition, Lock, Thread
+from time import monotonic, time
+from typing import Callable, Dict, List, Optional
+
+from ovos_utils.log import LOG
+
+from neon_enclosure.executor import HandlerExecutor
+
+
+class _ScheduledJob:
+    __slots__ = ("job_id", "name", "plugin", "fn", "interval", "jitter",
+                 "align", "due", "seq", "pending", "cancelled", "runs",
+                 "coalesced", "errors", "total", "max", "max_lag")
+
+    def __init__(self, job_id: str, name: str, plugin: Optional[str],
+                 fn: Callable, interval: Optional[float], jitter: float,
+                 align: bool):
+        self.job_id = job_id
+        self.name = name
+        self.plugin = plugin
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.align = align
+        self.due = 0.0
+        self.seq = -1
+        self.pending = False
+        self.cancelled = False
+        self.runs = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.max_lag = 0.0
+
+
+class Scheduler:
+    """
+    Runs delayed and periodic jobs on a shared pool of threads. A periodic
+    job is never run concurrently with itself; runs that come due while the
+    previous run is in progress (or that were missed) are coalesced into the
+    next run. Wakeups may be aligned to `granularity` seconds so jobs with
+    similar due times run together.
+    """
+    def __init__(self, max_workers: int = 2, granularity: float = 0):
+        """
+        :param max_workers: number of threads running jobs
+        :param granularity: round due times up to a multiple of this many
+            seconds; 0 runs jobs exactly when due
+        """
+        self.granularity = granularity
+        self._executor = HandlerExecutor(max_workers, 1, "reject")
+        self._jobs: Dict[str, _ScheduledJob] = dict()
+        self._heap: List[tuple] = list()
+        self._ids = count(1)
+        self._seq = count()
+        self._lock = Lock()
+        self._wake = Condition(self._lock)
+        self._running = True
+        self._thread = Thread(target=self._run, name="phal_scheduler",
+                              daemon=True)
+        self._thread.start()
+
+    def _get_due(self, base: float, job: _ScheduledJob) -> float:
+        due = base + (uniform(0, job.jitter) if job.jitter else 0)
+        step = job.interval if job.align and job.interval else \
+            self.granularity
+        if step:
+            # Align on the wall clock so wakeups match across jobs and
+            # processes
+            offset = time() - monotonic()
+            due = ceil((due + offset) / step) * step - offset
+        return due
+
+    def _push(self, job: _ScheduledJob, due: float):
+        job.due = due
+        job.seq = next(self._seq)
+        heappush(self._heap, (due, job.seq, job))
+        self._wake.notify()
+
+    def schedule(self, fn: Callable, delay: float = 0,
+                 interval: Optional[float] = None, name: Optional[str] = None,
+                 jitter: float = 0, align: bool = False,
+                 plugin: Optional[str] = None) -> str:
+        """
+        Schedule a job.
+        :param fn: callable to run with no arguments
+        :param delay: seconds until the first run
+        :param interval: seconds between runs; if None, the job runs once
+        :param name: name to report stats under (default `fn` name)
+        :param jitter: max random seconds added to each due time
+        :param align: align runs of a periodic job to multiples of `interval`
+            on the wall clock
+        :param plugin: name of the plugin scheduling the job
+        :returns: job ID that may be used to cancel the job
+        """
+        if interval is not None and interval <= 0:
+            raise ValueError(f"Invalid interval: {interval}")
+        name = name or getattr(fn, "__name__", None) or repr(fn)
+        job = _ScheduledJob(str(next(self._ids)),
+                            f"{plugin}.{name}" if plugin else name, plugin,
+                            fn, interval, max(jitter, 0), align)
+        with self._lock:
+            if not self._running:
+                raise RuntimeError("Scheduler is stopped")
+            self._jobs[job.job_id] = job
+            self._push(job, self._get_due(monotonic() + max(delay, 0), job))
+        return job.job_id
+
+    def schedule_once(self, fn: Callable, delay: float, **kwargs) -> str:
+        """
+        Run `fn` once after `delay` seconds. See `schedule` for options.
+        """
+        return self.schedule(fn, delay, None, **kwargs)
+
+    def schedule_repeating(self, fn: Callable, interval: float,
+                           delay: Optional[float] = None, **kwargs) -> str:
+        """
+        Run `fn` every `interval` seconds, starting after `delay` seconds
+        (default `interval`). See `schedule` for options.
+        """
+        return self.schedule(fn, interval if delay is None else delay,
+                             interval, **kwargs)
+
+    def cancel(self, job_id: str, plugin: Optional[str] = None) -> bool:
+        """
+        Cancel a job. A run in progress is allowed to finish.
+        :param job_id: ID returned when the job was scheduled
+        :param plugin: only cancel the job if it was scheduled by this plugin
+        :returns: True if the job was cancelled
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and (plugin is None or job.plugin == plugin):
+                del self._jobs[job_id]
+                job.cancelled = True
+            else:
+                job = None
+        if job:
+            self._executor.clear(job_id)
+        return job is not None
+
+    def cancel_plugin(self, plugin: str) -> int:
+        """
+        Cancel all jobs scheduled by a plugin.
+        :param plugin: plugin name
+        :returns: number of jobs cancelled
+        """
+        with self._lock:
+            job_ids = [job_id for job_id, job in self._jobs.items()
+                       if job.plugin == plugin]
+        return len([job_id for job_id in job_ids if self.cancel(job_id)])
+
+    def _run(self):
+        with self._lock:
+            while self._running:
+                if not self._heap:
+                    self._wake.wait()
+                    continue
+                due, seq, job = self._heap[0]
+                now = monotonic()
+                if due > now:
+                    self._wake.wait(due - now)
+                    continue
+                heappop(self._heap)
+                if job.cancelled or job.seq != seq:
+                    continue
+                if job.pending:
+                    job.coalesced += 1
+                else:
+                    job.pending = True
+                    self._executor.submit(job.job_id, self._execute, job,
+                                          due)
+                if job.interval:
+                    # Skip runs that were missed entirely
+                    missed = int((now - due) // job.interval)
+                    job.coalesced += missed
+                    self._push(job, self._get_due(
+                        due + (missed + 1) * job.interval, job))
+
+    def _execute(self, job: _ScheduledJob, due: float):
+        start = monotonic()
+        try:
+            job.fn()
+        except Exception as e:
+            job.errors += 1
+            LOG.exception(f"Scheduled job {job.name} raised: {e}")
+        duration = monotonic() - start
+        with self._lock:
+            job.pending = False
+            job.runs += 1
+            job.total += duration
+            job.max = max(job.max, duration)
+            job.max_lag = max(job.max_lag, start - due)
+            once = not job.interval
+            if once:
+                self._jobs.pop(job.job_id, None)
+        if once:
+            # Drop the executor queue for the finished job
+            self._executor.clear(job.job_id)
+
+    def get_stats(self, plugin: Optional[str] = None) -> Dict[str, dict]:
+        """
+        :param plugin: only return jobs scheduled by this plugin
+        :returns: dict of job ID to job `name`, `plugin`, `runs`,
+            `coalesced` runs, `errors`, `mean` and `max` duration, `max_lag`
+            (seconds a run started late), `interval`, and seconds until the
+            `next_run`
+        """
+        now = monotonic()
+        with self._lock:
+            return {job.job_id: {"name": job.name, "plugin": job.plugin,
+                                 "runs": job.runs,
+                                 "coalesced": job.coalesced,
+                                 "errors": job.errors,
+                                 "mean": job.total / job.runs if job.runs
+                                 else 0.0,
+                                 "max": job.max, "max_lag": job.max_lag,
+                                 "interval": job.interval,
+                                 "next_run": max(job.due - now, 0.0)}
+                    for job in self._jobs.values()
+                    if plugin is None or job.plugin == plugin}
+
+    def for_plugin(self, plugin: str) -> "PluginScheduler":
+        """
+        Get a view of this scheduler for a plugin. Jobs scheduled through it
+        are named for the plugin and cancelled together when it is unloaded.
+        """
+        return PluginScheduler(self, plugin)
+
+    def shutdown(self, timeout: Optional[float] = 5):
+        """
+        Cancel all jobs and stop worker threads.
+        """
+        with self._lock:
+            self._running = False
+            for job in self._jobs.values():
+                job.cancelled = True
+            self._jobs.clear()
+            self._heap.clear()
+            self._wake.notify_all()
+        self._thread.join(timeout)
+        self._executor.shutdown(timeout=timeout)
+
+
+class PluginScheduler:
+    """
+    Scheduler view passed to plugins accepting a `scheduler` init argument.
+    """
+    def __init__(self, scheduler: Scheduler, plugin: str):
+        self._scheduler = scheduler
+        self.plugin = plugin
+
+    def schedule_once(self, fn: Callable, delay: float, **kwargs) -> str:
+        return self._scheduler.schedule_once(fn, delay, plugin=self.plugin,
+                                             **kwargs)
+
+    def schedule_repeating(self, fn: Callable, interval: float,
+                           delay: Optional[float] = None, **kwargs) -> str:
+        return self._scheduler.schedule_repeating(fn, interval, delay,
+                                                  plugin=self.plugin, **kwargs)
+
+    def cancel(self, job_id: str) -> bool:
+        return self._scheduler.cancel(job_id, self.plugin)
+
+    def cancel_all(self) -> int:
+        return self._scheduler.cancel_plugin(self.plugin)
+
+    def get_stats(self) -> Dict[str, dict]:
+        return self._scheduler.get_stats(self.plugin)
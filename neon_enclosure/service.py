@@ -26,20 +26,145 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from threading import Event
+from concurrent.futures import Future
+from copy import deepcopy
+from functools import partial
+from random import uniform
+from threading import Event, Lock, Thread
 from ovos_PHAL import PHAL
-from ovos_plugin_manager.phal import find_phal_plugins
-from time import time
+from ovos_plugin_manager.utils import PluginTypes
+from time import time, monotonic
+from typing import Callable, Dict, List, Optional
 from ovos_bus_client.message import Message
 from ovos_utils.log import LOG
 
+from neon_enclosure.bus import PluginBus
+from neon_enclosure.coalesce import EmitCoalescer
+from neon_enclosure.cpu import CPU_ACCOUNTING_SUPPORTED, CPUAccounting, \
+    MetricsServer, call_as_plugin, format_prometheus
+from neon_enclosure.executor import HandlerExecutor, OVERFLOW_POLICIES
+from neon_enclosure.discovery import find_plugin_entrypoints
+from neon_enclosure.lazy import LazyPlugin
+from neon_enclosure.loader import load_plugins_concurrently, shutdown_plugins
+from neon_enclosure.memory import MemoryProfiler, get_plugin_paths
+from neon_enclosure.metrics import HandlerMetrics
+from neon_enclosure.profiling import StartupTimeline
+from neon_enclosure.scheduler import Scheduler
+from neon_enclosure.state import PluginStateStore, init_plugin, \
+    save_plugin_state
+from neon_enclosure.tracing import MessageTracer
+from neon_enclosure.watchdog import PluginWatchdog
+from neon_enclosure.workers import PluginWorker, WorkerSupervisor
+
 
 class NeonHardwareAbstractionLayer(PHAL):
-    def __init__(self, skill_id="neon.phal", **kwargs):
+    def __init__(self, skill_id="neon.phal",
+                 timeline: Optional[StartupTimeline] = None,
+                 memory_profiler: Optional[MemoryProfiler] = None,
+                 watch_config: Optional[bool] = None, **kwargs):
+        """
+        :param timeline: StartupTimeline to record startup phases to
+        :param memory_profiler: MemoryProfiler to bind to this service
+        :param watch_config: reload plugins when configuration changes; by
+            default, only if `config` is not passed
+        """
         LOG.info(f"Initializing PHAL")
         PHAL.__init__(self, skill_id=skill_id, **kwargs)
         self.status.set_alive()
         self.started = Event()
+        self.shutdown_report = dict()
+        self.load_times = dict()
+        self.timeline = timeline or StartupTimeline()
+        self.handler_metrics = HandlerMetrics(
+            self.user_config.get("slow_handler_threshold", 0.5)) \
+            if self.user_config.get("handler_metrics", True) else None
+        self.plugin_buses = dict()
+        self.cpu_accounting = self._init_cpu_accounting()
+        server_config = self.user_config.get("metrics_server") or {}
+        self.metrics_server = MetricsServer(
+            self.get_prometheus_metrics,
+            server_config.get("host", "127.0.0.1"),
+            server_config.get("port", 9464)) \
+            if self.cpu_accounting and server_config.get("enabled") else None
+        self.state_store = PluginStateStore(
+            self.user_config.get("state_path"),
+            self.user_config.get("state_max_age")) \
+            if self.user_config.get("state_snapshots", True) else None
+        self.handler_executor = self._init_handler_executor()
+        self.coalescer = EmitCoalescer(self.bus.emit,
+                                       self.user_config.get("coalesce") or {})
+        scheduler_config = self.user_config.get("scheduler") or {}
+        self.scheduler = Scheduler(scheduler_config.get("workers", 2),
+                                   scheduler_config.get("granularity", 0))
+        tracing_config = self.user_config.get("tracing") or {}
+        self.tracer = MessageTracer(
+            tracing_config.get("buffer_size", 1024),
+            tracing_config.get("sample_rate", 0.01)) \
+            if tracing_config.get("enabled", True) else None
+        self.memory_profiler = memory_profiler or MemoryProfiler()
+        self.memory_profiler.bind(self.bus, "neon.phal")
+        self.worker_supervisor = WorkerSupervisor(
+            self.user_config.get("worker_check_interval", 5),
+            self.user_config.get("worker_max_restarts", 5))
+        self.bus.on("neon.phal.get_startup_timeline",
+                    self.handle_get_startup_timeline)
+        self.bus.on("neon.phal.get_handler_metrics",
+                    self.handle_get_handler_metrics)
+        self.bus.on("neon.phal.get_worker_stats",
+                    self.handle_get_worker_stats)
+        self.bus.on("neon.phal.get_cpu_stats", self.handle_get_cpu_stats)
+        self.bus.on("neon.phal.get_traces", self.handle_get_traces)
+        self.bus.on("neon.phal.get_scheduler_stats",
+                    self.handle_get_scheduler_stats)
+        self.bus.on("neon.phal.get_message_types",
+                    self.handle_get_message_types)
+        self._reload_lock = Lock()
+        self.quarantined: Dict[str, str] = dict()
+        self._restarts: Dict[str, int] = dict()
+        watchdog_config = self.user_config.get("watchdog") or {}
+        self.watchdog = PluginWatchdog(
+            self._get_watched_plugins, self._on_plugin_failure,
+            self.handler_executor, self.handler_metrics,
+            watchdog_config.get("interval", 10),
+            watchdog_config.get("heartbeat_timeout", 30),
+            watchdog_config.get("handler_budget", 60),
+            watchdog_config.get("latency_budget", 5),
+            watchdog_config.get("max_misses", 3),
+            on_status=self._emit_plugin_status, notify=self._watchdog) \
+            if watchdog_config.get("enabled", True) else None
+        self.bus.on("neon.phal.get_plugin_status",
+                    self.handle_get_plugin_status)
+        self.bus.on("neon.phal.release_plugin", self.handle_release_plugin)
+        if watch_config is None:
+            # Only follow configuration changes if config was not passed in
+            watch_config = kwargs.get("config") is None
+        self._watch_config = watch_config and \
+            self.user_config.get("hot_reload", True)
+        # Config watchers cannot be unregistered, so they check this instead
+        self._config_watch_stopped = False
+
+    def _init_cpu_accounting(self) -> Optional[CPUAccounting]:
+        if not self.user_config.get("cpu_accounting", False):
+            return None
+        if not CPU_ACCOUNTING_SUPPORTED:
+            LOG.warning("CPU accounting is not supported on this Python "
+                        "version")
+            return None
+        return CPUAccounting(self.handler_metrics)
+
+    def _init_handler_executor(self) -> Optional[HandlerExecutor]:
+        workers = self.user_config.get("handler_workers", 4)
+        if not workers:
+            return None
+        policy = self.user_config.get("handler_queue_policy", "block")
+        if policy not in OVERFLOW_POLICIES:
+            LOG.error(f"Invalid handler_queue_policy ({policy}); "
+                      f"expected one of {OVERFLOW_POLICIES}")
+            policy = "block"
+        return HandlerExecutor(workers,
+                               self.user_config.get("handler_queue_size", 100),
+                               policy,
+                               self.user_config.get("handler_block_timeout", 1))
 
     @property
     def config(self):
@@ -47,33 +172,473 @@ class NeonHardwareAbstractionLayer(PHAL):
         log_deprecation("Reference `user_config`", "2.0.0")
         return self.user_config
 
+    def get_enabled_plugins(self) -> dict:
+        """
+        Get plugins that should be loaded by this service. Plugins configured
+        with `lazy_messages` are not imported or validated until activated.
+        :returns: dict of plugin name to (plugin class or EntryPoint, config)
+        """
+        plugins = dict()
+        entrypoints = find_plugin_entrypoints(
+            PluginTypes.PHAL.value, self.user_config.get("plugin_manifest"),
+            self.user_config.get("plugin_cache"))
+        for name, entrypoint in entrypoints.items():
+            plugin = self._get_enabled_plugin(name, entrypoint)
+            if plugin:
+                plugins[name] = plugin
+        return plugins
+
+    def _get_enabled_plugin(self, name: str, entrypoint) -> Optional[tuple]:
+        # load the plugin only if not defined as admin plugin
+        # (for plugins that can be used as admin or user plugins)
+        if name in self.admin_config:
+            LOG.debug(f"PHAL plugin {name} runs as admin plugin, skipping")
+            return None
+        config = self.user_config.get(name) or {}
+        if config.get("enabled") is False:
+            LOG.debug(f"PHAL plugin {name} disabled in configuration")
+            return None
+        if config.get("lazy_messages"):
+            return entrypoint, config
+        try:
+            plug = entrypoint.load()
+        except Exception:
+            LOG.exception(f"Failed to import PHAL plugin: {name}")
+            return None
+        if hasattr(plug, "validator"):
+            try:
+                if not plug.validator.validate(config):
+                    return None
+            except Exception:
+                LOG.exception(f"Validator failed for PHAL plugin: {name}")
+                return None
+        return plug, config
+
+    def load_plugins(self):
+        plugins = self.get_enabled_plugins()
+        builders = {name: partial(self._timed_build, name,
+                                  self._get_builder(name, plug, config))
+                    for name, (plug, config) in plugins.items()}
+        load_after = {name: list(config.get("load_after") or [])
+                      for name, (_, config) in plugins.items()}
+        critical = [name for name, (_, config) in plugins.items()
+                    if config.get("critical")]
+        prerequisites = dict()
+        if self.user_config.get('wait_for_gui'):
+            gui_plugins = [name for name, (_, config) in plugins.items()
+                           if config.get("requires_gui") or
+                           name in self.user_config.get("gui_plugins", [])]
+            if not gui_plugins:
+                LOG.debug("No plugins declare `requires_gui`; all plugins "
+                          "will wait for the GUI")
+                gui_plugins = list(plugins.keys())
+            for name in gui_plugins:
+                load_after[name].append("mycroft.gui")
+            prerequisites["mycroft.gui"] = Future()
+            Thread(target=self._resolve_gui_wait,
+                   args=(prerequisites["mycroft.gui"],),
+                   name="gui_wait", daemon=True).start()
+        start = time()
+        drivers, load_times = load_plugins_concurrently(
+            builders, load_after, critical,
+            self.user_config.get("load_workers", 4), prerequisites)
+        self.drivers.update(drivers)
+        self.load_times.update(load_times)
+        self.memory_profiler.plugin_paths.update(
+            get_plugin_paths(self.drivers))
+        LOG.info(f"Loaded {len(drivers)} plugins in "
+                 f"{round(time() - start, 3)}s")
+
+    def _get_builder(self, name: str, plug, config: dict) -> Callable:
+        if config.get("lazy_messages"):
+            return partial(LazyPlugin, name, plug, self.bus, config,
+                           self.handler_metrics, self.handler_executor,
+                           self.coalescer, self.state_store, self.tracer,
+                           self.scheduler)
+        if config.get("isolated") or \
+                name in (self.user_config.get("isolated_plugins") or []):
+            return partial(self._start_worker, name, plug, config)
+        self.plugin_buses[name] = PluginBus(self.bus, name,
+                                            self.handler_metrics,
+                                            self.handler_executor,
+                                            self.coalescer, self.tracer)
+        state = self.state_store.get(name) if self.state_store else None
+        return partial(call_as_plugin, name, init_plugin, plug, state,
+                       {"scheduler": self.scheduler.for_plugin(name)},
+                       bus=self.plugin_buses[name], config=config)
+
+    def _start_worker(self, name: str, plug, config: dict) -> PluginWorker:
+        worker = PluginWorker(name, plug, config,
+                              self.user_config.get("worker_bus"))
+        self.worker_supervisor.add(worker)
+        return worker
+
+    def _timed_build(self, name: str, builder):
+        with self.timeline.phase(name, "plugin"):
+            return builder()
+
+    def _resolve_gui_wait(self, future: Future):
+        with self.timeline.phase("gui_wait"):
+            alive = self.wait_for_gui(self.user_config.get("gui_timeout", 30))
+        future.set_result(alive)
+
+    def wait_for_gui(self, timeout: float = 30) -> bool:
+        """
+        Wait for the GUI service to report it is alive. GUI status responses are
+        handled as they arrive; a probe for each `.response` event is sent with
+        jittered exponential backoff in case the GUI started before this
+        service.
+        :param timeout: max seconds to wait
+        :returns: True if the GUI service is alive
+        """
+        LOG.info("Waiting for GUI Service to start")
+        alive = Event()
+
+        def _on_status(message):
+            if message.data.get('status'):
+                alive.set()
+
+        events = self.user_config.get("gui_ready_events") or \
+            ["mycroft.gui.is_alive.response", "mycroft.gui.is_ready.response"]
+        probes = [event[:-len(".response")] for event in events
+                  if event.endswith(".response")]
+        for event in events:
+            self.bus.on(event, _on_status)
+        deadline = monotonic() + timeout
+        delay = 0.5
+        try:
+            while not alive.is_set() and monotonic() < deadline:
+                for probe in probes:
+                    self.bus.emit(Message(probe))
+                alive.wait(min(uniform(0.5, 1.5) * delay,
+                               max(deadline - monotonic(), 0)))
+                delay = min(delay * 2, 5)
+        finally:
+            for event in events:
+                self.bus.remove(event, _on_status)
+        if alive.is_set():
+            LOG.debug('GUI Service is alive')
+        else:
+            LOG.warning(f"GUI Service not alive after {timeout}s")
+        return alive.is_set()
+
     def start(self):
         LOG.debug("Starting PHAL")
-        if self.user_config.get('wait_for_gui'):
-            LOG.info("Waiting for GUI Service to start")
-            timeout = time() + 30
-            while time() < timeout:
-                resp = self.bus.wait_for_response(Message('mycroft.gui.is_alive'))
-                if resp and resp.data.get('status'):
-                    LOG.debug('GUI Service is alive')
-                    break
-        PHAL.start(self)
+        with self.timeline.phase("start"):
+            PHAL.start(self)
         LOG.info(f"Started PHAL")
         self.started.set()
+        self.publish_startup_timeline()
+        if self.watchdog:
+            self.watchdog.start()
+        if self.metrics_server:
+            try:
+                self.metrics_server.start()
+            except OSError as e:
+                LOG.error(f"Failed to start metrics server: {e}")
+        if self._watch_config:
+            from ovos_config.config import Configuration
+            Configuration.set_config_watcher(self._on_config_changed)
+
+    def _on_config_changed(self):
+        if self._config_watch_stopped:
+            return
+        self.reload_config()
+
+    def reload_config(self, config: Optional[dict] = None) -> dict:
+        """
+        Apply updated configuration, reloading only plugins whose
+        configuration changed. Other service options require a restart.
+        :param config: new PHAL configuration (default reads `Configuration`)
+        :returns: dict of `reloaded`, `loaded`, `unloaded` and `failed`
+            plugin names
+        """
+        if config is None:
+            from ovos_config.config import Configuration
+            config = Configuration().get("PHAL") or {}
+        config = deepcopy(config)
+        admin_config = config.pop("admin", None) or {}
+        report = {"reloaded": [], "loaded": [], "unloaded": [], "failed": []}
+        with self._reload_lock:
+            old_config, old_admin = self.user_config, self.admin_config
+            entrypoints = find_plugin_entrypoints(
+                PluginTypes.PHAL.value, config.get("plugin_manifest"),
+                config.get("plugin_cache"))
+            changed = [name for name in entrypoints if
+                       (name in old_admin, old_config.get(name) or {}) !=
+                       (name in admin_config, config.get(name) or {})]
+            for name in changed:
+                if name in self.drivers:
+                    self._unload_plugin(name)
+                    report["unloaded"].append(name)
+            self.user_config, self.admin_config = config, admin_config
+            for name in changed:
+                loaded = self._load_plugin(name, entrypoints[name])
+                if loaded is None:
+                    continue
+                if not loaded:
+                    report["failed"].append(name)
+                    continue
+                if name in report["unloaded"]:
+                    report["unloaded"].remove(name)
+                    report["reloaded"].append(name)
+                else:
+                    report["loaded"].append(name)
+            options = [key for key in set(old_config) | set(config)
+                       if key not in entrypoints and
+                       old_config.get(key) != config.get(key)]
+        if options:
+            LOG.info(f"Service configuration changed ({options}); restart "
+                     f"to apply")
+        if any(report.values()):
+            LOG.info(f"Applied plugin configuration changes: {report}")
+            self.bus.emit(Message("neon.phal.plugins_reloaded", report))
+        return report
+
+    def _load_plugin(self, name: str, entrypoint) -> Optional[bool]:
+        """
+        Load a single plugin outside of the startup sequence.
+        :returns: True if loaded, False if loading failed, None if disabled
+        """
+        plugin = self._get_enabled_plugin(name, entrypoint)
+        if not plugin:
+            return None
+        try:
+            start = monotonic()
+            self.drivers[name] = self._get_builder(name, *plugin)()
+            self.load_times[name] = monotonic() - start
+        except Exception:
+            LOG.exception(f"failed to load PHAL plugin: {name}")
+            plugin_bus = self.plugin_buses.pop(name, None)
+            if plugin_bus:
+                plugin_bus.remove_all()
+            return False
+        self.memory_profiler.plugin_paths.update(
+            get_plugin_paths({name: self.drivers[name]}))
+        return True
+
+    def _unload_plugin(self, name: str):
+        driver = self.drivers.pop(name)
+        config = self.user_config.get(name)
+        timeout = config.get("shutdown_timeout") \
+            if isinstance(config, dict) else None
+        self.scheduler.cancel_plugin(name)
+        shutdown_plugins({name: driver}, default_timeout=timeout or
+                         self.user_config.get("plugin_shutdown_timeout", 10),
+                         before_shutdown=self._save_plugin_state)
+        plugin_bus = self.plugin_buses.pop(name, None)
+        if plugin_bus:
+            # Remove any handlers the plugin did not remove on shutdown
+            plugin_bus.remove_all()
+        if self.handler_executor:
+            self.handler_executor.clear(name)
+        self.worker_supervisor.remove(name)
+        self.load_times.pop(name, None)
+        if self.watchdog:
+            self.watchdog.forget(name)
+        if self.quarantined.pop(name, None):
+            self._update_process_status()
+        LOG.info(f"PHAL plugin unloaded: {name}")
+
+    def _save_plugin_state(self, name: str, driver):
+        # Lazy plugins save on deactivate; workers run in another process
+        if self.state_store and \
+                not isinstance(driver, (LazyPlugin, PluginWorker)):
+            save_plugin_state(name, driver, self.state_store)
+
+    def _get_watched_plugins(self) -> dict:
+        plugins = dict()
+        for name, driver in list(self.drivers.items()):
+            if name in self.quarantined or isinstance(driver, PluginWorker):
+                continue
+            if isinstance(driver, LazyPlugin):
+                if driver.active:
+                    plugins[name] = (driver.plugin, driver.plugin_bus)
+            else:
+                plugins[name] = (driver, self.plugin_buses.get(name))
+        return plugins
+
+    def _on_plugin_failure(self, name: str, reason: str):
+        config = self.user_config.get("watchdog") or {}
+        restarts = self._restarts.get(name, 0)
+        if config.get("action", "restart") == "restart" and \
+                restarts < config.get("max_restarts", 3):
+            self._restarts[name] = restarts + 1
+            self.restart_plugin(name, reason)
+        else:
+            self.quarantine_plugin(name, reason)
+
+    def _emit_plugin_status(self, name: str, status: str, reason: str = ""):
+        self.bus.emit(Message("neon.phal.plugin_status",
+                              {"plugin": name, "status": status,
+                               "reason": reason}))
+
+    def _update_process_status(self):
+        if self.quarantined:
+            self.status.set_error(f"Quarantined PHAL plugins: "
+                                  f"{list(self.quarantined.keys())}")
+        elif self.started.is_set():
+            self.status.set_ready()
+
+    def restart_plugin(self, name: str, reason: str = "") -> bool:
+        """
+        Shut down a plugin and load it again with current configuration.
+        :param name: name of the plugin to restart
+        :param reason: reason for the restart to report
+        :returns: True if the plugin was loaded again
+        """
+        LOG.warning(f"Restarting PHAL plugin {name} {reason}")
+        with self._reload_lock:
+            entrypoint = find_plugin_entrypoints(
+                PluginTypes.PHAL.value, self.user_config.get("plugin_manifest"),
+                self.user_config.get("plugin_cache")).get(name)
+            if name in self.drivers:
+                self._unload_plugin(name)
+            loaded = bool(entrypoint and self._load_plugin(name, entrypoint))
+        self._emit_plugin_status(name, "restarted" if loaded else "failed",
+                                 reason)
+        return loaded
+
+    def quarantine_plugin(self, name: str, reason: str = ""):
+        """
+        Disconnect a plugin from the messagebus without shutting it down.
+        :param name: name of the plugin to quarantine
+        :param reason: reason for quarantine to report
+        """
+        LOG.error(f"Quarantining PHAL plugin {name} {reason}")
+        driver = self.drivers.get(name)
+        if isinstance(driver, LazyPlugin):
+            driver.shutdown()
+        elif name in self.plugin_buses:
+            self.plugin_buses[name].remove_all()
+        if self.handler_executor:
+            self.handler_executor.clear(name)
+        self.quarantined[name] = reason
+        self._emit_plugin_status(name, "quarantined", reason)
+        self._update_process_status()
+
+    def handle_release_plugin(self, message: Message):
+        name = message.data.get("plugin")
+        if name not in self.quarantined:
+            self.bus.emit(message.response({"plugin": name,
+                                            "restarted": False}))
+            return
+        self._restarts.pop(name, None)
+        restarted = self.restart_plugin(name, "released from quarantine")
+        self.bus.emit(message.response({"plugin": name,
+                                        "restarted": restarted}))
+
+    def handle_get_plugin_status(self, message: Message):
+        status = self.watchdog.get_status() if self.watchdog else {}
+        plugins = {name: status.get(name) or {"status": "healthy",
+                                              "reason": "", "misses": 0}
+                   for name in self.drivers}
+        for name, reason in self.quarantined.items():
+            plugins[name] = {"status": "quarantined", "reason": reason,
+                             "misses": 0}
+        self.bus.emit(message.response({"plugins": plugins}))
+
+    def publish_startup_timeline(self):
+        """
+        Emit the startup timeline on the bus and write it to a file.
+        """
+        timeline = self.timeline.to_dict()
+        self.bus.emit(Message("neon.phal.startup_timeline", timeline))
+        try:
+            path = self.timeline.save(
+                self.user_config.get("startup_timeline_path"))
+            LOG.info(f"Startup took {round(timeline['total'], 3)}s. "
+                     f"Timeline written to {path}")
+        except OSError as e:
+            LOG.error(f"Failed to write startup timeline: {e}")
+
+    def handle_get_startup_timeline(self, message: Message):
+        self.bus.emit(message.response(self.timeline.to_dict()))
+
+    def handle_get_handler_metrics(self, message: Message):
+        plugin = message.data.get("plugin")
+        metrics = self.handler_metrics.get_metrics(plugin) \
+            if self.handler_metrics else {}
+        queues = self.handler_executor.get_stats(plugin) \
+            if self.handler_executor else {}
+        self.bus.emit(message.response({
+            "metrics": metrics, "queues": queues,
+            "coalesced": self.coalescer.get_stats()}))
+
+    def get_message_types(self) -> Dict[str, List[str]]:
+        """
+        Get the message types each loaded plugin handles. Isolated plugins are
+        not included.
+        :returns: dict of plugin name to list of message types
+        """
+        message_types = {name: plugin_bus.message_types
+                         for name, plugin_bus in self.plugin_buses.items()
+                         if name in self.drivers}
+        for name, driver in self.drivers.items():
+            if isinstance(driver, LazyPlugin):
+                message_types[name] = list(driver.message_types)
+        return message_types
+
+    def handle_get_message_types(self, message: Message):
+        self.bus.emit(message.response(
+            {"message_types": self.get_message_types()}))
+
+    def handle_get_worker_stats(self, message: Message):
+        self.bus.emit(message.response(
+            {"workers": self.worker_supervisor.get_stats()}))
+
+    def get_prometheus_metrics(self) -> str:
+        """
+        Get plugin CPU and memory usage in the Prometheus text format.
+        """
+        return format_prometheus(self.cpu_accounting.sample(),
+                                 self.worker_supervisor.get_stats())
+
+    def handle_get_traces(self, message: Message):
+        traces = self.tracer.get_records(message.data.get("trace_id"),
+                                         message.data.get("plugin")) \
+            if self.tracer else []
+        self.bus.emit(message.response({"traces": traces}))
+
+    def handle_get_scheduler_stats(self, message: Message):
+        self.bus.emit(message.response(
+            {"jobs": self.scheduler.get_stats(message.data.get("plugin"))}))
+
+    def handle_get_cpu_stats(self, message: Message):
+        self.bus.emit(message.response(
+            {"cpu": self.cpu_accounting.sample()
+             if self.cpu_accounting else None}))
 
     def shutdown(self):
         LOG.info("Shutting Down")
+        if self.watchdog:
+            self.watchdog.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        self._config_watch_stopped = True
+        self.worker_supervisor.stop()
         try:
             PHAL.shutdown(self)
         except Exception as e:
             LOG.exception(e)
         # TODO: Below should be implemented in ovos-PHAL directly
-        for service, clazz in self.drivers.items():
-            try:
-                if hasattr(clazz, 'shutdown'):
-                    LOG.debug(f"Shutting Down {service}")
-                    clazz.shutdown()
-            except Exception as e:
-                LOG.error(f"Error shutting down {service}: {e}")
-            del clazz
+        timeouts = {name: self.user_config[name]["shutdown_timeout"]
+                    for name in self.drivers
+                    if isinstance(self.user_config.get(name), dict) and
+                    "shutdown_timeout" in self.user_config[name]}
+        self.scheduler.shutdown()
+        self.shutdown_report = shutdown_plugins(
+            self.drivers, timeouts,
+            self.user_config.get("plugin_shutdown_timeout", 10),
+            self.user_config.get("shutdown_timeout", 30),
+            self._save_plugin_state)
+        self.coalescer.flush()
+        if self.handler_executor:
+            self.handler_executor.shutdown()
+        if self.cpu_accounting:
+            self.cpu_accounting.close()
+        if self.state_store:
+            # Written after plugin shutdown so plugins may update state
+            # there; state of plugins past their deadline is not waited for
+            self.state_store.snapshot()
 
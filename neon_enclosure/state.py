@@ -0,0 +1,217 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from inspect import signature
+from os import chmod, fsync, makedirs, replace
+from os.path import dirname, isfile, join
+from threading import Lock
+from time import time
+from typing import Dict, Optional, Set
+
+from ovos_utils.log import LOG
+from ovos_utils.xdg_utils import xdg_state_home
+
+STATE_VERSION = 1
+
+
+def get_default_state_path(service: str = "enclosure") -> str:
+    return join(xdg_state_home(), "neon", f"{service}_state.json")
+
+
+class PluginState(dict):
+    """
+    Mutable state for one plugin. `saved_at` is the epoch time the state was
+    last snapshotted, or None if the plugin has no saved state.
+    """
+    def __init__(self, data: Optional[dict] = None,
+                 saved_at: Optional[float] = None):
+        dict.__init__(self, data or {})
+        self.saved_at = saved_at
+
+
+class PluginStateStore:
+    """
+    Per-plugin state that persists across service restarts. State is loaded
+    once at init and written to a single compact JSON snapshot on `snapshot`.
+    """
+    def __init__(self, path: Optional[str] = None,
+                 max_age: Optional[float] = None):
+        """
+        :param path: snapshot file to read and write
+        :param max_age: seconds after which saved state is discarded on load
+        """
+        self.path = path or get_default_state_path()
+        self._states: Dict[str, PluginState] = dict()
+        self._saved: dict = dict()
+        self._lock = Lock()
+        self._load(max_age)
+
+    def _load(self, max_age: Optional[float]):
+        if not isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != STATE_VERSION:
+                raise ValueError(f"Unsupported version: "
+                                 f"{snapshot.get('version')}")
+        except Exception as e:
+            LOG.warning(f"Ignoring invalid state snapshot {self.path}: {e}")
+            return
+        saved_at = snapshot.get("time") or 0
+        if max_age and time() - saved_at > max_age:
+            LOG.info(f"Ignoring state snapshot older than {max_age}s")
+            return
+        self._saved = snapshot.get("plugins") or {}
+        for name, data in self._saved.items():
+            self._states[name] = PluginState(data, saved_at)
+        LOG.debug(f"Loaded state for {list(self._states.keys())}")
+
+    def get(self, name: str) -> PluginState:
+        """
+        Get the state for a plugin, creating an empty one if none was saved.
+        :param name: plugin name
+        :returns: PluginState to be read and updated by the plugin
+        """
+        with self._lock:
+            if name not in self._states:
+                self._states[name] = PluginState()
+            return self._states[name]
+
+    def update(self, name: str, data: dict):
+        """
+        Replace the state for a plugin.
+        :param name: plugin name
+        :param data: JSON-serializable state
+        """
+        with self._lock:
+            state = self._states.get(name)
+            if state is None:
+                state = self._states[name] = PluginState()
+            state.clear()
+            state.update(data)
+
+    def snapshot(self, force: bool = False) -> bool:
+        """
+        Atomically write all non-empty plugin states to disk. Nothing is
+        written if state is unchanged since it was loaded or last written.
+        :param force: write the snapshot even if state is unchanged
+        :returns: True if the snapshot was written
+        """
+        now = time()
+        plugins = dict()
+        with self._lock:
+            states = list(self._states.items())
+            # Copied while locked; abandoned plugins may still be saving
+            data = [(name, dict(state)) for name, state in states]
+        for name, state in data:
+            if not state:
+                continue
+            try:
+                # Round-trip per plugin so one bad value doesn't lose the rest
+                plugins[name] = json.loads(json.dumps(state))
+            except (TypeError, ValueError) as e:
+                LOG.error(f"State for {name} is not serializable: {e}")
+        if plugins == self._saved and not force:
+            LOG.debug("Plugin state unchanged; not writing snapshot")
+            return False
+        snapshot = {"version": STATE_VERSION, "time": now,
+                    "plugins": plugins}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            makedirs(dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                # State may include credentials
+                chmod(tmp_path, 0o600)
+                json.dump(snapshot, f, separators=(',', ':'))
+                f.flush()
+                fsync(f.fileno())
+            replace(tmp_path, self.path)
+        except OSError as e:
+            LOG.error(f"Failed to write state snapshot {self.path}: {e}")
+            return False
+        self._saved = plugins
+        for _, state in states:
+            state.saved_at = now
+        LOG.debug(f"Wrote state for {list(plugins.keys())} to {self.path}")
+        return True
+
+
+def _get_parameters(plug) -> Set[str]:
+    try:
+        return set(signature(plug).parameters)
+    except (TypeError, ValueError):
+        return set()
+
+
+def init_plugin(plug, state: Optional[PluginState] = None,
+                optional: Optional[dict] = None, **kwargs):
+    """
+    Initialize a plugin with its saved state. Plugins accepting a `state`
+    kwarg get the PluginState directly; otherwise a plugin's
+    `restore_state(dict)` method is called after init, if defined.
+    :param plug: plugin class
+    :param state: PluginState for this plugin
+    :param optional: kwargs passed only if the plugin's init accepts them
+    :param kwargs: plugin init kwargs
+    :returns: initialized plugin
+    """
+    parameters = _get_parameters(plug) if state is not None or optional \
+        else set()
+    kwargs.update({key: value for key, value in (optional or {}).items()
+                   if key in parameters})
+    if state is None:
+        return plug(**kwargs)
+    if "state" in parameters:
+        return plug(state=state, **kwargs)
+    plugin = plug(**kwargs)
+    if state and hasattr(plugin, "restore_state"):
+        try:
+            plugin.restore_state(dict(state))
+        except Exception as e:
+            LOG.error(f"Failed to restore state for {plug}: {e}")
+    return plugin
+
+
+def save_plugin_state(name: str, plugin, store: PluginStateStore):
+    """
+    Collect state from a plugin's `save_state()` method, if defined.
+    :param name: plugin name
+    :param plugin: plugin object
+    :param store: PluginStateStore to update
+    """
+    if not hasattr(plugin, "save_state"):
+        return
+    try:
+        data = plugin.save_state()
+        if data is not None:
+            store.update(name, data)
+    except Exception as e:
+        LOG.error(f"Failed to save state for {name}: {e}")
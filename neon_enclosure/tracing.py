@@ -0,0 +1,184 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from datetime import datetime
+from itertools import count
+from random import random
+from threading import local
+from time import time
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from ovos_bus_client.message import Message
+
+from neon_enclosure.metrics import format_table
+
+
+class _TraceRecord:
+    __slots__ = ("seq", "trace_id", "plugin", "msg_type", "kind",
+                 "received", "dispatched", "completed")
+
+    def __init__(self):
+        self.seq = -1
+
+    def as_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "plugin": self.plugin,
+                "msg_type": self.msg_type, "kind": self.kind,
+                "received": self.received, "dispatched": self.dispatched,
+                "completed": self.completed}
+
+
+class MessageTracer:
+    """
+    Flight recorder of sampled plugin bus messages. Sampled messages get a
+    `trace_id` in their context; messages that already have one are always
+    traced, as are messages emitted by a plugin while handling a traced
+    message. Records are kept in a fixed-size ring buffer of reused objects.
+    """
+    def __init__(self, size: int = 1024, sample_rate: float = 0.01):
+        """
+        :param size: max number of records kept
+        :param sample_rate: fraction (0-1) of untraced messages to trace
+        """
+        self.size = max(size, 1)
+        self.sample_rate = sample_rate
+        self._records = [_TraceRecord() for _ in range(self.size)]
+        self._seq = count()
+        self._local = local()
+
+    def _sample(self, message: Message) -> Optional[str]:
+        trace_id = message.context.get("trace_id")
+        if trace_id is None and random() < self.sample_rate:
+            trace_id = message.context["trace_id"] = uuid4().hex[:16]
+        return trace_id
+
+    def _record(self, trace_id: str, plugin: str, msg_type: str, kind: str,
+                received: float) -> Tuple[_TraceRecord, int]:
+        # `next` on a count is atomic, so no lock is needed to claim a slot
+        seq = next(self._seq)
+        record = self._records[seq % self.size]
+        record.seq = -1
+        record.trace_id = trace_id
+        record.plugin = plugin
+        record.msg_type = msg_type
+        record.kind = kind
+        record.received = received
+        record.dispatched = None
+        record.completed = None
+        record.seq = seq
+        return record, seq
+
+    def receive(self, plugin: str, message: Message) \
+            -> Optional[Tuple[_TraceRecord, int]]:
+        """
+        Record receipt of a message by a plugin handler, if sampled.
+        :param plugin: name of the plugin handling the message
+        :param message: Message received
+        :returns: trace handle to pass to `dispatch` and `complete`, or None
+        """
+        trace_id = self._sample(message)
+        if trace_id is None:
+            return None
+        return self._record(trace_id, plugin, message.msg_type, "handle",
+                            time())
+
+    def dispatch(self, trace: Tuple[_TraceRecord, int]):
+        """
+        Record the start of a traced handler call on the current thread.
+        """
+        record, seq = trace
+        if record.seq == seq:
+            record.dispatched = time()
+        self._local.trace_id = record.trace_id
+
+    def complete(self, trace: Tuple[_TraceRecord, int]):
+        """
+        Record the end of a traced handler call on the current thread.
+        """
+        record, seq = trace
+        # The record may have been reused if the buffer wrapped
+        if record.seq == seq:
+            record.completed = time()
+        self._local.trace_id = None
+
+    def emit(self, plugin: str, message: Message):
+        """
+        Record a message emitted by a plugin, if sampled or emitted while
+        handling a traced message.
+        :param plugin: name of the plugin emitting the message
+        :param message: Message being emitted
+        """
+        current = getattr(self._local, "trace_id", None)
+        if current and "trace_id" not in message.context:
+            message.context["trace_id"] = current
+        trace_id = self._sample(message)
+        if trace_id is not None:
+            self._record(trace_id, plugin, message.msg_type, "emit", time())
+
+    def get_records(self, trace_id: Optional[str] = None,
+                    plugin: Optional[str] = None) -> List[dict]:
+        """
+        Get buffered trace records, oldest first.
+        :param trace_id: only include records for this trace
+        :param plugin: only include records for this plugin
+        :returns: list of dict records
+        """
+        records = sorted((r for r in self._records if r.seq >= 0),
+                         key=lambda r: r.seq)
+        return [r.as_dict() for r in records
+                if (trace_id is None or r.trace_id == trace_id) and
+                (plugin is None or r.plugin == plugin)]
+
+    def clear(self):
+        for record in self._records:
+            record.seq = -1
+
+
+def _ms(start: Optional[float], end: Optional[float]) -> str:
+    if start is None or end is None:
+        return "-"
+    return f"{1000 * (end - start):.2f}"
+
+
+def format_traces(records: List[dict]) -> str:
+    """
+    Format trace records as a text table. Handled messages that were never
+    dispatched (still queued or dropped) have no queued or handler time.
+    :param records: list returned by `MessageTracer.get_records`
+    :returns: multi-line string table
+    """
+    rows = [("time", "trace", "plugin", "message", "kind", "queued ms",
+             "handler ms")]
+    for record in records:
+        rows.append((datetime.fromtimestamp(record["received"])
+                     .strftime("%H:%M:%S.%f")[:-3],
+                     record["trace_id"], record["plugin"],
+                     record["msg_type"], record["kind"],
+                     _ms(record["received"], record["dispatched"]),
+                     _ms(record["dispatched"], record["completed"])))
+    return format_table(rows)
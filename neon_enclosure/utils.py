@@ -26,11 +26,193 @@
 # NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import json
+import subprocess
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os import listdir, makedirs
+from os.path import dirname, isfile, join
+from shutil import move, rmtree
+from tempfile import mkdtemp
+from threading import Lock
 from ovos_config.config import Configuration
-from typing import List, Union
+from ovos_utils.log import LOG
+from ovos_utils.xdg_utils import xdg_cache_home
+from typing import Dict, List, Optional, Union
 
 def build_extra_dependency_list(config: Union[dict, Configuration], additional: List[str] = []) -> List[str]:
     extra_dependencies = config.get("extra_dependencies", {})
     dependencies = additional + extra_dependencies.get("global", []) + extra_dependencies.get("enclosure", [])
 
-    return dependencies
\ No newline at end of file
+    return dependencies
+
+
+def _get_installed_version(name: str) -> Optional[str]:
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        # Fallback for Python < 3.8
+        from importlib_metadata import version, PackageNotFoundError
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def _requirement_satisfied(spec: str, check_extras: bool = True) -> bool:
+    from packaging.requirements import Requirement, InvalidRequirement
+    try:
+        requirement = Requirement(spec)
+    except InvalidRequirement:
+        # Let pip handle anything that can't be evaluated here
+        return False
+    if requirement.marker and not requirement.marker.evaluate():
+        return True
+    installed = _get_installed_version(requirement.name)
+    if installed is None:
+        return False
+    if requirement.specifier and \
+            not requirement.specifier.contains(installed, prereleases=True):
+        return False
+    if check_extras and requirement.extras:
+        try:
+            from importlib.metadata import requires
+        except ImportError:
+            from importlib_metadata import requires
+        for dependency in requires(requirement.name) or []:
+            try:
+                dep_requirement = Requirement(dependency)
+            except InvalidRequirement:
+                continue
+            if not dep_requirement.marker:
+                continue
+            if any(dep_requirement.marker.evaluate({"extra": extra})
+                   for extra in requirement.extras) and \
+                    not _requirement_satisfied(dependency.split(';')[0],
+                                               False):
+                return False
+    return True
+
+
+def get_unsatisfied_requirements(requirements: List[str]) -> List[str]:
+    """
+    Check requirements against installed distributions without calling pip.
+    Requirements specified by URL are considered satisfied if a distribution
+    with the same name is installed.
+    :param requirements: list of requirement specs (requirements.txt format)
+    :returns: list of requirements that are missing or unsatisfied
+    """
+    return [spec for spec in requirements
+            if not _requirement_satisfied(spec)]
+
+
+def get_dependency_hash(dependencies: List[str]) -> str:
+    """
+    Get a hash of requested dependencies and the installed environment.
+    :param dependencies: list of requirement specs
+    :returns: hex digest that changes if dependencies or installed
+        distributions change
+    """
+    from neon_enclosure.discovery import get_environment_fingerprint
+    data = {"dependencies": sorted(dependencies),
+            "environment": get_environment_fingerprint()}
+    return sha256(json.dumps(data).encode()).hexdigest()
+
+
+def get_dependency_stamp_path() -> str:
+    return join(xdg_cache_home(), "neon", "enclosure_dependencies.json")
+
+
+def check_dependency_stamp(dependencies: List[str]) -> bool:
+    """
+    Check if `dependencies` were satisfied the last time they were checked and
+    the environment has not changed since.
+    :param dependencies: list of requirement specs
+    :returns: True if dependencies are known to be satisfied
+    """
+    path = get_dependency_stamp_path()
+    if not isfile(path):
+        return False
+    try:
+        with open(path) as f:
+            stamp = json.load(f)
+    except Exception:
+        return False
+    return stamp.get("hash") == get_dependency_hash(dependencies)
+
+
+def write_dependency_stamp(dependencies: List[str]):
+    """
+    Record that `dependencies` are satisfied in the current environment.
+    :param dependencies: list of requirement specs
+    """
+    path = get_dependency_stamp_path()
+    makedirs(dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({"hash": get_dependency_hash(dependencies)}, f)
+
+
+def _run_pip(args: List[str]) -> int:
+    try:
+        return subprocess.run([sys.executable, '-m', 'pip'] + args).returncode
+    except Exception as e:
+        LOG.error(f"Error running pip {args}: {e}")
+        return 1
+
+
+def _write_constraints(path: str, core_module: str = "neon-enclosure") -> str:
+    from neon_utils.packaging_utils import get_package_dependencies
+    constraints_file = join(path, "constraints.txt")
+    with open(constraints_file, 'w', encoding="utf8") as f:
+        f.write('\n'.join(get_package_dependencies(core_module)))
+    return constraints_file
+
+
+def build_wheelhouse(requirements: List[str], path: str,
+                     jobs: int = 4) -> Dict[str, int]:
+    """
+    Build wheels for requirements and their dependencies so they can be
+    installed later without network access.
+    :param requirements: list of requirement specs
+    :param path: directory to write wheels to
+    :param jobs: number of requirements to build concurrently
+    :returns: dict of requirement to pip exit code
+    """
+    makedirs(path, exist_ok=True)
+    constraints = _write_constraints(path)
+    lock = Lock()
+
+    def _build(requirement: str) -> int:
+        LOG.info(f"Building wheels for: {requirement}")
+        # Each build writes to its own directory so concurrent pip processes
+        # do not race on the same wheel files
+        build_dir = mkdtemp(prefix=".build-", dir=path)
+        try:
+            result = _run_pip(['wheel', '--wheel-dir', build_dir, '-c',
+                               constraints, requirement])
+            with lock:
+                for wheel in listdir(build_dir):
+                    if not isfile(join(path, wheel)):
+                        move(join(build_dir, wheel), join(path, wheel))
+            return result
+        finally:
+            rmtree(build_dir, ignore_errors=True)
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        return dict(zip(requirements, executor.map(_build, requirements)))
+
+
+def install_from_wheelhouse(requirements: List[str], path: str) -> int:
+    """
+    Install requirements using only wheels in a local wheelhouse.
+    :param requirements: list of requirement specs
+    :param path: directory containing wheels built by `build_wheelhouse`
+    :returns: int pip exit code
+    """
+    LOG.info(f"Installing from wheelhouse {path}: {requirements}")
+    args = ['install', '--no-index', '--find-links', path]
+    if isfile(join(path, "constraints.txt")):
+        args += ['-c', join(path, "constraints.txt")]
+    return _run_pip(args + requirements)
@@ -0,0 +1,231 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ovos_utils.log import LOG
+
+from neon_enclosure.bus import PluginBus
+from neon_enclosure.executor import HandlerExecutor
+from neon_enclosure.metrics import HandlerMetrics, estimate_percentile
+
+
+class _PluginHealth:
+    __slots__ = ("status", "reason", "misses", "probe_sent", "probe_done",
+                 "probe_ok", "buckets")
+
+    def __init__(self):
+        self.status = "healthy"
+        self.reason = ""
+        self.misses = 0
+        self.probe_sent: Optional[float] = None
+        self.probe_done = Event()
+        self.probe_ok = True
+        self.buckets: Optional[List[int]] = None
+
+
+class PluginWatchdog:
+    """
+    Periodically checks that plugins are responsive. A plugin misses a check
+    if a handler call has run longer than `handler_budget`, a heartbeat probe
+    is not handled within `heartbeat_timeout` (or the plugin's `heartbeat`
+    method returns False), or p95 handler latency since the last check
+    exceeds `latency_budget`. After `max_misses` consecutive misses,
+    `on_failure` is called.
+    """
+    def __init__(self, get_plugins: Callable[[], Dict[str, Tuple[object,
+                                                                 PluginBus]]],
+                 on_failure: Callable[[str, str], None],
+                 executor: Optional[HandlerExecutor] = None,
+                 metrics: Optional[HandlerMetrics] = None,
+                 interval: float = 10, heartbeat_timeout: float = 30,
+                 handler_budget: float = 60, latency_budget: float = 5,
+                 max_misses: int = 3, min_samples: int = 5,
+                 on_status: Optional[Callable[[str, str, str], None]] = None,
+                 notify: Optional[Callable[[], None]] = None):
+        """
+        :param get_plugins: returns dict of plugin name to (plugin, PluginBus)
+            for plugins to check
+        :param on_failure: called with plugin name and reason when a plugin
+            misses `max_misses` consecutive checks
+        :param executor: HandlerExecutor to send heartbeat probes through
+        :param metrics: HandlerMetrics to read handler latency from
+        :param interval: seconds between checks
+        :param heartbeat_timeout: max seconds for a heartbeat to be handled
+        :param handler_budget: max seconds a single handler call may run
+        :param latency_budget: max p95 handler latency in seconds
+        :param max_misses: consecutive missed checks before `on_failure`
+        :param min_samples: min handler calls to evaluate latency
+        :param on_status: called with plugin name, status, and reason when a
+            plugin becomes `degraded` or `healthy`
+        :param notify: called after each check (i.e. a service watchdog)
+        """
+        self.get_plugins = get_plugins
+        self.on_failure = on_failure
+        self.on_status = on_status
+        self.notify = notify
+        self.executor = executor
+        self.metrics = metrics
+        self.interval = interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.handler_budget = handler_budget
+        self.latency_budget = latency_budget
+        self.max_misses = max(max_misses, 1)
+        self.min_samples = min_samples
+        self._health: Dict[str, _PluginHealth] = dict()
+        self._stopping = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="plugin_watchdog",
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                LOG.exception(e)
+
+    def get_status(self) -> Dict[str, dict]:
+        """
+        :returns: dict of plugin name to `status`, `reason`, and `misses`
+        """
+        return {name: {"status": health.status, "reason": health.reason,
+                       "misses": health.misses}
+                for name, health in self._health.items()}
+
+    def forget(self, name: str):
+        """
+        Reset tracked health for a plugin (i.e. after it was restarted).
+        """
+        self._health.pop(name, None)
+
+    def check_all(self):
+        plugins = self.get_plugins()
+        for name in [n for n in self._health if n not in plugins]:
+            self.forget(name)
+        for name, (plugin, plugin_bus) in plugins.items():
+            health = self._health.get(name)
+            if health is None:
+                health = self._health[name] = _PluginHealth()
+            reasons = self.check(name, plugin, plugin_bus, health)
+            if not reasons:
+                if health.status != "healthy":
+                    health.status, health.reason, health.misses = \
+                        "healthy", "", 0
+                    self._set_status(name, health)
+                continue
+            health.misses += 1
+            health.reason = "; ".join(reasons)
+            if health.misses >= self.max_misses:
+                LOG.error(f"PHAL plugin {name} unresponsive: {health.reason}")
+                self.forget(name)
+                self.on_failure(name, health.reason)
+            elif health.status != "degraded":
+                health.status = "degraded"
+                self._set_status(name, health)
+        if self.notify:
+            self.notify()
+
+    def _set_status(self, name: str, health: _PluginHealth):
+        LOG.info(f"PHAL plugin {name} is {health.status} {health.reason}")
+        if self.on_status:
+            self.on_status(name, health.status, health.reason)
+
+    def check(self, name: str, plugin, plugin_bus: Optional[PluginBus],
+              health: _PluginHealth) -> List[str]:
+        """
+        Check a plugin and send a new heartbeat probe.
+        :returns: list of reasons the plugin missed this check
+        """
+        reasons = list()
+        active = plugin_bus.longest_active_call if plugin_bus else 0
+        if self.handler_budget and active > self.handler_budget:
+            reasons.append(f"handler running for {round(active, 1)}s")
+        if health.probe_sent is not None:
+            if health.probe_done.is_set():
+                if not health.probe_ok:
+                    reasons.append("heartbeat failed")
+                health.probe_sent = None
+            else:
+                waited = monotonic() - health.probe_sent
+                if waited > self.heartbeat_timeout:
+                    reasons.append(f"no heartbeat for {round(waited, 1)}s")
+        if health.probe_sent is None:
+            self._send_probe(name, plugin, health)
+        if self.metrics and self.latency_budget:
+            buckets = None
+            for stats in self.metrics.get_metrics(name).get(name,
+                                                            {}).values():
+                buckets = [a + b for a, b in
+                           zip(buckets, stats["buckets"])] if buckets \
+                    else list(stats["buckets"])
+            if buckets and health.buckets:
+                window = [a - b for a, b in zip(buckets, health.buckets)]
+                if sum(window) >= self.min_samples:
+                    p95 = estimate_percentile(window, 95)
+                    if p95 > self.latency_budget:
+                        reasons.append(f"p95 handler latency > "
+                                       f"{self.latency_budget}s")
+            health.buckets = buckets or health.buckets
+        return reasons
+
+    def _send_probe(self, name: str, plugin, health: _PluginHealth):
+        done = health.probe_done = Event()
+        health.probe_ok = True
+        health.probe_sent = monotonic()
+
+        def _probe():
+            try:
+                heartbeat = getattr(plugin, "heartbeat", None)
+                if callable(heartbeat) and heartbeat() is False:
+                    health.probe_ok = False
+            except Exception as e:
+                LOG.error(f"Heartbeat failed for {name}: {e}")
+                health.probe_ok = False
+            finally:
+                done.set()
+
+        if self.executor:
+            # Queued behind the plugin's handlers so a blocked queue is
+            # detected, without taking the place of any plugin calls
+            self.executor.submit_probe(name, _probe)
+        else:
+            Thread(target=_probe, name=f"heartbeat_{name}",
+                   daemon=True).start()
@@ -0,0 +1,297 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import atexit
+
+from multiprocessing import get_context
+from os import _exit, getpid, getppid, sysconf
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, Optional
+from weakref import WeakSet
+
+from ovos_utils.log import LOG
+
+_spawn = get_context("spawn")
+
+# Workers are not daemonic (so plugins may start their own processes); stop
+# any still running before multiprocessing waits on them at exit
+_workers: "WeakSet[PluginWorker]" = WeakSet()
+
+
+@atexit.register
+def _stop_workers():
+    for worker in list(_workers):
+        if worker.alive:
+            worker.shutdown(1)
+
+
+def get_process_stats(pid: int) -> dict:
+    """
+    Read resource usage for a process from procfs.
+    :param pid: process ID to read
+    :returns: dict of `cpu_time` (seconds), `rss` (bytes), and `threads`
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        # Fields after the parenthesized command name, starting at `state`
+        fields = f.read().rsplit(")", 1)[1].split()
+    with open(f"/proc/{pid}/statm") as f:
+        rss_pages = int(f.read().split()[1])
+    return {"cpu_time": (int(fields[11]) + int(fields[12])) /
+            sysconf("SC_CLK_TCK"),
+            "rss": rss_pages * sysconf("SC_PAGE_SIZE"),
+            "threads": int(fields[17])}
+
+
+def _watch_parent(parent_pid: int, stop_event, interval: float = 1,
+                  shutdown_timeout: float = 10):
+    """
+    Stop the worker if the service process exits without stopping it (i.e.
+    it was killed), so an orphaned plugin does not stay on the bus.
+    """
+    while not stop_event.wait(interval):
+        if getppid() != parent_pid:
+            LOG.warning("Service process exited; stopping worker")
+            stop_event.set()
+            sleep(shutdown_timeout)
+            # Plugin did not shut down in time
+            _exit(1)
+
+
+def _run_plugin(name: str, plugin, config: dict, bus_config: Optional[dict],
+                stop_event, parent_pid: Optional[int] = None):
+    """
+    Worker process entrypoint. Connects a new bus client and runs the plugin
+    until `stop_event` is set or the parent process exits.
+    """
+    from ovos_bus_client.client import MessageBusClient
+    from neon_utils.log_utils import init_log
+    init_log(log_name="enclosure")
+    if parent_pid:
+        Thread(target=_watch_parent, args=(parent_pid, stop_event),
+               name="parent_watch", daemon=True).start()
+    bus = MessageBusClient(**(bus_config or {}))
+    bus.run_in_thread()
+    try:
+        instance = plugin(bus=bus, config=config)
+    except Exception:
+        LOG.exception(f"failed to load PHAL plugin: {name}")
+        bus.close()
+        raise SystemExit(1)
+    LOG.info(f"PHAL plugin {name} running in worker process")
+    stop_event.wait()
+    try:
+        instance.shutdown()
+    except Exception as e:
+        LOG.error(f"Error shutting down {name}: {e}")
+    bus.close()
+
+
+class PluginWorker:
+    """
+    Hosts a PHAL plugin in a child process with its own bus connection. The
+    process is not daemonic, so the plugin may start child processes; it exits
+    when the service process does.
+    """
+    def __init__(self, name: str, plugin, config: dict,
+                 bus_config: Optional[dict] = None):
+        """
+        :param name: plugin name
+        :param plugin: plugin class; must be importable by the child process
+        :param config: plugin configuration
+        :param bus_config: kwargs for the worker's MessageBusClient
+        """
+        self.name = name
+        self.plugin = plugin
+        self.config = config
+        self.bus_config = bus_config
+        self.process = None
+        self.stopping = False
+        self.restarts = list()
+        self.next_restart: Optional[float] = None
+        self._stop_event = None
+        self._last_cpu: Optional[tuple] = None
+        _workers.add(self)
+        self.start()
+
+    @property
+    def plugin_module(self) -> str:
+        return self.plugin.__module__
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    @property
+    def alive(self) -> bool:
+        return bool(self.process and self.process.is_alive())
+
+    def start(self):
+        self.stopping = False
+        self.next_restart = None
+        self._last_cpu = None
+        self._stop_event = _spawn.Event()
+        self.process = _spawn.Process(
+            target=_run_plugin, name=f"phal_{self.name}",
+            args=(self.name, self.plugin, self.config, self.bus_config,
+                  self._stop_event, getpid()))
+        self.process.start()
+        LOG.debug(f"Started worker for {self.name} (pid={self.pid})")
+
+    def shutdown(self, timeout: float = 5):
+        """
+        Ask the worker to shut down its plugin, terminating it if it does not
+        exit within `timeout` seconds.
+        """
+        self.stopping = True
+        if not self.process:
+            return
+        self._stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            LOG.warning(f"Terminating worker for {self.name}")
+            self.process.terminate()
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+    def get_stats(self) -> dict:
+        """
+        :returns: dict of worker process status and resource usage
+        """
+        stats = {"pid": self.pid, "alive": self.alive,
+                 "restarts": len(self.restarts),
+                 "exitcode": self.process.exitcode if self.process else None}
+        if not stats["alive"]:
+            return stats
+        try:
+            stats.update(get_process_stats(self.pid))
+        except (OSError, IndexError, ValueError):
+            return stats
+        now = monotonic()
+        if self._last_cpu:
+            elapsed = now - self._last_cpu[1]
+            stats["cpu_percent"] = round(
+                100 * (stats["cpu_time"] - self._last_cpu[0]) / elapsed, 1) \
+                if elapsed > 0 else 0.0
+        self._last_cpu = (stats["cpu_time"], now)
+        return stats
+
+
+class WorkerSupervisor:
+    """
+    Monitors PluginWorkers, restarting any that exit unexpectedly with
+    exponential backoff. A worker that exits more than `max_restarts` times
+    within `restart_window` seconds is not restarted again.
+    """
+    def __init__(self, check_interval: float = 5, max_restarts: int = 5,
+                 restart_window: float = 300, backoff: float = 1,
+                 max_backoff: float = 60):
+        self.check_interval = check_interval
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.workers: Dict[str, PluginWorker] = dict()
+        self.failed = list()
+        self._stopping = Event()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+
+    def add(self, worker: PluginWorker):
+        with self._lock:
+            self.workers[worker.name] = worker
+        if not self._thread:
+            self.start()
+
+    def remove(self, name: str) -> Optional[PluginWorker]:
+        """
+        Stop supervising a worker.
+        :param name: plugin name of the worker
+        :returns: removed PluginWorker, if any
+        """
+        with self._lock:
+            if name in self.failed:
+                self.failed.remove(name)
+            return self.workers.pop(name, None)
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="worker_supervisor",
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(self.check_interval)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.check_interval):
+            with self._lock:
+                for worker in self.workers.values():
+                    try:
+                        self.check_worker(worker)
+                    except Exception as e:
+                        LOG.exception(e)
+
+    def check_worker(self, worker: PluginWorker):
+        """
+        Schedule or perform a restart of `worker` if it exited unexpectedly.
+        """
+        if worker.alive or worker.stopping or worker.name in self.failed:
+            return
+        now = monotonic()
+        if worker.next_restart is None:
+            worker.restarts = [t for t in worker.restarts
+                               if now - t < self.restart_window]
+            if len(worker.restarts) >= self.max_restarts:
+                LOG.error(f"Worker for {worker.name} exited "
+                          f"{len(worker.restarts) + 1} times; not restarting")
+                self.failed.append(worker.name)
+                return
+            delay = min(self.backoff * 2 ** len(worker.restarts),
+                        self.max_backoff)
+            LOG.warning(f"Worker for {worker.name} exited with code "
+                        f"{worker.process.exitcode}; restarting in {delay}s")
+            worker.next_restart = now + delay
+        if now >= worker.next_restart:
+            worker.restarts.append(now)
+            worker.start()
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        :returns: dict of plugin name to worker stats
+        """
+        stats = dict()
+        for name, worker in self.workers.items():
+            stats[name] = worker.get_stats()
+            stats[name]["failed"] = name in self.failed
+        return stats
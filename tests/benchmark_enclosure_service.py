@@ -0,0 +1,102 @@
+# NEON AI (TM) SOFTWARE, Software Development Kit & Application Framework
+# All trademark and other rights reserved by their respective owners
+# Copyright 2008-2022 Neongecko.com Inc.
+# Contributors: Daniel McKnight, Guy Daniels, Elon Gasper, Richard Leeds,
+# Regina Bloomstine, Casimiro Ferreira, Andrii Pernatii, Kirill Hrymailo
+# BSD-3 License
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from this
+#    software without specific prior written permission.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS  BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA,
+# OR PROFITS;  OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark the Enclosure service with synthetic plugins on a FakeBus.
+
+    python tests/benchmark_enclosure_service.py --output results.json \
+        --baseline baseline.json --threshold 0.25
+
+Exits with status 1 if any metric regressed more than `threshold` relative to
+the baseline.
+"""
+
+import sys
+import click
+
+from os.path import isfile
+from neon_enclosure.benchmark import compare_to_baseline, load_results, \
+    run_benchmark, save_results
+
+
+@click.command()
+@click.option("--plugins", default=10, help="Number of synthetic plugins")
+@click.option("--messages", default=2000, help="Number of requests to send")
+@click.option("--concurrency", default=4,
+              help="Number of requests awaiting responses at once")
+@click.option("--handler-time", default=0.0,
+              help="Seconds each plugin handler takes")
+@click.option("--rounds", default=3,
+              help="Benchmark rounds; the median of each metric is reported")
+@click.option("--output", "-o", default=None, help="File to write results to")
+@click.option("--baseline", "-b", default=None,
+              help="Results file to compare to")
+@click.option("--threshold", default=0.25,
+              help="Max relative regression allowed (0.25 is 25%)")
+@click.option("--update-baseline", is_flag=True, default=False,
+              help="Write results to the baseline file")
+def benchmark(plugins, messages, concurrency, handler_time, rounds, output,
+              baseline, threshold, update_baseline):
+    runs = [run_benchmark(plugins, messages, concurrency, handler_time)
+            for _ in range(max(rounds, 1))]
+    results = _median_results(runs)
+    for key in ("construct", "start_to_ready", "shutdown"):
+        click.echo(f"{key}: {1000 * results[key]:.2f} ms")
+    click.echo(f"throughput: {results['throughput']:.1f} msg/s "
+               f"({results['dropped']} dropped)")
+    click.echo("latency: " + ", ".join(
+        f"{pct} {1000 * value:.2f} ms"
+        for pct, value in results["latency"].items()))
+    if output:
+        save_results(results, output)
+    if baseline and update_baseline:
+        save_results(results, baseline)
+        click.echo(f"Updated baseline {baseline}")
+    elif baseline and isfile(baseline):
+        regressions = compare_to_baseline(results, load_results(baseline),
+                                          threshold)
+        for regression in regressions:
+            click.echo(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        click.echo(f"No regressions relative to {baseline}")
+
+
+def _median_results(runs: list) -> dict:
+    results = dict(runs[0])
+    for key, value in runs[0].items():
+        if isinstance(value, dict):
+            results[key] = _median_results([run[key] for run in runs])
+        elif isinstance(value, (int, float)):
+            values = sorted(run[key] for run in runs)
+            results[key] = values[len(values) // 2]
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -27,6 +27,8 @@
 # SOFTWARE,  EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import unittest
+from threading import Event, Thread
+from time import sleep, time
 from unittest.mock import patch, Mock
 
 from ovos_utils.messagebus import FakeBus
@@ -36,6 +38,42 @@ from neon_enclosure.service import NeonHardwareAbstractionLayer
 from neon_enclosure.admin.service import NeonAdminHardwareAbstractionLayer
 
 
+_xdg_patch = None
+
+
+def setUpModule():
+    # Keep startup timelines, plugin caches, and state written by services
+    # under test out of the user's XDG directories
+    from os import environ
+    from tempfile import mkdtemp
+    global _xdg_patch
+    xdg_dir = mkdtemp()
+    _xdg_patch = patch.dict(environ, {
+        "XDG_STATE_HOME": f"{xdg_dir}/state",
+        "XDG_CACHE_HOME": f"{xdg_dir}/cache"})
+    _xdg_patch.start()
+
+
+def tearDownModule():
+    _xdg_patch.stop()
+
+
+def _entrypoints(plugins: dict) -> dict:
+    return {name: Mock(load=Mock(return_value=plugin))
+            for name, plugin in plugins.items()}
+
+
+class _WorkerPlugin:
+    # Module-level so it can be imported by worker processes
+    def __init__(self, bus, config):
+        from os import getpid
+        with open(config["pid_file"], 'w') as f:
+            f.write(str(getpid()))
+
+    def shutdown(self):
+        pass
+
+
 class TestEnclosureService(unittest.TestCase):
     bus = FakeBus()
 
@@ -66,6 +104,1069 @@ class TestEnclosureService(unittest.TestCase):
         service.shutdown()
         stopping.assert_called_once()
 
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_load_plugins(self, find_plugins):
+        started = list()
+
+        def _plugin(name, delay=0.2):
+            class _Plugin:
+                def __init__(self, bus, config):
+                    started.append(name)
+                    sleep(delay)
+                    self.bus = bus
+                    self.config = config
+            return _Plugin
+
+        find_plugins.return_value = _entrypoints(
+            {"slow_a": _plugin("slow_a"), "slow_b": _plugin("slow_b"),
+             "dependent": _plugin("dependent", 0),
+             "critical": _plugin("critical", 0.1)})
+        config = {"dependent": {"load_after": ["slow_a"]},
+                  "critical": {"critical": True},
+                  "load_workers": 4}
+        ready = Mock()
+        service = NeonHardwareAbstractionLayer(config=config, bus=self.bus,
+                                               ready_hook=ready)
+        load_start = time()
+        service.start()
+        load_time = time() - load_start
+        ready.assert_called_once()
+        self.assertEqual(set(service.drivers.keys()),
+                         set(find_plugins.return_value.keys()))
+        self.assertEqual(started[0], "critical")
+        self.assertEqual(started[-1], "dependent")
+        # slow_a and slow_b are loaded concurrently
+        self.assertLess(load_time, 0.6)
+        self.assertEqual(set(service.load_times.keys()),
+                         set(service.drivers.keys()))
+        self.assertGreaterEqual(service.load_times["slow_a"], 0.2)
+        service.shutdown()
+
+    def test_shutdown_plugins(self):
+        hung = Event()
+
+        class _Plugin:
+            def __init__(self, delay):
+                self.delay = delay
+
+            def shutdown(self):
+                if self.delay is None:
+                    hung.wait()
+                elif self.delay < 0:
+                    raise RuntimeError("shutdown failed")
+                else:
+                    sleep(self.delay)
+
+        config = {"hung": {"shutdown_timeout": 0.5},
+                  "plugin_shutdown_timeout": 2}
+        service = NeonHardwareAbstractionLayer(config=config, bus=self.bus)
+        service.drivers = {"slow_a": _Plugin(0.3), "slow_b": _Plugin(0.3),
+                           "hung": _Plugin(None), "error": _Plugin(-1)}
+        shutdown_start = time()
+        service.shutdown()
+        shutdown_time = time() - shutdown_start
+        self.assertLess(shutdown_time, 0.9)
+        report = service.shutdown_report
+        self.assertEqual(set(report["completed"]), {"slow_a", "slow_b"})
+        self.assertEqual(report["timed_out"], ["hung"])
+        self.assertEqual(set(report["errors"].keys()), {"error"})
+        self.assertGreaterEqual(report["durations"]["slow_a"], 0.3)
+        hung.set()
+
+        # Global deadline applies to all plugins
+        config["shutdown_timeout"] = 0.2
+        service = NeonHardwareAbstractionLayer(config=config, bus=self.bus)
+        service.drivers = {"slow": _Plugin(1)}
+        service.shutdown()
+        self.assertEqual(service.shutdown_report["timed_out"], ["slow"])
+
+        # Plugin state is saved within the shutdown deadlines
+        import json
+        from os.path import join
+        from tempfile import mkdtemp
+
+        class _StatePlugin:
+            def __init__(self, delay):
+                self.delay = delay
+
+            def save_state(self):
+                sleep(self.delay)
+                return {"delay": self.delay}
+
+        path = join(mkdtemp(), "state.json")
+        service = NeonHardwareAbstractionLayer(
+            config={"plugin_shutdown_timeout": 0.5, "shutdown_timeout": 1,
+                    "state_path": path}, bus=self.bus)
+        service.drivers = {"fast": _StatePlugin(0), "slow_a": _StatePlugin(5),
+                           "slow_b": _StatePlugin(5)}
+        shutdown_start = time()
+        service.shutdown()
+        self.assertLess(time() - shutdown_start, 1)
+        self.assertEqual(set(service.shutdown_report["timed_out"]),
+                         {"slow_a", "slow_b"})
+        with open(path) as f:
+            self.assertEqual(json.load(f)["plugins"], {"fast": {"delay": 0}})
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_wait_for_gui(self, find_plugins):
+        from ovos_bus_client.message import Message
+        loaded = dict()
+
+        def _plugin(name):
+            class _Plugin:
+                def __init__(self, bus, config):
+                    loaded[name] = time()
+            return _Plugin
+
+        find_plugins.return_value = _entrypoints(
+            {"gui": _plugin("gui"), "headless": _plugin("headless")})
+        config = {"wait_for_gui": True, "gui_timeout": 10,
+                  "gui": {"requires_gui": True}}
+        bus = FakeBus()
+        probes = list()
+        ready_probes = list()
+        bus.on("mycroft.gui.is_alive", lambda m: probes.append(m))
+        bus.on("mycroft.gui.is_ready", lambda m: ready_probes.append(m))
+
+        def _gui_started():
+            sleep(1)
+            bus.emit(Message("mycroft.gui.is_ready.response",
+                             {"status": True}))
+
+        service = NeonHardwareAbstractionLayer(config=config, bus=bus)
+        Thread(target=_gui_started).start()
+        start = time()
+        service.start()
+        self.assertTrue(service.started.is_set())
+        self.assertEqual(set(loaded.keys()), {"gui", "headless"})
+        self.assertLess(loaded["headless"] - start, 0.5)
+        self.assertGreaterEqual(loaded["gui"] - start, 1)
+        self.assertLess(loaded["gui"] - start, 2)
+        # Probes back off instead of flooding the bus
+        self.assertLess(len(probes), 5)
+        # Both default ready events are probed
+        self.assertEqual(len(ready_probes), len(probes))
+        service.shutdown()
+
+        # GUI never starts
+        config["gui_timeout"] = 0.5
+        service = NeonHardwareAbstractionLayer(config=config, bus=bus)
+        start = time()
+        self.assertFalse(service.wait_for_gui(0.5))
+        self.assertLess(time() - start, 1)
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_startup_timeline(self, find_plugins):
+        import json
+        from tempfile import mkdtemp
+        from os.path import join
+        from ovos_bus_client.message import Message
+        from neon_enclosure.profiling import StartupTimeline
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                sleep(0.1)
+
+        find_plugins.return_value = _entrypoints({"test_plugin": _Plugin})
+        timeline_file = join(mkdtemp(), "timeline.json")
+        bus = FakeBus()
+        published = Mock()
+        bus.on("neon.phal.startup_timeline", published)
+        timeline = StartupTimeline()
+        with timeline.phase("before_service"):
+            sleep(0.05)
+        service = NeonHardwareAbstractionLayer(
+            config={"startup_timeline_path": timeline_file}, bus=bus,
+            timeline=timeline)
+        service.start()
+        published.assert_called_once()
+        data = published.call_args[0][0].data
+        phases = {p["name"]: p for p in data["phases"]}
+        self.assertEqual(phases["test_plugin"]["category"], "plugin")
+        self.assertGreaterEqual(phases["test_plugin"]["duration"], 0.1)
+        self.assertGreaterEqual(phases["start"]["start"],
+                                phases["before_service"]["duration"])
+        with open(timeline_file) as f:
+            self.assertEqual(json.load(f), data)
+        resp = bus.wait_for_response(Message("neon.phal.get_startup_timeline"))
+        self.assertEqual(resp.data, data)
+        self.assertIn("test_plugin", timeline.format_waterfall())
+        service.shutdown()
+
+    @patch("neon_enclosure.metrics.LOG")
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_handler_metrics(self, find_plugins, log):
+        from ovos_bus_client.message import Message
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                self.bus = bus
+                self.bus.on("test.fast", self.on_fast)
+                self.bus.on("test.slow", self.on_slow)
+
+            def on_fast(self, _):
+                pass
+
+            def on_slow(self, _):
+                sleep(0.15)
+
+        find_plugins.return_value = _entrypoints({"plugin": _Plugin})
+        bus = FakeBus()
+        service = NeonHardwareAbstractionLayer(
+            config={"slow_handler_threshold": 0.1}, bus=bus)
+        service.start()
+        for _ in range(10):
+            bus.emit(Message("test.fast"))
+        bus.emit(Message("test.slow"))
+        service.handler_executor.join(5)
+        log.warning.assert_called_once()
+        self.assertIn("test.slow", log.warning.call_args[0][0])
+
+        resp = bus.wait_for_response(Message("neon.phal.get_handler_metrics"))
+        metrics = resp.data["metrics"]["plugin"]
+        self.assertEqual(metrics["test.fast"]["count"], 10)
+        self.assertLessEqual(metrics["test.fast"]["p95"], 0.001)
+        self.assertEqual(metrics["test.slow"]["count"], 1)
+        self.assertGreaterEqual(metrics["test.slow"]["max"], 0.15)
+        self.assertEqual(metrics["test.slow"]["p50"], 0.25)
+        self.assertEqual(sum(metrics["test.fast"]["buckets"]), 10)
+        resp = bus.wait_for_response(Message("neon.phal.get_handler_metrics",
+                                             {"plugin": "other"}))
+        self.assertEqual(resp.data["metrics"], {})
+        service.shutdown()
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_handler_queues(self, find_plugins):
+        from ovos_bus_client.message import Message
+        from neon_enclosure.executor import HandlerExecutor
+        release = Event()
+        handled = list()
+
+        class _Slow:
+            def __init__(self, bus, config):
+                bus.on("test.slow", self.on_slow)
+
+            def on_slow(self, message):
+                release.wait(5)
+                handled.append(message.data["i"])
+
+        class _Fast:
+            def __init__(self, bus, config):
+                bus.on("test.fast", self.on_fast)
+
+            def on_fast(self, _):
+                handled.append("fast")
+
+        find_plugins.return_value = _entrypoints({"slow": _Slow,
+                                                  "fast": _Fast})
+        bus = FakeBus()
+        service = NeonHardwareAbstractionLayer(
+            config={"handler_queue_size": 2,
+                    "handler_queue_policy": "drop-oldest"}, bus=bus)
+        service.start()
+        bus.emit(Message("test.slow", {"i": 0}))
+        sleep(0.2)
+        for i in range(1, 5):
+            bus.emit(Message("test.slow", {"i": i}))
+        # A blocked plugin does not delay other plugins
+        bus.emit(Message("test.fast"))
+        sleep(0.2)
+        self.assertEqual(handled, ["fast"])
+        stats = service.handler_executor.get_stats()
+        self.assertEqual(stats["slow"]["depth"], 2)
+        self.assertEqual(stats["slow"]["dropped"], 2)
+        release.set()
+        self.assertTrue(service.handler_executor.join(5))
+        # Oldest queued calls were dropped
+        self.assertEqual(handled, ["fast", 0, 3, 4])
+
+        resp = bus.wait_for_response(Message("neon.phal.get_handler_metrics",
+                                             {"plugin": "slow"}))
+        self.assertEqual(resp.data["queues"]["slow"]["max_depth"], 2)
+        service.shutdown()
+
+        # Reject policy discards new calls
+        executor = HandlerExecutor(1, 1, "reject")
+        release.clear()
+        self.assertTrue(executor.submit("test", release.wait, 5))
+        sleep(0.1)
+        self.assertTrue(executor.submit("test", handled.clear))
+        self.assertFalse(executor.submit("test", handled.clear))
+        self.assertEqual(executor.get_stats()["test"]["rejected"], 1)
+        release.set()
+        self.assertTrue(executor.join(5))
+        executor.shutdown()
+
+        # Probes do not take queue space, are not dropped or counted
+        executor = HandlerExecutor(1, 1, "drop-oldest")
+        release.clear()
+        handled.clear()
+        self.assertTrue(executor.submit("test", release.wait, 5))
+        sleep(0.1)
+        self.assertTrue(executor.submit_probe("test", handled.append,
+                                              "probe"))
+        self.assertTrue(executor.submit("test", handled.append, 1))
+        self.assertTrue(executor.submit("test", handled.append, 2))
+        self.assertEqual(executor.get_stats()["test"]["depth"], 1)
+        release.set()
+        self.assertTrue(executor.join(5))
+        self.assertEqual(handled, ["probe", 2])
+        stats = executor.get_stats()["test"]
+        self.assertEqual(stats["processed"], 2)
+        self.assertEqual(stats["dropped"], 1)
+        executor.shutdown()
+        with self.assertRaises(ValueError):
+            HandlerExecutor(policy="invalid")
+
+        # Calls are only dropped if configured to
+        service = NeonHardwareAbstractionLayer(config={"handler_workers": 1},
+                                               bus=FakeBus())
+        self.assertEqual(service.handler_executor.policy, "block")
+        service.shutdown()
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_coalesce_emits(self, find_plugins):
+        from threading import enumerate as threads
+        from ovos_bus_client.message import Message
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                self.bus = bus
+
+        find_plugins.return_value = _entrypoints({"plugin": _Plugin})
+        bus = FakeBus()
+        received = {"debounce": [], "throttle": [], "last": [], "other": []}
+        for msg_type in received:
+            bus.on(f"test.{msg_type}",
+                   lambda m: received[m.msg_type.split('.')[1]].append(
+                       m.data["i"]))
+        config = {"coalesce": {
+            "test.debounce": {"policy": "debounce", "window": 0.3},
+            "test.throttle": {"policy": "throttle", "window": 0.3},
+            "test.last": {"policy": "last-value", "window": 0.3}}}
+        service = NeonHardwareAbstractionLayer(config=config, bus=bus)
+        service.start()
+        plugin_bus = service.drivers["plugin"].bus
+        for i in range(5):
+            for msg_type in received:
+                plugin_bus.emit(Message(f"test.{msg_type}", {"i": i}))
+            sleep(0.1)
+        self.assertEqual(received["other"], [0, 1, 2, 3, 4])
+        self.assertEqual(received["debounce"], [])
+        # Windows share one thread rather than a timer per message
+        self.assertEqual(len([t for t in threads()
+                              if t.name == "emit_coalescer"]), 1)
+        self.assertEqual(received["throttle"][0], 0)
+        self.assertEqual(len(received["last"]), 1)
+        sleep(0.5)
+        self.assertEqual(received["debounce"], [4])
+        self.assertEqual(received["throttle"][-1], 4)
+        self.assertLess(len(received["throttle"]), 5)
+        self.assertEqual(received["last"][-1], 4)
+        self.assertLess(len(received["last"]), 5)
+
+        stats = service.coalescer.get_stats()
+        self.assertEqual(stats["test.debounce"],
+                         {"received": 5, "emitted": 1})
+        self.assertNotIn("test.other", stats)
+
+        # Held messages are emitted on shutdown
+        plugin_bus.emit(Message("test.debounce", {"i": 5}))
+        service.shutdown()
+        self.assertEqual(received["debounce"], [4, 5])
+        self.assertIsNone(service.coalescer._thread)
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_memory_profiler(self, find_plugins):
+        import json
+        import tracemalloc
+        from tempfile import mkdtemp
+        from os.path import join
+        from ovos_bus_client.message import Message
+        from neon_enclosure.memory import MemoryProfiler
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                self.data = list()
+                bus.on("test.allocate", self.on_allocate)
+
+            def on_allocate(self, _):
+                self.data.append(bytearray(1024 * 1024))
+
+        find_plugins.return_value = _entrypoints({"plugin": _Plugin})
+        bus = FakeBus()
+        path = join(mkdtemp(), "memory.jsonl")
+        service = NeonHardwareAbstractionLayer(
+            bus=bus, memory_profiler=MemoryProfiler(interval=60, path=path))
+        service.start()
+        self.assertFalse(service.memory_profiler.running)
+        self.assertIn("plugin", service.memory_profiler.plugin_paths)
+
+        resp = bus.wait_for_response(
+            Message("neon.phal.memory_profiler.start"))
+        self.assertTrue(resp.data["running"])
+        self.assertTrue(tracemalloc.is_tracing())
+        bus.emit(Message("test.allocate"))
+        service.handler_executor.join(5)
+        resp = bus.wait_for_response(
+            Message("neon.phal.memory_profiler.sample"))
+        self.assertGreaterEqual(resp.data["sample"]["growth"]["plugin"],
+                                1024 * 1024)
+
+        resp = bus.wait_for_response(Message("neon.phal.memory_profiler.stop"))
+        self.assertFalse(resp.data["running"])
+        self.assertFalse(tracemalloc.is_tracing())
+        with open(path) as f:
+            samples = [json.loads(line) for line in f]
+        self.assertEqual(len(samples), 2)
+        service.shutdown()
+
+        # Tracing started elsewhere is left running
+        tracemalloc.start()
+        try:
+            profiler = MemoryProfiler(interval=60, path=path)
+            profiler.start()
+            profiler.stop()
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_isolated_plugins(self, find_plugins):
+        from os import getpid, kill, remove
+        from os.path import isfile, join
+        from signal import SIGKILL
+        from tempfile import mkdtemp
+        from ovos_bus_client.message import Message
+        from neon_enclosure.workers import PluginWorker
+
+        def _wait_for_pid(path):
+            timeout = time() + 30
+            while not isfile(path) and time() < timeout:
+                sleep(0.1)
+            sleep(0.1)
+            with open(path) as f:
+                return int(f.read())
+
+        pid_file = join(mkdtemp(), "pid")
+        find_plugins.return_value = _entrypoints({"worker": _WorkerPlugin})
+        bus = FakeBus()
+        service = NeonHardwareAbstractionLayer(
+            config={"isolated_plugins": ["worker"],
+                    "worker_check_interval": 0.1,
+                    "worker_bus": {"host": "127.0.0.1", "port": 1},
+                    "worker": {"pid_file": pid_file}}, bus=bus)
+        service.start()
+        worker = service.drivers["worker"]
+        self.assertIsInstance(worker, PluginWorker)
+        pid = _wait_for_pid(pid_file)
+        self.assertEqual(pid, worker.pid)
+        self.assertNotEqual(pid, getpid())
+
+        resp = bus.wait_for_response(Message("neon.phal.get_worker_stats"))
+        stats = resp.data["workers"]["worker"]
+        self.assertTrue(stats["alive"])
+        self.assertGreater(stats["rss"], 0)
+        self.assertEqual(stats["restarts"], 0)
+
+        # Crashed worker is restarted
+        remove(pid_file)
+        kill(pid, SIGKILL)
+        worker.process.join()
+        timeout = time() + 10
+        while not worker.restarts and time() < timeout:
+            sleep(0.1)
+        self.assertEqual(len(worker.restarts), 1)
+        self.assertNotEqual(_wait_for_pid(pid_file), pid)
+
+        service.shutdown()
+        self.assertFalse(worker.alive)
+        self.assertEqual(service.shutdown_report["completed"], ["worker"])
+
+        # Workers exit when the service process is killed
+        import subprocess
+        import sys
+        from os.path import dirname
+        pid_file = join(mkdtemp(), "pid")
+        script = (f"import sys\n"
+                  f"sys.path.insert(0, {dirname(__file__)!r})\n"
+                  f"from time import sleep\n"
+                  f"from test_enclosure_service import _WorkerPlugin\n"
+                  f"from neon_enclosure.workers import PluginWorker\n"
+                  f"worker = PluginWorker('orphan', _WorkerPlugin, "
+                  f"{{'pid_file': {pid_file!r}}}, "
+                  f"{{'host': '127.0.0.1', 'port': 1}})\n"
+                  f"sleep(60)\n")
+        parent = subprocess.Popen([sys.executable, "-c", script])
+        pid = _wait_for_pid(pid_file)
+        parent.kill()
+        parent.wait()
+
+        def _running(pid):
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+            except OSError:
+                return False
+
+        timeout = time() + 10
+        while _running(pid) and time() < timeout:
+            sleep(0.1)
+        self.assertFalse(_running(pid))
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_reload_config(self, find_plugins):
+        init = Mock()
+        shutdown = Mock()
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                init(config)
+                self.config = config
+                bus.on("test.message", self.on_message)
+
+            def on_message(self, message):
+                pass
+
+            def shutdown(self):
+                shutdown(self.config)
+
+        find_plugins.return_value = _entrypoints({"one": _Plugin,
+                                                  "two": _Plugin,
+                                                  "three": _Plugin})
+        bus = FakeBus()
+        reloaded = Mock()
+        bus.on("neon.phal.plugins_reloaded", reloaded)
+        config = {"handler_workers": 0,
+                  "one": {"value": 1},
+                  "two": {"value": 2},
+                  "three": {"enabled": False}}
+        service = NeonHardwareAbstractionLayer(config=config, bus=bus)
+        service.start()
+        self.assertEqual(init.call_count, 2)
+        one, two = service.drivers["one"], service.drivers["two"]
+
+        # Unchanged config does nothing
+        report = service.reload_config(config)
+        self.assertFalse(any(report.values()))
+        reloaded.assert_not_called()
+
+        # Only the changed plugin is reloaded
+        new_config = {**config, "one": {"value": 10}, "load_workers": 1}
+        report = service.reload_config(new_config)
+        self.assertEqual(report["reloaded"], ["one"])
+        self.assertEqual(report["unloaded"], [])
+        shutdown.assert_called_once_with({"value": 1})
+        init.assert_called_with({"value": 10})
+        self.assertIsNot(service.drivers["one"], one)
+        self.assertIs(service.drivers["two"], two)
+        self.assertEqual(service.user_config["load_workers"], 1)
+        self.assertEqual(reloaded.call_args[0][0].data, report)
+
+        # Disabled and enabled plugins are unloaded and loaded
+        new_config = {**new_config, "two": {"enabled": False},
+                      "three": {"value": 3}}
+        report = service.reload_config(new_config)
+        self.assertEqual(report["unloaded"], ["two"])
+        self.assertEqual(report["loaded"], ["three"])
+        self.assertEqual(set(service.drivers.keys()), {"one", "three"})
+        self.assertNotIn("two", service.plugin_buses)
+        self.assertEqual(len(bus.ee.listeners("test.message")), 2)
+        service.shutdown()
+
+        # Config changes are ignored after shutdown
+        with patch.object(service, "reload_config") as reload_config:
+            service._on_config_changed()
+            reload_config.assert_not_called()
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_plugin_state(self, find_plugins):
+        import json
+        from os import stat
+        from tempfile import mkdtemp
+        from os.path import join
+        restored = Mock()
+
+        class _StatePlugin:
+            def __init__(self, bus, config, state):
+                self.state = state
+                self.state.setdefault("starts", 0)
+                self.state["starts"] += 1
+
+            def shutdown(self):
+                self.state["token"] = "secret"
+
+        class _HookPlugin:
+            def __init__(self, bus, config):
+                self.value = None
+
+            def restore_state(self, state):
+                restored(state)
+                self.value = state["value"]
+
+            def save_state(self):
+                return {"value": "cached", "bad": {1, 2}} \
+                    if self.value else {"value": "cached"}
+
+        find_plugins.return_value = _entrypoints({"state": _StatePlugin,
+                                                  "hooks": _HookPlugin,
+                                                  "lazy": _StatePlugin})
+        path = join(mkdtemp(), "state.json")
+        config = {"handler_workers": 0, "state_path": path,
+                  "lazy": {"lazy_messages": ["test.lazy"]}}
+
+        service = NeonHardwareAbstractionLayer(bus=FakeBus(), config=config)
+        service.start()
+        self.assertEqual(service.drivers["state"].state["starts"], 1)
+        self.assertIsNone(service.drivers["state"].state.saved_at)
+        restored.assert_not_called()
+        service.shutdown()
+        with open(path) as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot["plugins"],
+                         {"state": {"starts": 1, "token": "secret"},
+                          "hooks": {"value": "cached"}})
+        self.assertEqual(stat(path).st_mode & 0o777, 0o600)
+
+        # Restored on restart; lazy plugin state is saved on deactivate
+        service = NeonHardwareAbstractionLayer(bus=FakeBus(), config=config)
+        service.start()
+        self.assertEqual(service.drivers["state"].state["starts"], 2)
+        self.assertEqual(service.drivers["state"].state.saved_at,
+                         snapshot["time"])
+        restored.assert_called_once_with({"value": "cached"})
+        self.assertEqual(service.drivers["hooks"].value, "cached")
+        service.drivers["lazy"].activate()
+        service.shutdown()
+        with open(path) as f:
+            snapshot = json.load(f)
+        # Unserializable state is not written
+        self.assertNotIn("hooks", snapshot["plugins"])
+        self.assertEqual(snapshot["plugins"]["state"]["starts"], 2)
+        self.assertEqual(snapshot["plugins"]["lazy"],
+                         {"starts": 1, "token": "secret"})
+
+        # Unchanged state is not rewritten
+        service = NeonHardwareAbstractionLayer(bus=FakeBus(), config=config)
+        self.assertFalse(service.state_store.snapshot())
+        mtime = stat(path).st_mtime_ns
+        self.assertTrue(service.state_store.snapshot(force=True))
+        self.assertNotEqual(stat(path).st_mtime_ns, mtime)
+
+        # Expired snapshots are ignored
+        config["state_max_age"] = 0.01
+        sleep(0.1)
+        service = NeonHardwareAbstractionLayer(bus=FakeBus(), config=config)
+        self.assertEqual(service.state_store.get("state"), {})
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_cpu_accounting(self, find_plugins):
+        import threading
+        from urllib.request import urlopen
+        from time import thread_time
+        from ovos_bus_client.message import Message
+
+        def _spin(seconds: float):
+            start = thread_time()
+            while thread_time() - start < seconds:
+                pass
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                self.stop = Event()
+                bus.on("test.spin", self.on_spin)
+                Thread(target=self.run, daemon=True).start()
+
+            def run(self):
+                # Threads started by plugin threads are also attributed
+                Thread(target=_spin, args=(0.2,), daemon=True).start()
+                _spin(0.2)
+                self.stop.wait()
+
+            def on_spin(self, message):
+                _spin(0.2)
+
+            def shutdown(self):
+                self.stop.set()
+
+        class _IdlePlugin:
+            def __init__(self, bus, config):
+                pass
+
+        find_plugins.return_value = _entrypoints({"busy": _Plugin,
+                                                  "idle": _IdlePlugin})
+        bus = FakeBus()
+        service = NeonHardwareAbstractionLayer(
+            bus=bus, config={"cpu_accounting": True,
+                             "metrics_server": {"enabled": True, "port": 0}})
+        service.start()
+        bus.emit(Message("test.spin"))
+        service.handler_executor.join(5)
+        sleep(0.5)
+
+        resp = bus.wait_for_response(Message("neon.phal.get_cpu_stats"))
+        stats = resp.data["cpu"]
+        self.assertEqual(stats["plugins"]["busy"]["threads"], 1)
+        self.assertGreaterEqual(stats["plugins"]["busy"]["handler_cpu_time"],
+                                0.15)
+        self.assertGreaterEqual(stats["plugins"]["busy"]["cpu_time"], 0.5)
+        self.assertNotIn("idle", stats["plugins"])
+        self.assertGreater(stats["rss"], 0)
+        self.assertGreaterEqual(stats["cpu_time"],
+                                stats["plugins"]["busy"]["cpu_time"])
+
+        port = service.metrics_server.port
+        with urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+            self.assertEqual(resp.status, 200)
+            text = resp.read().decode()
+        self.assertIn("# TYPE neon_phal_plugin_cpu_seconds_total counter",
+                      text)
+        self.assertIn('neon_phal_plugin_threads{plugin="busy"} 1', text)
+        self.assertIn("process_resident_memory_bytes ", text)
+        from neon_enclosure import cpu
+        users = cpu._hook_users
+        service.shutdown()
+        self.assertIsNone(service.metrics_server._server)
+        self.assertEqual(cpu._hook_users, users - 1)
+
+        # Thread.start is restored when no service needs it
+        with patch("neon_enclosure.cpu._hook_users", 0):
+            accounting = cpu.CPUAccounting()
+            self.assertIs(threading.Thread.start, cpu._start)
+            accounting.close()
+            accounting.close()
+            self.assertIs(threading.Thread.start, cpu._original_start)
+            self.assertEqual(cpu._hook_users, 0)
+        if cpu._hook_users:
+            # Services from other tests are still running
+            threading.Thread.start = cpu._start
+
+        # Accounting is opt-in
+        service = NeonHardwareAbstractionLayer(bus=FakeBus(), config={
+            "metrics_server": {"enabled": True, "port": 0}})
+        self.assertIsNone(service.cpu_accounting)
+        self.assertIsNone(service.metrics_server)
+        service.shutdown()
+
+        # Accounting is disabled where native thread IDs are unavailable
+        with patch("neon_enclosure.service.CPU_ACCOUNTING_SUPPORTED", False):
+            service = NeonHardwareAbstractionLayer(bus=FakeBus(), config={
+                "cpu_accounting": True,
+                "metrics_server": {"enabled": True, "port": 0}})
+            self.assertIsNone(service.cpu_accounting)
+            self.assertIsNone(service.metrics_server)
+            service.shutdown()
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_tracing(self, find_plugins):
+        from ovos_bus_client.message import Message
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                self.bus = bus
+                bus.on("test.request", self.on_request)
+
+            def on_request(self, message):
+                sleep(0.01)
+                self.bus.emit(message.response())
+
+        find_plugins.return_value = _entrypoints({"plugin": _Plugin})
+        bus = FakeBus()
+        responses = list()
+        bus.on("test.request.response", responses.append)
+        service = NeonHardwareAbstractionLayer(
+            bus=bus, config={"tracing": {"sample_rate": 0,
+                                         "buffer_size": 4}})
+        service.start()
+        # Unsampled messages are not traced
+        bus.emit(Message("test.request"))
+        # Messages with a trace ID are traced, including emitted responses
+        bus.emit(Message("test.request", context={"trace_id": "one"}))
+        service.handler_executor.join(5)
+        self.assertEqual(responses[1].context["trace_id"], "one")
+        self.assertNotIn("trace_id", responses[0].context)
+
+        resp = bus.wait_for_response(Message("neon.phal.get_traces"))
+        records = resp.data["traces"]
+        self.assertEqual([(r["trace_id"], r["kind"]) for r in records],
+                         [("one", "handle"), ("one", "emit")])
+        handled = records[0]
+        self.assertLessEqual(handled["received"], handled["dispatched"])
+        self.assertGreaterEqual(handled["completed"] - handled["dispatched"],
+                                0.01)
+
+        # The buffer keeps only the newest records
+        service.tracer.sample_rate = 1
+        for _ in range(3):
+            bus.emit(Message("test.request"))
+        service.handler_executor.join(5)
+        records = service.tracer.get_records()
+        self.assertEqual(len(records), 4)
+        self.assertNotIn("one", [r["trace_id"] for r in records])
+        trace_id = records[-1]["trace_id"]
+        self.assertEqual(len(service.tracer.get_records(trace_id)), 2)
+        service.shutdown()
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_scheduler(self, find_plugins):
+        from ovos_bus_client.message import Message
+        from neon_enclosure.scheduler import Scheduler
+        ticks = list()
+        once = Event()
+        running = list()
+        overlaps = list()
+
+        class _Plugin:
+            def __init__(self, bus, config, scheduler):
+                self.scheduler = scheduler
+                scheduler.schedule_repeating(self.tick, 0.05, delay=0)
+                scheduler.schedule_repeating(self.slow, 0.05, name="slow")
+                scheduler.schedule_once(once.set, 0.05)
+
+            def tick(self):
+                ticks.append(time())
+
+            def slow(self):
+                if running:
+                    overlaps.append(True)
+                running.append(True)
+                sleep(0.12)
+                running.pop()
+
+        class _LegacyPlugin:
+            def __init__(self, bus, config):
+                pass
+
+        find_plugins.return_value = _entrypoints({"plugin": _Plugin,
+                                                  "legacy": _LegacyPlugin})
+        bus = FakeBus()
+        config = {"handler_workers": 0, "plugin": {}, "legacy": {}}
+        service = NeonHardwareAbstractionLayer(bus=bus, config=config)
+        service.start()
+        self.assertTrue(once.wait(2))
+        sleep(0.5)
+        resp = bus.wait_for_response(Message("neon.phal.get_scheduler_stats",
+                                             {"plugin": "plugin"}))
+        jobs = {job["name"]: job for job in resp.data["jobs"].values()}
+        self.assertEqual(set(jobs.keys()), {"plugin.tick", "plugin.slow"})
+        self.assertGreaterEqual(jobs["plugin.tick"]["runs"], 5)
+        self.assertGreaterEqual(jobs["plugin.slow"]["runs"], 2)
+        self.assertGreater(jobs["plugin.slow"]["coalesced"], 0)
+        self.assertGreaterEqual(jobs["plugin.slow"]["mean"], 0.12)
+        self.assertEqual(overlaps, [])
+        # Finished one-shot jobs do not leave an executor queue behind
+        self.assertEqual(set(service.scheduler._executor.get_stats().keys()),
+                         set(resp.data["jobs"].keys()))
+
+        # Jobs are cancelled when a plugin is unloaded
+        service.reload_config({**config, "plugin": {"enabled": False}})
+        self.assertEqual(service.scheduler.get_stats(), {})
+        count = len(ticks)
+        sleep(0.2)
+        self.assertEqual(len(ticks), count)
+        service.shutdown()
+
+        # Wakeups are aligned to `granularity` on the wall clock
+        scheduler = Scheduler(granularity=0.25)
+        runs = list()
+        scheduler.schedule_repeating(lambda: runs.append(time()), 0.1,
+                                     jitter=0.05)
+        sleep(0.8)
+        scheduler.shutdown()
+        self.assertGreaterEqual(len(runs), 2)
+        for run in runs:
+            self.assertLess(abs(run - round(run / 0.25) * 0.25), 0.05)
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_watchdog(self, find_plugins):
+        from ovos_bus_client.message import Message
+        from ovos_utils.process_utils import ProcessState
+        release = Event()
+        instances = list()
+
+        class _Blocking:
+            def __init__(self, bus, config):
+                instances.append(self)
+                bus.on("test.block", self.on_block)
+
+            def on_block(self, _):
+                release.wait(10)
+
+        class _Unhealthy:
+            healthy = False
+
+            def __init__(self, bus, config):
+                bus.on("test.unhealthy", self.on_message)
+
+            def on_message(self, _):
+                pass
+
+            def heartbeat(self):
+                return _Unhealthy.healthy
+
+        find_plugins.return_value = _entrypoints({"blocking": _Blocking,
+                                                  "unhealthy": _Unhealthy})
+        bus = FakeBus()
+        statuses = list()
+        bus.on("neon.phal.plugin_status",
+               lambda m: statuses.append((m.data["plugin"],
+                                          m.data["status"])))
+        config = {"watchdog": {"interval": 0.1, "handler_budget": 0.25,
+                               "heartbeat_timeout": 0.25, "max_misses": 2,
+                               "max_restarts": 1}}
+        service = NeonHardwareAbstractionLayer(config=config, bus=bus)
+        service.start()
+
+        # Blocked handler causes a restart
+        bus.emit(Message("test.block"))
+        timeout = time() + 5
+        while len(instances) < 2 and time() < timeout:
+            sleep(0.1)
+        self.assertEqual(len(instances), 2)
+        self.assertIs(service.drivers["blocking"], instances[1])
+        self.assertIn(("blocking", "degraded"), statuses)
+        self.assertIn(("blocking", "restarted"), statuses)
+
+        # Failed heartbeat is restarted, then quarantined
+        timeout = time() + 5
+        while "unhealthy" not in service.quarantined and time() < timeout:
+            sleep(0.1)
+        self.assertIn("unhealthy", service.quarantined)
+        self.assertIn(("unhealthy", "restarted"), statuses)
+        self.assertEqual(statuses[-1], ("unhealthy", "quarantined"))
+        self.assertEqual(service.status.state, ProcessState.ERROR)
+        self.assertEqual(len(bus.ee.listeners("test.unhealthy")), 0)
+        resp = bus.wait_for_response(Message("neon.phal.get_plugin_status"))
+        self.assertEqual(resp.data["plugins"]["unhealthy"]["status"],
+                         "quarantined")
+        self.assertNotIn("blocking", service.quarantined)
+
+        # Released plugin is restarted
+        _Unhealthy.healthy = True
+        resp = bus.wait_for_response(Message("neon.phal.release_plugin",
+                                             {"plugin": "unhealthy"}))
+        self.assertTrue(resp.data["restarted"])
+        self.assertEqual(service.quarantined, {})
+        self.assertEqual(service.status.state, ProcessState.READY)
+        self.assertEqual(len(bus.ee.listeners("test.unhealthy")), 1)
+        release.set()
+        service.shutdown()
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_lazy_plugins(self, find_plugins):
+        from ovos_bus_client.message import Message
+        init = Mock()
+        shutdown = Mock()
+
+        events = list()
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                init()
+                self.bus = bus
+                self.bus.on("test.ping", self.on_ping)
+                self.bus.on("test.slow", self.on_slow)
+
+            def on_ping(self, message):
+                self.bus.emit(message.reply("test.pong"))
+
+            def on_slow(self, _):
+                events.append("start")
+                sleep(1)
+                events.append("end")
+
+            def shutdown(self):
+                shutdown()
+                events.append("shutdown")
+                self.bus.remove("test.ping", self.on_ping)
+
+        find_plugins.return_value = _entrypoints({"lazy": _Plugin})
+        config = {"lazy": {"lazy_messages": ["test.ping", "test.slow"],
+                           "idle_timeout": 0.5}}
+        bus = FakeBus()
+        pong = Mock()
+        bus.on("test.pong", pong)
+        service = NeonHardwareAbstractionLayer(config=config, bus=bus)
+        service.start()
+        find_plugins.return_value["lazy"].load.assert_not_called()
+        init.assert_not_called()
+        self.assertFalse(service.drivers["lazy"].active)
+
+        # First message activates the plugin and is handled by it
+        bus.emit(Message("test.ping"))
+        service.handler_executor.join(5)
+        init.assert_called_once()
+        pong.assert_called_once()
+        self.assertTrue(service.drivers["lazy"].active)
+        bus.emit(Message("test.ping"))
+        service.handler_executor.join(5)
+        init.assert_called_once()
+        self.assertEqual(pong.call_count, 2)
+
+        # Idle plugin is unloaded and activated again on demand
+        sleep(1)
+        shutdown.assert_called_once()
+        self.assertFalse(service.drivers["lazy"].active)
+        # Calls queued for the unloaded plugin are discarded
+        self.assertNotIn("lazy", service.handler_executor.get_stats())
+        bus.emit(Message("test.ping"))
+        service.handler_executor.join(5)
+        self.assertEqual(init.call_count, 2)
+        self.assertEqual(pong.call_count, 3)
+
+        # Plugin is not unloaded while a handler is running, and idle time is
+        # measured from when the last call finished
+        bus.emit(Message("test.slow"))
+        sleep(1.3)
+        self.assertEqual(events, ["shutdown", "start", "end"])
+        self.assertTrue(service.drivers["lazy"].active)
+
+        service.shutdown()
+        self.assertEqual(shutdown.call_count, 2)
+        bus.emit(Message("test.ping"))
+        self.assertEqual(init.call_count, 2)
+
+    @patch("neon_enclosure.service.find_plugin_entrypoints")
+    def test_lazy_plugin_activation(self, find_plugins):
+        from threading import current_thread
+        from ovos_bus_client.message import Message
+        init_threads = list()
+        received = list()
+
+        class _Plugin:
+            def __init__(self, bus, config):
+                init_threads.append(current_thread().name)
+                sleep(0.2)
+                bus.on("test.ping", received.append)
+
+        entrypoints = _entrypoints({"lazy": _Plugin})
+        entrypoints["lazy"].load.side_effect = [ImportError("transient"),
+                                                _Plugin]
+        find_plugins.return_value = entrypoints
+        bus = FakeBus()
+        service = NeonHardwareAbstractionLayer(
+            config={"lazy": {"lazy_messages": ["test.ping"]}}, bus=bus)
+        service.start()
+
+        # A failed activation is retried on the next message
+        bus.emit(Message("test.ping", {"n": 0}))
+        service.handler_executor.join(5)
+        self.assertFalse(service.drivers["lazy"].active)
+
+        # Activation does not block the bus; messages received while
+        # activating are each handled once
+        start = time()
+        for n in range(1, 4):
+            bus.emit(Message("test.ping", {"n": n}))
+        self.assertLess(time() - start, 0.2)
+        service.handler_executor.join(5)
+        self.assertTrue(service.drivers["lazy"].active)
+        self.assertTrue(init_threads[0].startswith("phal_handler"))
+        bus.emit(Message("test.ping", {"n": 4}))
+        service.handler_executor.join(5)
+        self.assertEqual([m.data["n"] for m in received], [1, 2, 3, 4])
+        service.shutdown()
+
 
 class TestAdminEnclosureService(unittest.TestCase):
     bus = FakeBus()
@@ -98,10 +1199,295 @@ class TestAdminEnclosureService(unittest.TestCase):
         stopping.assert_called_once()
 
 
+    @patch("neon_enclosure.admin.jobs.LOG")
+    def test_job_queue(self, log):
+        from ovos_bus_client.message import Message
+        from neon_enclosure.admin.jobs import request_job
+        bus = FakeBus()
+        completed = list()
+        done = Event()
+
+        def _on_complete(message):
+            completed.append(message.data)
+            if len(completed) == 4:
+                done.set()
+
+        bus.on("neon.phal.admin.job_completed", _on_complete)
+        config = {"jobs": {"workers": 2, "commands": {
+            "slow": ["sleep", "0.3"],
+            "echo": "echo 'hello world'",
+            "hang": {"command": ["sleep", "10"], "timeout": 0.2}}}}
+        service = NeonAdminHardwareAbstractionLayer(bus=bus, config=config)
+
+        resp = bus.wait_for_response(Message("neon.phal.admin.run_job",
+                                             {"job": "slow"}))
+        first = resp.data["job"]
+        sleep(0.1)
+        # Identical queued requests are merged but do not run concurrently
+        # with the running job
+        second = bus.wait_for_response(Message("neon.phal.admin.run_job",
+                                               {"job": "slow"})).data["job"]
+        merged = bus.wait_for_response(Message("neon.phal.admin.run_job",
+                                               {"job": "slow"})).data["job"]
+        self.assertNotEqual(first["job_id"], second["job_id"])
+        self.assertEqual(merged["job_id"], second["job_id"])
+        self.assertEqual(merged["requests"], 2)
+        # Other jobs are not blocked by a slow job
+        self.assertEqual(request_job(bus, "echo")["job"], "echo")
+        bus.emit(Message("neon.phal.admin.run_job", {"job": "hang"}))
+        resp = bus.wait_for_response(Message("neon.phal.admin.run_job",
+                                             {"job": "rm -rf /"}))
+        self.assertIn("Unknown job", resp.data["error"])
+        with self.assertRaises(ValueError):
+            request_job(bus, "rm -rf /")
+
+        self.assertTrue(done.wait(5))
+        by_id = {job["job_id"]: job for job in completed}
+        self.assertEqual(completed[0]["job"], "echo")
+        # Command output is logged but not sent on the bus
+        self.assertNotIn("stdout", completed[0])
+        self.assertIn(f"Job echo ({completed[0]['job_id']}) stdout:\n"
+                      f"hello world\n",
+                      [call.args[0] for call in log.info.call_args_list])
+        hang = [job for job in completed if job["job"] == "hang"][0]
+        self.assertEqual(hang["state"], "timed_out")
+        self.assertLess(hang["finished"] - hang["started"], 2)
+        self.assertEqual(by_id[first["job_id"]]["state"], "completed")
+        self.assertGreaterEqual(by_id[second["job_id"]]["started"],
+                                by_id[first["job_id"]]["finished"])
+
+        resp = bus.wait_for_response(Message("neon.phal.admin.get_jobs"))
+        self.assertEqual(len(resp.data["jobs"]), 4)
+        service.shutdown()
+
+
+class TestResilientBus(unittest.TestCase):
+    def test_outbound_buffer(self):
+        from ovos_bus_client.message import Message
+        from neon_enclosure.messagebus import OutboundBuffer
+        buffer = OutboundBuffer(max_size=4, default_retention=60,
+                                retention={"test.transient": 0,
+                                           "test.short": 0.05},
+                                collapse=["test.state.*"])
+        buffer.add(Message("test.state.volume", {"volume": 1}))
+        buffer.add(Message("test.event", {"n": 1}))
+        buffer.add(Message("test.transient"))
+        buffer.add(Message("test.short"))
+        buffer.add(Message("test.state.volume", {"volume": 2}))
+        buffer.add(Message("test.event", {"n": 2}))
+        self.assertEqual(len(buffer), 4)
+        sleep(0.1)
+        buffer.add(Message("test.event", {"n": 3}))
+        # Oldest dropped when full; expired messages are skipped
+        messages = [buffer.pop() for _ in range(len(buffer))]
+        self.assertEqual([(m.msg_type, m.data) for m in messages if m],
+                         [("test.state.volume", {"volume": 2}),
+                          ("test.event", {"n": 2}),
+                          ("test.event", {"n": 3})])
+        self.assertEqual(buffer.stats["collapsed"], 1)
+        self.assertEqual(buffer.stats["expired"], 1)
+        self.assertEqual(buffer.stats["dropped"], 2)
+        self.assertIsNone(buffer.pop())
+
+    def test_resilient_bus_client(self):
+        from ovos_bus_client.message import Message
+        from websocket import WebSocketConnectionClosedException
+        from neon_enclosure.messagebus import ResilientBusClient
+        bus = ResilientBusClient(min_retry=0.01, max_retry=0.05)
+        for attempts in range(8):
+            bus._attempts = attempts
+            self.assertTrue(0.01 <= bus.get_retry_delay() <= 0.05)
+        bus._attempts = 0
+
+        # Messages emitted while disconnected are replayed in order
+        bus.emit(Message("test.one"))
+        bus.emit(Message("test.two"))
+        self.assertEqual(len(bus.buffer), 2)
+        bus.client = Mock()
+        bus.on_open()
+        sleep(0.2)
+        sent = [Message.deserialize(call[0][0]).msg_type
+                for call in bus.client.send.call_args_list]
+        # Emitted during replay, so sent after buffered messages
+        self.assertEqual(sent, ["test.one", "test.two", "ovos.session.sync"])
+        self.assertEqual(bus.buffer.stats["replayed"], 3)
+
+        # Messages emitted while connecting are not left in the buffer
+        class _ConnectedEvent(Event):
+            def set(self):
+                if not self.is_set():
+                    Thread(target=bus.emit,
+                           args=(Message("test.connecting"),)).start()
+                    sleep(0.05)
+                Event.set(self)
+
+        bus.connected_event = _ConnectedEvent()
+        bus.client = Mock()
+        bus.on_open()
+        sleep(0.2)
+        sent = [Message.deserialize(call[0][0]).msg_type
+                for call in bus.client.send.call_args_list]
+        self.assertIn("test.connecting", sent)
+        self.assertEqual(len(bus.buffer), 0)
+
+        # Messages that fail to send are buffered
+        bus.client.send.side_effect = WebSocketConnectionClosedException()
+        bus.emit(Message("test.three"))
+        self.assertEqual(len(bus.buffer), 1)
+
+        # Reconnect with backoff until closed
+        reconnecting = Mock()
+        bus.on("reconnecting", reconnecting)
+        client = Mock()
+
+        def _run_forever():
+            if client.run_forever.call_count == 3:
+                bus.close()
+        client.run_forever.side_effect = _run_forever
+        bus.client = client
+        bus.create_client = Mock(return_value=client)
+        bus.run_forever()
+        self.assertEqual(client.run_forever.call_count, 3)
+        self.assertEqual(bus.create_client.call_count, 2)
+        self.assertFalse(bus.connected_event.is_set())
+
+
+class TestCombinedServices(unittest.TestCase):
+    @patch("neon_enclosure.admin.__main__.init_memory_profiler")
+    @patch("neon_enclosure.__main__.init_memory_profiler")
+    @patch("neon_enclosure.combined.init_log")
+    @patch("neon_enclosure.__main__.init_log")
+    def test_start_services(self, _, __, init_profiler, init_admin_profiler):
+        from neon_enclosure.combined import start_services
+        bus = FakeBus()
+        service, admin = start_services(bus=bus, standalone=False)
+        # The shared profiler is passed in, so neither service creates one
+        init_profiler.assert_not_called()
+        init_admin_profiler.assert_not_called()
+        self.assertIsInstance(service, NeonHardwareAbstractionLayer)
+        self.assertIsInstance(admin, NeonAdminHardwareAbstractionLayer)
+        self.assertTrue(service.started.is_set())
+        self.assertTrue(admin.started.is_set())
+        self.assertEqual(service.bus, bus)
+        self.assertEqual(admin.bus, bus)
+        self.assertIs(service.memory_profiler, admin.memory_profiler)
+        service.shutdown()
+        admin.shutdown()
+
+    @patch("neon_enclosure.combined.Configuration")
+    @patch("neon_enclosure.combined.init_log")
+    @patch("neon_enclosure.__main__.init_log")
+    def test_start_services_config(self, _, __, configuration):
+        from neon_enclosure.combined import start_services
+        config = {"PHAL": {"user-plugin": {"enabled": True},
+                           "admin": {"admin-plugin": {"enabled": True}}}}
+        configuration.return_value = config
+        service, admin = start_services(bus=FakeBus(), standalone=False)
+        self.assertEqual(service.admin_config,
+                         {"admin-plugin": {"enabled": True}})
+        self.assertEqual(admin.admin_config, service.admin_config)
+        self.assertNotIn("admin", service.user_config)
+        self.assertIn("user-plugin", admin.user_config)
+        # Shared configuration is not modified
+        self.assertIn("admin", config["PHAL"])
+        self.assertTrue(service._watch_config)
+        service.shutdown()
+        admin.shutdown()
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_benchmark(self):
+        from neon_enclosure.benchmark import run_benchmark
+        with patch("ovos_PHAL.service.Configuration") as configuration:
+            results = run_benchmark(plugin_count=3, messages=50,
+                                    concurrency=2)
+        configuration.assert_not_called()
+        self.assertEqual(results["plugins"], 3)
+        self.assertEqual(results["sent"], 50)
+        self.assertEqual(results["received"], 50)
+        self.assertEqual(results["dropped"], 0)
+        self.assertGreater(results["throughput"], 0)
+        for key in ("construct", "start_to_ready", "shutdown"):
+            self.assertGreater(results[key], 0)
+        self.assertLessEqual(results["latency"]["p50"],
+                             results["latency"]["p99"])
+
+    def test_compare_to_baseline(self):
+        from neon_enclosure.benchmark import compare_to_baseline
+        baseline = {"construct": 0.1, "shutdown": 0.001, "throughput": 1000,
+                    "latency": {"p50": 0.01, "p95": 0.02}}
+        self.assertEqual(compare_to_baseline(baseline, baseline), [])
+        results = {"construct": 0.2, "shutdown": 0.003, "throughput": 700,
+                   "latency": {"p50": 0.011, "p95": 0.05}}
+        regressions = compare_to_baseline(results, baseline, 0.25)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(regressions[0].startswith("construct"))
+        self.assertTrue(regressions[1].startswith("throughput"))
+        self.assertTrue(regressions[2].startswith("latency.p95"))
+
+
+class TestPluginDiscovery(unittest.TestCase):
+    def test_find_plugin_entrypoints(self):
+        from tempfile import mkdtemp
+        from os.path import isfile, join
+        from neon_enclosure.discovery import find_plugin_entrypoints, \
+            write_plugin_manifest
+        test_dir = mkdtemp()
+        cache = join(test_dir, "cache.json")
+        manifest = join(test_dir, "manifest.json")
+
+        # Discovery results are cached
+        plugins = find_plugin_entrypoints("console_scripts", manifest, cache)
+        self.assertEqual(plugins["neon-enclosure"].value,
+                         "neon_enclosure.cli:neon_enclosure_cli")
+        self.assertTrue(isfile(cache))
+        with patch("neon_enclosure.discovery.scan_plugin_entrypoints") as scan:
+            cached = find_plugin_entrypoints("console_scripts", manifest,
+                                             cache)
+            scan.assert_not_called()
+        self.assertEqual(cached, plugins)
+
+        # Cache is invalidated when the environment changes
+        with patch("neon_enclosure.discovery.get_environment_fingerprint") \
+                as fingerprint:
+            fingerprint.return_value = "changed"
+            with patch("neon_enclosure.discovery.scan_plugin_entrypoints") \
+                    as scan:
+                scan.return_value = {"new": "new_plugin:Plugin"}
+                plugins = find_plugin_entrypoints("console_scripts",
+                                                  manifest, cache)
+                scan.assert_called_once()
+        self.assertEqual(list(plugins.keys()), ["new"])
+
+        # Manifest is used without discovery
+        write_plugin_manifest(manifest, ["console_scripts"])
+        with patch("neon_enclosure.discovery.scan_plugin_entrypoints") as scan:
+            plugins = find_plugin_entrypoints("console_scripts", manifest,
+                                              cache)
+            scan.assert_not_called()
+        self.assertIn("neon-enclosure", plugins)
+        self.assertEqual(find_plugin_entrypoints("console_scripts", manifest,
+                                                 cache)["neon-enclosure"]
+                         .load().name, "neon-enclosure")
+
+
+class TestUtils(unittest.TestCase):
+    def test_get_unsatisfied_requirements(self):
+        from neon_enclosure.utils import get_unsatisfied_requirements
+        satisfied = ["click", "click>=1.0", "ovos-utils~=0.0,>=0.0.1",
+                     "not-a-real-package; python_version < '3'"]
+        unsatisfied = ["click<1.0", "not-a-real-package",
+                       "not-a-real-package>=1.0", "not a valid spec"]
+        self.assertEqual(get_unsatisfied_requirements(satisfied), [])
+        self.assertEqual(get_unsatisfied_requirements(satisfied +
+                                                      unsatisfied),
+                         unsatisfied)
+
+
 class TestCLI(unittest.TestCase):
     runner = CliRunner()
 
-    @patch("neon_enclosure.cli.init_config_dir")
+    @patch("neon_utils.configuration_utils.init_config_dir")
     @patch("neon_enclosure.__main__.main")
     def test_run(self, main, init_config):
         from neon_enclosure.cli import run
@@ -110,7 +1496,7 @@ class TestCLI(unittest.TestCase):
         main.assert_called_once()
 
     @patch("os.geteuid")
-    @patch("neon_enclosure.cli.init_config_dir")
+    @patch("neon_utils.configuration_utils.init_config_dir")
     @patch("neon_enclosure.admin.__main__.main")
     def test_run_admin(self, main, init_config, get_id):
         from neon_enclosure.cli import run_admin
@@ -126,6 +1512,240 @@ class TestCLI(unittest.TestCase):
         init_config.assert_called_once()
         main.assert_called_once()
 
+    @patch("os.geteuid")
+    @patch("neon_utils.configuration_utils.init_config_dir")
+    @patch("neon_enclosure.combined.main")
+    def test_run_all(self, main, init_config, get_id):
+        from neon_enclosure.cli import run_all
+        # Non-root
+        get_id.return_value = 100
+        self.runner.invoke(run_all)
+        init_config.assert_not_called()
+        main.assert_not_called()
+
+        # Root
+        get_id.return_value = 0
+        self.runner.invoke(run_all)
+        init_config.assert_called_once()
+        main.assert_called_once()
+
+    @patch("neon_enclosure.utils.get_dependency_stamp_path")
+    @patch("neon_utils.packaging_utils.install_packages_from_pip")
+    @patch("ovos_config.config.Configuration")
+    def test_install_dependencies(self, config, install, stamp_path):
+        from tempfile import mkdtemp
+        from os.path import join
+        from neon_enclosure.cli import install_dependencies
+        stamp_path.return_value = join(mkdtemp(), "stamp.json")
+        config.return_value = {"extra_dependencies": {
+            "enclosure": ["click", "not-a-real-package"]}}
+        install.return_value = 0
+
+        # Only unsatisfied requirements are passed to pip
+        result = self.runner.invoke(install_dependencies)
+        self.assertEqual(result.exit_code, 0)
+        install.assert_called_once_with("neon-enclosure",
+                                        ["not-a-real-package"])
+
+        # pip is skipped when nothing changed
+        result = self.runner.invoke(install_dependencies)
+        self.assertEqual(result.exit_code, 0)
+        install.assert_called_once()
+
+        # Errors are returned
+        install.return_value = 1
+        result = self.runner.invoke(install_dependencies, ["--force"])
+        self.assertEqual(result.exit_code, 1)
+        install.assert_called_with("neon-enclosure",
+                                   ["click", "not-a-real-package"])
+
+    @patch("neon_enclosure.utils._run_pip")
+    @patch("ovos_config.config.Configuration")
+    def test_wheelhouse(self, config, run_pip):
+        from tempfile import mkdtemp
+        from os.path import join
+        from neon_enclosure.cli import build_wheelhouse, install_dependencies
+        from os import listdir
+        wheelhouse = mkdtemp()
+        config.return_value = {"extra_dependencies": {
+            "global": ["pkg-a"], "enclosure": ["pkg-b"]}}
+        build_dirs = dict()
+
+        def _wheel(args):
+            build_dirs[args[-1]] = args[2]
+            for name in (args[-1], "shared-dep"):
+                with open(join(args[2], f"{name}.whl"), 'w') as f:
+                    f.write(name)
+            return 0
+
+        run_pip.side_effect = _wheel
+        result = self.runner.invoke(build_wheelhouse, ["-j", "2", wheelhouse])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(run_pip.call_count, 2)
+        self.assertEqual(set(build_dirs.keys()), {"pkg-a", "pkg-b"})
+        # Concurrent builds use separate directories, merged afterwards
+        self.assertEqual(len(set(build_dirs.values())), 2)
+        self.assertEqual(set(listdir(wheelhouse)),
+                         {"constraints.txt", "pkg-a.whl", "pkg-b.whl",
+                          "shared-dep.whl"})
+
+        run_pip.reset_mock()
+        run_pip.side_effect = None
+        run_pip.return_value = 0
+        with patch("neon_enclosure.utils.get_dependency_stamp_path") as stamp:
+            stamp.return_value = join(wheelhouse, "stamp.json")
+            result = self.runner.invoke(install_dependencies,
+                                        ["--wheelhouse", wheelhouse])
+        self.assertEqual(result.exit_code, 0, result.output)
+        args = run_pip.call_args.args[0]
+        self.assertEqual(args[:4], ["install", "--no-index", "--find-links",
+                                    wheelhouse])
+        self.assertEqual(args[-2:], ["pkg-a", "pkg-b"])
+
+        # Failed builds are reported
+        run_pip.return_value = 1
+        result = self.runner.invoke(build_wheelhouse, [wheelhouse])
+        self.assertEqual(result.exit_code, 1)
+
+    def test_cli_import_time(self):
+        import subprocess
+        import sys
+        script = ("import sys\n"
+                  "import neon_enclosure.cli\n"
+                  "print(','.join(sorted(sys.modules)))")
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                                 script], capture_output=True, text=True)
+        modules = result.stdout.strip().split(',')
+        for module in ("neon_utils", "ovos_config", "ovos_utils",
+                       "ovos_bus_client", "ovos_PHAL"):
+            self.assertNotIn(module, modules)
+        import_us = [int(line.split('|')[1])
+                     for line in result.stderr.splitlines()
+                     if line.strip().endswith("| neon_enclosure.cli")][0]
+        self.assertLess(import_us / 1000000, 0.1)
+
+        from neon_enclosure.cli import neon_enclosure_cli
+        result = self.runner.invoke(neon_enclosure_cli, ["--version"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("neon_enclosure version", result.output)
+
+    @patch("neon_enclosure.__main__.init_log")
+    @patch("neon_enclosure.__main__.PIDLock")
+    @patch("ovos_config.config.Configuration")
+    def test_profile_startup(self, configuration, pid_lock, init_log):
+        from os.path import isfile
+        from neon_enclosure.cli import profile_startup
+        configuration.return_value = {"PHAL": {
+            "isolated_plugins": ["one"], "two": {"isolated": True}}}
+        with patch("neon_enclosure.__main__.NeonHardwareAbstractionLayer",
+                   wraps=NeonHardwareAbstractionLayer) as service:
+            result = self.runner.invoke(profile_startup)
+        self.assertEqual(result.exit_code, 0, result.output)
+        init_log.assert_called_once()
+        pid_lock.assert_not_called()
+        for phase in ("init_log", "connect_bus", "construct", "start"):
+            self.assertIn(phase, result.output)
+        # Diagnostic runs are isolated from the running service
+        config = service.call_args.kwargs["config"]
+        self.assertFalse(config["state_snapshots"])
+        self.assertFalse(config["hot_reload"])
+        self.assertEqual(config["isolated_plugins"], [])
+        self.assertFalse(config["two"]["isolated"])
+        self.assertFalse(isfile(config["startup_timeline_path"]))
+
+    @patch("ovos_bus_client.client.MessageBusClient")
+    def test_handler_metrics(self, client):
+        from ovos_bus_client.message import Message
+        from neon_enclosure.cli import handler_metrics
+        metrics = {"plugin": {"test.message": {
+            "count": 2, "total": 0.004, "max": 0.003, "p50": 0.0025,
+            "p95": 0.005, "buckets": [0, 1, 1] + [0] * 10}}}
+        client.return_value.wait_for_response.return_value = \
+            Message("neon.phal.get_handler_metrics.response",
+                    {"metrics": metrics,
+                     "queues": {"plugin": {"depth": 7, "max_depth": 9,
+                                           "processed": 2, "dropped": 0,
+                                           "rejected": 0}}})
+        result = self.runner.invoke(handler_metrics)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("test.message", result.output)
+        self.assertIn("2.00", result.output)
+        self.assertIn("max depth", result.output)
+
+        client.return_value.wait_for_response.return_value = None
+        result = self.runner.invoke(handler_metrics)
+        self.assertEqual(result.exit_code, 1)
+
+    @patch("ovos_bus_client.client.MessageBusClient")
+    def test_traces(self, client):
+        from ovos_bus_client.message import Message
+        from neon_enclosure.cli import traces
+        records = [{"trace_id": "abc123", "plugin": "plugin",
+                    "msg_type": "test.message", "kind": "handle",
+                    "received": 1700000000.0, "dispatched": 1700000000.002,
+                    "completed": 1700000000.0055},
+                   {"trace_id": "abc123", "plugin": "plugin",
+                    "msg_type": "test.response", "kind": "emit",
+                    "received": 1700000000.005, "dispatched": None,
+                    "completed": None}]
+        client.return_value.wait_for_response.return_value = \
+            Message("neon.phal.get_traces.response", {"traces": records})
+        result = self.runner.invoke(traces, ["-t", "abc123"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(client.return_value.wait_for_response.call_args[0][0]
+                         .data["trace_id"], "abc123")
+        self.assertIn("test.response", result.output)
+        self.assertIn("2.00", result.output)
+        self.assertIn("3.50", result.output)
+
+    @patch("neon_enclosure.__main__.start_service")
+    def test_bench(self, start_service):
+        import json
+        from neon_enclosure.benchmark import BenchmarkService, \
+            make_synthetic_plugin
+        from neon_enclosure.cli import bench
+
+        def _start_service(standalone, bus, config):
+            self.assertFalse(config["state_snapshots"])
+            service = BenchmarkService({"one": make_synthetic_plugin(1),
+                                        "two": make_synthetic_plugin(2)},
+                                       bus=bus, config=config)
+            service.start()
+            return service
+        start_service.side_effect = _start_service
+
+        result = self.runner.invoke(bench, ["--local", "-t", "0.5", "-c", "2",
+                                            "--timeout", "0.5"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("bench.plugin1.request", result.output)
+        self.assertIn("bench.plugin2.request", result.output)
+        self.assertIn("dropped replies: 0 ", result.output)
+
+        result = self.runner.invoke(bench, ["--local", "-t", "0.5", "--json",
+                                            "-p", "one", "--rate", "20"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        results = json.loads(result.output.split("\n", 1)[1])
+        self.assertEqual(list(results["by_type"].keys()),
+                         ["bench.plugin1.request"])
+        self.assertLessEqual(results["sent"], 12)
+
+        # Message types without replies are dropped
+        result = self.runner.invoke(bench, ["--local", "-t", "0.3", "--json",
+                                            "--timeout", "0.1",
+                                            "-m", "test.no_reply"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        results = json.loads(result.output.split("\n", 1)[1])
+        self.assertEqual(results["dropped"], results["sent"])
+
+    @patch("neon_enclosure.discovery.write_plugin_manifest")
+    def test_write_manifest(self, write_manifest):
+        from neon_enclosure.cli import write_manifest as cmd
+        write_manifest.return_value = {"plugins": {"ovos.plugin.phal":
+                                                   {"test": "test:Plugin"}}}
+        result = self.runner.invoke(cmd, ["--path", "/tmp/manifest.json"])
+        write_manifest.assert_called_once_with("/tmp/manifest.json")
+        self.assertIn("ovos.plugin.phal: test", result.output)
+
 
 if __name__ == '__main__':
     unittest.main()